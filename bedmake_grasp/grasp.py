@@ -11,6 +11,8 @@ import custom_transforms as CT
 import argparse, copy, cv2, os, sys, pickle, time
 import numpy as np
 from os.path import join
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+import cpu_ddp
 
 # ------------------------------------------------------------------------------
 # Local data directory, from `prepare_data.py`.
@@ -34,13 +36,21 @@ if not os.path.exists(TMPDIR2):
 MEAN = [0.37468, 0.37468, 0.37468]
 STD  = [0.33259, 0.33259, 0.33259]
 
-# Pre-trained models
-resnet18 = models.resnet18(pretrained=True)
-resnet34 = models.resnet34(pretrained=True)
-resnet50 = models.resnet50(pretrained=True)
 # ------------------------------------------------------------------------------
 
 
+def get_pretrained(name):
+    """Pre-trained models. Built on demand, so importing this file is cheap."""
+    if name == 'resnet18':
+        return models.resnet18(pretrained=True)
+    elif name == 'resnet34':
+        return models.resnet34(pretrained=True)
+    elif name == 'resnet50':
+        return models.resnet50(pretrained=True)
+    else:
+        raise ValueError(name)
+
+
 def _save_images(inputs, labels, outputs, loss, phase):
     """Debugging the data transformations, labels, etc.
 
@@ -131,7 +141,8 @@ def _save_viz(sample, idx):
     cv2.imwrite(fname, img)
 
 
-def train(model, args):
+def get_datasets():
+    """The (train, valid) `GraspDataset`s, with their transforms."""
     # To debug transformation(s), pick any one to run, get images, and save.
     transforms_train = transforms.Compose([
         CT.Rescale((256,256)),
@@ -149,6 +160,11 @@ def train(model, args):
 
     gdata_t = GraspDataset(infodir=DATA_TRAIN_INFO, transform=transforms_train)
     gdata_v = GraspDataset(infodir=DATA_VALID_INFO, transform=transforms_valid)
+    return gdata_t, gdata_v
+
+
+def train(model, args):
+    gdata_t, gdata_v = get_datasets()
 
     # Can debug here, but only works if we didn't call `ToTensor()` (+normalize).
     #for i in range(20):
@@ -166,13 +182,39 @@ def train(model, args):
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     print("\nNow training!! On device: {}".format(device))
     print("dataset_sizes: {}\n".format(dataset_sizes))
+    model, stats = fit(model, dataloaders, dataset_sizes, device, args)
+
+    # Can make predictions on one minibatch just to confirm.
+    print("\nChecking performance on one validation set minibatch:")
+    criterion = nn.MSELoss()
+    model.eval()
+    for minibatch in dataloaders['valid']:
+        inputs = (minibatch['image']).to(device)
+        labels = (minibatch['target']).to(device)
+        with torch.set_grad_enabled(False):
+            outputs = model(inputs)
+            loss = criterion(outputs, labels.float())
+        _save_images(inputs, labels, outputs, loss, phase='valid')
+        break
+
+    return model
+
 
+def fit(model, dataloaders, dataset_sizes, device, args):
+    """The training loop, given `dataloaders` and sizes for 'train' and 'valid'.
+
+    Returns the model with the best validation weights loaded, and a dict with
+    the best losses and the per-epoch losses. Also used by `kfold.py`.
+    """
     # Get things setup. Since ResNet has 1000 outputs, we need to adjust the
     # last layer to only give two outputs (since I'm doing classification).
     # And as usual, don't forget to add it to your correct device!!
     num_penultimate_layer = model.fc.in_features
     model.fc = nn.Linear(num_penultimate_layer, 2)
     model = model.to(device)
+    if cpu_ddp.is_distributed():
+        # With `--ranks`, average gradients over processes, see `ddp_main`.
+        model = nn.parallel.DistributedDataParallel(model)
 
     # Loss function & optimizer
     criterion = nn.MSELoss()
@@ -194,8 +236,12 @@ def train(model, args):
     all_valid = []
 
     for epoch in range(args.num_epochs):
-        print('\nEpoch {}/{}'.format(epoch, args.num_epochs-1))
-        print('-' * 20)
+        if cpu_ddp.is_main():
+            print('\nEpoch {}/{}'.format(epoch, args.num_epochs-1))
+            print('-' * 20)
+        sampler = getattr(dataloaders['train'], 'sampler', None)
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
 
         # Each epoch has a training and validation phase.
         # Epochs automatically tracked via the for loop over `dataloaders`.
@@ -207,6 +253,7 @@ def train(model, args):
 
             running_loss     = 0.0
             running_loss_pix = 0.0
+            num_examples     = 0
 
             # Iterate over data and labels (minibatches), by default, one epoch.
             for minibatch in dataloaders[phase]:
@@ -238,13 +285,22 @@ def train(model, args):
 
                 running_loss += loss.item() * inputs.size(0)
                 running_loss_pix += L2_pix * inputs.size(0)
+                num_examples += inputs.size(0)
+
+            # We summed (not averaged) the losses earlier, so divide by full
+            # size. With `--ranks`, each rank only saw its shard, so sum first;
+            # then all ranks agree on the losses (and the best weights).
+            if cpu_ddp.is_distributed():
+                running_loss, running_loss_pix, num_examples = cpu_ddp.all_reduce_sum(
+                        [running_loss, running_loss_pix, num_examples])
+            else:
+                num_examples = dataset_sizes[phase]
+            epoch_loss = running_loss / float(num_examples)
+            epoch_loss_pix = running_loss_pix / float(num_examples)
 
-            # We summed (not averaged) the losses earlier, so divide by full size.
-            epoch_loss = running_loss / float(dataset_sizes[phase])
-            epoch_loss_pix = running_loss_pix / float(dataset_sizes[phase])
-
-            print('({})  Loss: {:.4f}, LossPix: {:.4f}'.format(
-                    phase, epoch_loss, epoch_loss_pix))
+            if cpu_ddp.is_main():
+                print('({})  Loss: {:.4f}, LossPix: {:.4f}'.format(
+                        phase, epoch_loss, epoch_loss_pix))
             if phase == 'train':
                 all_train.append(round(epoch_loss,4))
             else:
@@ -257,28 +313,48 @@ def train(model, args):
                 best_model_wts = copy.deepcopy(model.state_dict())
 
     time_elapsed = time.time() - since
-    print('\nTrained in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
-    print('Best epoch losses: {:4f}  (pix: {:.4f})'.format(best_loss, best_loss_pix))
-    print('train:  {}'.format(all_train))
-    print('valid:  {}'.format(all_valid))
+    if cpu_ddp.is_main():
+        print('\nTrained in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
+        print('Best epoch losses: {:4f}  (pix: {:.4f})'.format(best_loss, best_loss_pix))
+        print('train:  {}'.format(all_train))
+        print('valid:  {}'.format(all_valid))
 
     # Load best model weights
     model.load_state_dict(best_model_wts)
+    if cpu_ddp.is_distributed():
+        model = model.module
+    stats = {
+        'best_loss':     best_loss,
+        'best_loss_pix': best_loss_pix,
+        'train':         all_train,
+        'valid':         all_valid,
+    }
+    return model, stats
 
-    # Can make predictions on one minibatch just to confirm.
-    print("\nChecking performance on one validation set minibatch:")
-    model.eval()
-    for minibatch in dataloaders['valid']:
-        inputs = (minibatch['image']).to(device)
-        labels = (minibatch['target']).to(device)
-        optimizer.zero_grad()
-        with torch.set_grad_enabled(False):
-            outputs = model(inputs)
-            loss = criterion(outputs, labels.float())
-        _save_images(inputs, labels, outputs, loss, phase='valid')
-        break
 
-    return model
+def ddp_main(rank, world_size, args):
+    """One of the `--ranks` processes, see `../torch/cpu_ddp.py`. CPU only.
+
+    Each rank loads its shard of every epoch with `32 / ranks` images per
+    minibatch (same effective batch size) and fewer loader workers, since the
+    ranks share the cores. Only rank 0 prints and saves the model.
+    """
+    gdata_t, gdata_v = get_datasets()
+    bs = max(1, 32 // world_size)
+    workers = max(1, 8 // world_size)
+    dataloaders = {
+        'train': cpu_ddp.distributed_loader(gdata_t, bs, num_workers=workers),
+        'valid': cpu_ddp.distributed_loader(gdata_v, bs, shuffle=False, num_workers=workers),
+    }
+    dataset_sizes = {'train': len(gdata_t), 'valid': len(gdata_v)}
+    if cpu_ddp.is_main():
+        print("\nNow training!! On {} CPU ranks".format(world_size))
+        print("dataset_sizes: {}\n".format(dataset_sizes))
+    torch.manual_seed(0)
+    model, stats = fit(get_pretrained(args.model), dataloaders, dataset_sizes,
+                       torch.device("cpu"), args)
+    if cpu_ddp.is_main() and args.save is not None:
+        torch.save(model.state_dict(), args.save)
 
 
 if __name__ == "__main__":
@@ -286,15 +362,19 @@ if __name__ == "__main__":
     pp.add_argument('--model', type=str, default='resnet18')
     pp.add_argument('--optim', type=str, default='adam')
     pp.add_argument('--num_epochs', type=int, default=20)
+    # Data-parallel over this many CPU processes, see `../torch/cpu_ddp.py`.
+    pp.add_argument('--ranks', type=int, default=1)
+    pp.add_argument('--threads_per_rank', type=int, default=None)
+    pp.add_argument('--save', type=str, default=None)
     args = pp.parse_args() 
+    if args.ranks > 1:
+        # Fetch the pre-trained weights once here, so the ranks don't race.
+        get_pretrained(args.model)
+        cpu_ddp.launch(ddp_main, args.ranks, args=(args,), threads=args.threads_per_rank)
+        sys.exit()
 
     # Train the ResNet. Then I can do stuff with it ...  I get similar best
     # validation set performance with ResNet-{18,34,50}, fyi.
-    if args.model == 'resnet18':
-        model = train(resnet18, args)
-    elif args.model == 'resnet34':
-        model = train(resnet34, args)
-    elif args.model == 'resnet50':
-        model = train(resnet50, args)
-    else:
-        raise ValueError(args.model)
+    model = train(get_pretrained(args.model), args)
+    if args.save is not None:
+        torch.save(model.state_dict(), args.save)
@@ -0,0 +1,70 @@
+"""K-fold cross validation for `grasp.py` over the `cv_*` folds of the cache.
+
+The grasp cache already comes split into `cv_0` ... `cv_9`, but
+`prepare_data.py` flattens it into one random 80/20 split. Here we hold out each
+fold in turn and train on the others, with the shared-memory driver in
+`../torch/kfold_runner.py`. For example:
+
+    python kfold.py --num_procs 5 --num_epochs 20
+
+Needs the record files from `prepare_data.py` (or `../torch/cache_records.py`).
+"""
+from torch.utils.data import DataLoader
+from torchvision import transforms
+import custom_transforms as CT
+import grasp
+from prepare_data import HEAD_REC
+
+import argparse, os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+from cache_records import list_records, load_shared
+import kfold_runner
+
+
+class SharedGraspDataset(kfold_runner.SharedFrames):
+    """Like `grasp.GraspDataset` but indexes into the shared decoded frames."""
+
+    def sample(self, image, label):
+        sample = {'image': image, 'target': (float(label[0]), float(label[1]))}
+        if self.transform:
+            sample = self.transform(sample)
+        return sample
+
+
+def train_fold(k, frames, labels, indices, device, args):
+    transforms_train = transforms.Compose([
+        CT.Rescale((256,256)),
+        CT.RandomCrop((224,224)),
+        CT.RandomHorizontalFlip(),
+        CT.ToTensor(),
+        CT.Normalize(grasp.MEAN, grasp.STD),
+    ])
+    transforms_valid = transforms.Compose([
+        CT.Rescale((256,256)),
+        CT.CenterCrop((224,224)),
+        CT.ToTensor(),
+        CT.Normalize(grasp.MEAN, grasp.STD),
+    ])
+    gdata_t = SharedGraspDataset(frames, labels, indices['train'], transforms_train)
+    gdata_v = SharedGraspDataset(frames, labels, indices['valid'], transforms_valid)
+    dataloaders = {
+        'train': DataLoader(gdata_t, batch_size=32, shuffle=True, num_workers=args.num_workers),
+        'valid': DataLoader(gdata_v, batch_size=32, shuffle=False, num_workers=args.num_workers),
+    }
+    dataset_sizes = {'train': len(gdata_t), 'valid': len(gdata_v)}
+    _, stats = grasp.fit(grasp.get_pretrained(args.model), dataloaders,
+                         dataset_sizes, device, args)
+    stats['dataset_sizes'] = dataset_sizes
+    return stats
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    kfold_runner.add_args(pp, report='kfold_grasp.json')
+    args = pp.parse_args()
+
+    # Targets are the raw (x,y) grasp points, as in `prepare_data.py`.
+    frames, labels, folds = load_shared(list_records(HEAD_REC),
+            label_fn=lambda item: [item['pose'][0], item['pose'][1]])
+    all_stats = kfold_runner.run_folds(train_fold, frames, labels, folds, args)
+    kfold_runner.report(all_stats, args.report, ['best_loss', 'best_loss_pix'])
@@ -28,11 +28,16 @@ from torchvision import datasets, transforms
 import argparse, copy, cv2, os, sys, pickle, time
 import numpy as np
 from os.path import join
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+from cache_records import convert_dir, iter_records, list_records, num_records, RunningStats
 
 # ------------------------------------------------------------------------------
 # Target is where we re-format the data for PyTorch convenience methods.
 HEAD   = '/nfs/diskstation/seita/bed-make/cache_combo_v03'
 
+# Same data as HEAD, but as record files we can stream. See `../torch/cache_records.py`.
+HEAD_REC = '/nfs/diskstation/seita/bed-make/cache_combo_v03_rec'
+
 # Move locally after data creation! Can get up to 10x speed-up!!
 #TARGET = '/nfs/diskstation/seita/bed-make/cache_combo_v03_pytorch'
 TARGET = 'cache_combo_v03_pytorch'
@@ -65,54 +70,53 @@ def prepare_daniel_data():
     loader_train_dict = []
     loader_valid_dict = []
 
-    # Load the pickle files that I used for the bed-making paper.
-    pickle_files = sorted([join(HEAD,x) for x in os.listdir(HEAD) if x[-4:] == '.pkl'])
-    total_pickles = len(pickle_files)
-
-    # Put all numbers here. For PyTorch we can use one scalar for each of the
-    # mean and std, because we have one scalar here (for our depth images).
-    numbers = []
-
-    for p_idx,p_ff in enumerate(pickle_files):
-        with open(p_ff, 'r') as fh:
-            data = pickle.load(fh)
-            N = len(data)
-            print("Just loaded: {}  (len: {})".format(p_ff, N))
-
-            # Pick validation indices.
-            indx_random = np.random.permutation(N)
-            indx_train  = indx_random[ : int(N*0.8)]
-            indx_valid  = indx_random[int(N*0.8) : ]
-
-            # Each `item` here has a 'd_img' key, and a target key, 'pose'.
-            for idx,item in enumerate(data):
-                if idx in indx_train:
-                    pname = path_train
-                else:
-                    pname = path_valid
-
-                target_str = "{}-{}".format(item['pose'][0], item['pose'][1])
-                target_tuple = (item['pose'][0], item['pose'][1])
-
-                suffix = 'd_{}_{}_{}.png'.format(str(p_idx).zfill(2), 
-                        str(idx).zfill(4), target_str)
-                png_name = join(pname, suffix)
-
-                # Accumulate statistics for mean and std computation across our
-                # lone channel. We made values same across all three channels.
-                d_img = item['d_img']
-                assert d_img.shape == (480,640,3)
-                assert np.sum(d_img[:,:,0]) == np.sum(d_img[:,:,1]) == np.sum(d_img[:,:,2])
-                numbers.extend( d_img[:,:,0].flatten() )
-                cv2.imwrite(png_name, d_img)
-
-                # Don't forget! Add info to our data loaders!!
-                if idx in indx_train:
-                    loader_train_dict.append( (png_name, target_tuple) )
-                    total_train += 1
-                else:
-                    loader_valid_dict.append( (png_name, target_tuple) )
-                    total_valid += 1
+    # Load the record files, converted from the pickles for the bed-making paper.
+    if not os.path.exists(HEAD_REC):
+        convert_dir(HEAD, HEAD_REC)
+    record_files = list_records(HEAD_REC)
+
+    # Mean and std over all pixels. For PyTorch we can use one scalar for each,
+    # because we have one scalar here (for our depth images).
+    stats = RunningStats()
+
+    for p_idx,p_ff in enumerate(record_files):
+        N = num_records(p_ff)
+        print("Just loaded: {}  (len: {})".format(p_ff, N))
+
+        # Pick validation indices.
+        indx_random = np.random.permutation(N)
+        indx_train  = set(indx_random[ : int(N*0.8)])
+
+        # Each `item` here has a 'd_img' key, and a target key, 'pose'. We only
+        # have one item in memory at a time.
+        for idx,item in enumerate(iter_records(p_ff)):
+            if idx in indx_train:
+                pname = path_train
+            else:
+                pname = path_valid
+
+            target_str = "{}-{}".format(item['pose'][0], item['pose'][1])
+            target_tuple = (item['pose'][0], item['pose'][1])
+
+            suffix = 'd_{}_{}_{}.png'.format(str(p_idx).zfill(2), 
+                    str(idx).zfill(4), target_str)
+            png_name = join(pname, suffix)
+
+            # Accumulate statistics for mean and std computation across our
+            # lone channel. We made values same across all three channels.
+            d_img = item['d_img']
+            assert d_img.shape == (480,640,3)
+            assert np.sum(d_img[:,:,0]) == np.sum(d_img[:,:,1]) == np.sum(d_img[:,:,2])
+            stats.update(d_img[:,:,0])
+            cv2.imwrite(png_name, d_img)
+
+            # Don't forget! Add info to our data loaders!!
+            if idx in indx_train:
+                loader_train_dict.append( (png_name, target_tuple) )
+                total_train += 1
+            else:
+                loader_valid_dict.append( (png_name, target_tuple) )
+                total_valid += 1
 
     assert len(loader_train_dict) == total_train
     assert len(loader_valid_dict) == total_valid
@@ -124,13 +128,12 @@ def prepare_daniel_data():
 
     print("done loading data, train {} & valid {} (total {})".format(
             total_train, total_valid, total_train+total_valid))
-    numbers = np.array(numbers)
-    print("len(numbers):  {}  (has single-channel mean/std info)".format(len(numbers)))
-    print("mean(numbers): {}".format(np.mean(numbers)))
-    print("std(numbers):  {}".format(np.std(numbers)))
+    print("len(numbers):  {}  (has single-channel mean/std info)".format(stats.n))
+    print("mean(numbers): {}".format(stats.mean()))
+    print("std(numbers):  {}".format(stats.std()))
     print("\nBut, use this for actual mean/std because we want them in [0,256) ...")
-    print("mean(scaled): {}".format(np.mean(numbers/255.0)))
-    print("std(scaled):  {}".format(np.std(numbers/255.0)))
+    print("mean(scaled): {}".format(stats.mean(scale=255.0)))
+    print("std(scaled):  {}".format(stats.std(scale=255.0)))
 
 
 if __name__ == "__main__":
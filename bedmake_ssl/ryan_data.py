@@ -34,6 +34,12 @@ if not os.path.exists(TMPDIR2):
 MEAN = [0.41979732, 0.40260704, 0.4141044 ]
 STD  = [0.43067302, 0.44038301, 0.44804261]
 
+# Raw image size, then what we use in `transforms_valid`, for pixel-space L2s.
+ORIG_HW = (480,640)
+RESCALE = (256,256)
+CROP    = (224,224)
+NUM_ANG = 4
+
 # Pre-trained models
 resnet18 = models.resnet18(pretrained=True)
 resnet34 = models.resnet34(pretrained=True)
@@ -48,7 +54,7 @@ WHITE = (255,255,255)
 
 
 def _save_images(imgs_t, imgs_tp1, labels_pos, labels_ang, out_pos, 
-                 out_ang, ang_predict, loss, phase='valid'):
+                 out_ang, ang_predict, loss, phase='valid', start=0):
     """Debugging the data transforms, labels, net predictions, etc.
  
     OpenCV can't save if you use floats. You need: `img = img.astype(int)`.
@@ -64,6 +70,10 @@ def _save_images(imgs_t, imgs_tp1, labels_pos, labels_ang, out_pos,
     B = imgs_t.shape[0]
     imgs_t   = imgs_t.cpu().numpy()
     imgs_tp1 = imgs_tp1.cpu().numpy()
+    labels_pos  = labels_pos.cpu().numpy()
+    labels_ang  = labels_ang.cpu().numpy()
+    out_pos     = out_pos.cpu().numpy()
+    ang_predict = ang_predict.cpu().numpy()
 
     # Iterate through all (data-augmented) images in minibatch and save.
     for b in range(B):
@@ -126,7 +136,7 @@ def _save_images(imgs_t, imgs_tp1, labels_pos, labels_ang, out_pos,
         elif pred_ang == 3:
             pred_offset = [0, 50]
         else:
-            raise ValueError(target_ang)
+            raise ValueError(pred_ang)
 
         # Draw both target direction and predicted direction
         targ_goal = (targ_pos_int[0] + targ_offset[0], targ_pos_int[1] + targ_offset[1])
@@ -146,11 +156,9 @@ def _save_images(imgs_t, imgs_tp1, labels_pos, labels_ang, out_pos,
         hstack = np.concatenate((img, img_tp1), axis=1)
 
         # Inspect!
-        fname = '{}/{}_{}_{:.0f}.png'.format(TMPDIR2, phase, str(b).zfill(4), L2_pix)
+        fname = '{}/{}_{}_{:.0f}.png'.format(TMPDIR2, phase, str(start+b).zfill(4), L2_pix)
         cv2.imwrite(fname, hstack)
 
-    print("Just finished saving validation images! Look at: {}".format(TMPDIR2))
-
 
 def _log(phase, ep_loss, ep_loss_pos, ep_loss_ang, ep_correct_ang):
     """For logging."""
@@ -161,6 +169,85 @@ def _log(phase, ep_loss, ep_loss_pos, ep_loss_ang, ep_correct_ang):
     print("correct_ang: {:.4f}".format(ep_correct_ang))
 
 
+def _to_original_pixels(pos):
+    """Map (B,2) positions in [0,1] of the validation input back to (480,640).
+
+    Validation uses Rescale((256,256)) then CenterCrop((224,224)), so undo the
+    crop offset and then the resizing. Training uses a random crop, so this
+    only makes sense for the validation set.
+    """
+    left = int((RESCALE[1] - CROP[1]) / 2.0)
+    top  = int((RESCALE[0] - CROP[0]) / 2.0)
+    x = (pos[:,0] * CROP[1] + left) * (ORIG_HW[1] / float(RESCALE[1]))
+    y = (pos[:,1] * CROP[0] + top)  * (ORIG_HW[0] / float(RESCALE[0]))
+    return torch.stack((x,y), dim=1)
+
+
+def evaluate(policy, dataloader, device, args, viz=False):
+    """One no-grad pass over all of `dataloader`, returning dataset-level stats.
+
+    Everything is accumulated as tensors on `device` and only moved to the host
+    at the end, so we don't sync with `.item()` on every minibatch. The angle
+    confusion matrix has rows as targets and columns as predictions, with the
+    usual 0,90,180,270 class ordering. Set `viz=True` to also save overlays of
+    predictions and targets in `TMPDIR2`, which is slow.
+    """
+    assert args.model_type == 1, args.model_type
+    policy.eval()
+    sq_err_pos = torch.zeros(1, device=device)
+    l2_pix     = torch.zeros(1, device=device)
+    confusion  = torch.zeros(NUM_ANG*NUM_ANG, dtype=torch.long, device=device)
+    num_items  = 0
+
+    with torch.no_grad():
+        for mb in dataloader:
+            imgs_t     = (mb['img_t']).to(device)      # (B,3,224,224)
+            imgs_tp1   = (mb['img_tp1']).to(device)    # (B,3,224,224)
+            labels     = (mb['label']).to(device)      # (B,3)
+            labels_pos = labels[:,:2].float()          # (B,2)
+            labels_ang = labels[:,2].long()            # (B,)
+
+            out_pos, out_ang = policy(imgs_t, imgs_tp1)
+            _, ang_predict = torch.max(out_ang, dim=1)
+
+            # Summed, not averaged, so we divide by the full size at the end.
+            sq_err_pos += ((out_pos - labels_pos) ** 2).sum()
+            diff = _to_original_pixels(out_pos) - _to_original_pixels(labels_pos)
+            l2_pix += torch.norm(diff, dim=1).sum()
+            confusion += torch.bincount(labels_ang*NUM_ANG + ang_predict,
+                                        minlength=NUM_ANG*NUM_ANG)
+
+            if viz:
+                _save_images(imgs_t, imgs_tp1, labels_pos, labels_ang, out_pos,
+                             out_ang, ang_predict, None, phase='valid',
+                             start=num_items)
+            num_items += imgs_t.size(0)
+
+    # Only now do we move things to the host.
+    N = float(num_items)
+    confusion = confusion.view(NUM_ANG, NUM_ANG).cpu().numpy()
+    stats = {
+        'num_items':  num_items,
+        'mse_pos':    sq_err_pos.item() / (2.0 * N), # same as nn.MSELoss()
+        'l2_pix':     l2_pix.item() / N,
+        'confusion':  confusion,
+        'acc_ang':    np.trace(confusion) / N,
+    }
+    if viz:
+        print("Just finished saving validation images! Look at: {}".format(TMPDIR2))
+    return stats
+
+
+def _log_eval(stats):
+    """For logging the output of `evaluate`."""
+    print("  (valid, {} items)".format(stats['num_items']))
+    print("mse_pos:     {:.4f}".format(stats['mse_pos']))
+    print("l2_pix:      {:.2f}  (on (480,640) images)".format(stats['l2_pix']))
+    print("correct_ang: {:.4f}".format(stats['acc_ang']))
+    print("confusion (rows: targets, cols: predictions):\n{}".format(
+            stats['confusion']))
+
+
 def train(model, args):
     # To debug transformation(s), pick any one to run, get images, and save.
     transforms_train = transforms.Compose([
@@ -171,8 +258,8 @@ def train(model, args):
         CT.Normalize(MEAN, STD),
     ])
     transforms_valid = transforms.Compose([
-        CT.Rescale((256,256)),
-        CT.CenterCrop((224,224)),
+        CT.Rescale(RESCALE),
+        CT.CenterCrop(CROP),
         CT.ToTensor(),
         CT.Normalize(MEAN, STD),
     ])
@@ -307,29 +394,9 @@ def train(model, args):
 
     # Load best model weights, make predictions on validatoin to confirm
     model.load_state_dict(best_model_wts)
-    model.eval()
-    print("\nVisualizing performance of best model on validation set:")
-
-    for minibatch in dataloaders['valid']:
-        imgs_t     = (mb['img_t']).to(device)
-        imgs_tp1   = (mb['img_tp1']).to(device)
-        labels     = (mb['label']).to(device)
-        labels_pos = labels[:,:2].float()
-        labels_ang = torch.squeeze(labels[:,2:].long())
-
-        optimizer.zero_grad()
-        with torch.set_grad_enabled(False):
-            out_pos, out_ang = policy(imgs_t, imgs_tp1)
-            _, ang_predict = torch.max(out_ang, dim=1)
-            correct_ang = (ang_predict == labels_ang).sum().item()
-
-            loss_pos = criterion_mse(out_pos, labels_pos)
-            loss_ang = criterion_cent(out_ang, labels_ang)
-            loss = (lambda1 * loss_pos) + (lambda2 * loss_ang)
-            print("  {} / {} angle accuracy".format(correct_ang, imgs_t.size(0)))
-
-            _save_images(imgs_t, imgs_tp1, labels_pos, labels_ang, out_pos, 
-                         out_ang, ang_predict, loss, phase='valid')
+    print("\nEvaluating best model on the full validation set:")
+    stats = evaluate(policy, dataloaders['valid'], device, args, viz=args.viz)
+    _log_eval(stats)
 
     return model, all_train, all_valid
 
@@ -341,6 +408,8 @@ if __name__ == "__main__":
     pp.add_argument('--num_epochs', type=int, default=30)
     # Rely on several options for the loss type. See README for details.
     pp.add_argument('--model_type', type=int, default=1)
+    # Save prediction overlays for the validation set after training (slow).
+    pp.add_argument('--viz', action='store_true', default=False)
     args = pp.parse_args() 
 
     # Train the ResNet. Then I can do stuff with it ...  I get similar best
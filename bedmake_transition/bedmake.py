@@ -19,28 +19,47 @@ from torchvision import datasets, transforms
 import argparse, copy, cv2, os, sys, pickle, time
 import numpy as np
 from os.path import join
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+from classifier_eval import ConfusionMatrix
+from shards import folder_to_shards, ShardedImageDataset
+from cache_records import convert_dir, iter_records, list_records, num_records, RunningStats
 
 # Target is where we re-format the data for PyTorch convenience methods.
 # In the `cache` files, I already processed the depth images.
 HEAD   = '/nfs/diskstation/seita/bed-make/cache_combo_v03_success'
 
+# Same data as HEAD, but as record files we can stream. See `../torch/cache_records.py`.
+HEAD_REC = '/nfs/diskstation/seita/bed-make/cache_combo_v03_success_rec'
+
 # Move locally after data creation! With 10 epochs, I get an 8x speed-up: 4min -> 30sec.
 #TARGET = '/nfs/diskstation/seita/bed-make/cache_combo_v03_success_pytorch'
 TARGET = 'cache_combo_v03_success_pytorch'
 
+# Or, pack TARGET into large tar shards with `prepare_shards()`, which we can
+# stream sequentially from NFS without a local copy. Use `--shards` to train.
+SHARDS = '/nfs/diskstation/seita/bed-make/cache_combo_v03_success_shards'
+
 TMPDIR = 'tmp/'
 
 # From `prepare_raw_data`. Remember, we really have three channels.
 MEAN = [0.36605, 0.36605, 0.36605]
 STD  = [0.33208, 0.33208, 0.33208]
 
-# Pre-trained models
-resnet18 = models.resnet18(pretrained=True)
-resnet34 = models.resnet34(pretrained=True)
-resnet50 = models.resnet50(pretrained=True)
 # ------------------------------------------------------------------------------
 
 
+def get_pretrained(name):
+    """Pre-trained models. Built on demand, so importing this file is cheap."""
+    if name == 'resnet18':
+        return models.resnet18(pretrained=True)
+    elif name == 'resnet34':
+        return models.resnet34(pretrained=True)
+    elif name == 'resnet50':
+        return models.resnet50(pretrained=True)
+    else:
+        raise ValueError(name)
+
+
 def prepare_raw_data():
     """Create the appropriate data for PyTorch. Sources:
 
@@ -64,60 +83,68 @@ def prepare_raw_data():
     t_success = 0
     t_failure = 0
 
-    pickle_files = sorted([join(HEAD,x) for x in os.listdir(HEAD) if x[-4:] == '.pkl'])
-    total_pickles = len(pickle_files)
-
-    # Put all numbers here. For PyTorch we can use one scalar for each of the
-    # mean and std, because we have one scalar here (for our depth images).
-    numbers = []
-
-    for p_idx,p_ff in enumerate(pickle_files):
-        with open(p_ff, 'r') as fh:
-            data = pickle.load(fh)
-            N = len(data)
-            print("Just loaded: {}  (len: {})".format(p_ff, N))
-
-            # Pick validation indices.
-            indx_random = np.random.permutation(N)
-            indx_train  = indx_random[ : int(N*0.8)]
-            indx_valid  = indx_random[int(N*0.8) : ]
-
-            # Each `item` here has a 'd_img' key, and a class label 'class' key.
-            for idx,item in enumerate(data):
-                if idx in indx_train:
-                    pname = path_train
-                else:
-                    pname = path_valid
-
-                if item['class'] == 0:
-                    png_name = join(pname, 'success', 
-                            'd_{}_{}.png'.format(str(p_idx).zfill(2), str(idx).zfill(4)))
-                    t_success += 1
-                elif item['class'] == 1:
-                    png_name = join(pname, 'failure',
-                            'd_{}_{}.png'.format(str(p_idx).zfill(2), str(idx).zfill(4)))
-                    t_failure += 1
-                else:
-                    raise ValueError(item['class'])
-
-                # Accumulate statistics for mean and std computation across our
-                # lone channel. We made values same across all three channels.
-                d_img = item['d_img']
-                assert d_img.shape == (480,640,3)
-                assert np.sum(d_img[:,:,0]) == np.sum(d_img[:,:,1]) == np.sum(d_img[:,:,2])
-                numbers.extend( d_img[:,:,0].flatten() )
-                cv2.imwrite(png_name, d_img)
+    if not os.path.exists(HEAD_REC):
+        convert_dir(HEAD, HEAD_REC)
+    record_files = list_records(HEAD_REC)
+
+    # Mean and std over all pixels. For PyTorch we can use one scalar for each,
+    # because we have one scalar here (for our depth images).
+    stats = RunningStats()
+
+    for p_idx,p_ff in enumerate(record_files):
+        N = num_records(p_ff)
+        print("Just loaded: {}  (len: {})".format(p_ff, N))
+
+        # Pick validation indices.
+        indx_random = np.random.permutation(N)
+        indx_train  = set(indx_random[ : int(N*0.8)])
+
+        # Each `item` here has a 'd_img' key, and a class label 'class' key.
+        # We only have one item in memory at a time.
+        for idx,item in enumerate(iter_records(p_ff)):
+            if idx in indx_train:
+                pname = path_train
+            else:
+                pname = path_valid
+
+            if item['class'] == 0:
+                png_name = join(pname, 'success', 
+                        'd_{}_{}.png'.format(str(p_idx).zfill(2), str(idx).zfill(4)))
+                t_success += 1
+            elif item['class'] == 1:
+                png_name = join(pname, 'failure',
+                        'd_{}_{}.png'.format(str(p_idx).zfill(2), str(idx).zfill(4)))
+                t_failure += 1
+            else:
+                raise ValueError(item['class'])
+
+            # Accumulate statistics for mean and std computation across our
+            # lone channel. We made values same across all three channels.
+            d_img = item['d_img']
+            assert d_img.shape == (480,640,3)
+            assert np.sum(d_img[:,:,0]) == np.sum(d_img[:,:,1]) == np.sum(d_img[:,:,2])
+            stats.update(d_img[:,:,0])
+            cv2.imwrite(png_name, d_img)
         print("  so far, success {} vs failure {}".format(t_success, t_failure))
 
     print("done loading data, success {} vs failure {} (total {})".format(
             t_success, t_failure, t_success+t_failure))
-    numbers = np.array(numbers)
-    print("len(numbers):  {}  (has the single-channel mean/std info)".format(len(numbers)))
-    print("mean(numbers): {}".format(np.mean(numbers)))
-    print("std(numbers):  {}".format(np.std(numbers)))
+    print("len(numbers):  {}  (has the single-channel mean/std info)".format(stats.n))
+    print("mean(numbers): {}".format(stats.mean()))
+    print("std(numbers):  {}".format(stats.std()))
     print("\nBut, use this for actual mean/std because we want them in [0,256) ...")
-    print("mean(scaled): {}".format(np.mean(numbers/255.0)))
-    print("std(scaled):  {}".format(np.std(numbers/255.0)))
+    print("mean(scaled): {}".format(stats.mean(scale=255.0)))
+    print("std(scaled):  {}".format(stats.std(scale=255.0)))
+
+
+def prepare_shards(shard_size=200):
+    """Pack the `ImageFolder` layout from `prepare_raw_data()` into shards.
+
+    Call once after `prepare_raw_data()`. Keeps the same train/valid split and
+    class indices. See `shards.py` for the format.
+    """
+    for x in ['train', 'valid']:
+        folder_to_shards(join(TARGET,x), join(SHARDS,x), shard_size=shard_size)
 
 
 def _save_images(inputs, labels, phase):
@@ -173,8 +200,9 @@ def _save_images(inputs, labels, phase):
         cv2.imwrite(fname, img)
 
 
-def train(model, args):
-    data_transforms = {
+def get_transforms():
+    """Data augmentation for 'train', and the usual resize + crop for 'valid'."""
+    return {
         'train': transforms.Compose([
             transforms.RandomResizedCrop(224, scale=(0.8, 1.0)),
             transforms.RandomHorizontalFlip(),
@@ -188,15 +216,27 @@ def train(model, args):
             transforms.Normalize(MEAN, STD)
         ]),
     }
-    
+
+
+def train(model, args):
+    data_transforms = get_transforms()
+
     # So, ImageFolder (within the `train/` and `valid/`) requires images to be
     # stored within sub-directories based on their labels. Also, I wonder, maybe
     # better to drop the last batch for the DataLoader?
-    image_datasets = {x: datasets.ImageFolder(join(TARGET,x), data_transforms[x]) 
-                        for x in ['train', 'valid']}
-    dataloaders    = {x: torch.utils.data.DataLoader(image_datasets[x],
-                        batch_size=32, shuffle=True, num_workers=4)
-                          for x in ['train', 'valid']}
+    if args.shards:
+        # The shard datasets shuffle themselves, so no `shuffle` for the loader.
+        image_datasets = {x: ShardedImageDataset(join(SHARDS,x), data_transforms[x],
+                            shuffle=(x == 'train')) for x in ['train', 'valid']}
+        dataloaders    = {x: torch.utils.data.DataLoader(image_datasets[x],
+                            batch_size=32, num_workers=4)
+                              for x in ['train', 'valid']}
+    else:
+        image_datasets = {x: datasets.ImageFolder(join(TARGET,x), data_transforms[x]) 
+                            for x in ['train', 'valid']}
+        dataloaders    = {x: torch.utils.data.DataLoader(image_datasets[x],
+                            batch_size=32, shuffle=True, num_workers=4)
+                              for x in ['train', 'valid']}
     dataset_sizes  = {x: len(image_datasets[x]) for x in ['train', 'valid']}
     class_names    = image_datasets['train'].classes
 
@@ -205,7 +245,16 @@ def train(model, args):
     print("\nNow training!! On device: {}".format(device))
     print("class_names: {}".format(class_names))
     print("dataset_sizes: {}\n".format(dataset_sizes))
+    model, stats = fit(model, dataloaders, dataset_sizes, device, args)
+    return model
+
 
+def fit(model, dataloaders, dataset_sizes, device, args):
+    """The training loop, given `dataloaders` and sizes for 'train' and 'valid'.
+
+    Returns the model with the best validation weights loaded, and a dict with
+    the best accuracy and the per-epoch accuracies. Also used by `kfold.py`.
+    """
     # Get things setup. Since ResNet has 1000 outputs, we need to adjust the
     # last layer to only give two outputs (since I'm doing classification).
     # And as usual, don't forget to add it to your correct device!!
@@ -246,8 +295,7 @@ def train(model, args):
             else:
                 model.eval()   # Set model to evaluate mode
 
-            running_loss = 0.0
-            running_corrects = 0
+            meter = ConfusionMatrix(num_classes=2, device=device)
 
             # Iterate over data and labels (minibatches), by default, for one
             # epoch. Data augmentation happens here on the fly. :-)
@@ -263,7 +311,6 @@ def train(model, args):
                 # forward: track (gradient?) history _only_ if training
                 with torch.set_grad_enabled(phase == 'train'):
                     outputs = model(inputs)             # forward pass
-                    _, preds = torch.max(outputs, 1)    # returns (max vals, indices)
                     loss = criterion(outputs, labels)
 
                     # backward + optimize only if in training phase
@@ -271,18 +318,19 @@ def train(model, args):
                         loss.backward()
                         optimizer.step()
 
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
+                # Summed (not averaged) loss; stays on the device, no `.item()`.
+                meter.update(outputs.detach(), labels, loss.detach() * inputs.size(0))
 
-            # We summed (not averaged) the losses earlier, so divide by full size.
-            epoch_loss = running_loss / dataset_sizes[phase]
-            epoch_acc = running_corrects.double() / dataset_sizes[phase]
-            print('({})  Loss: {:.4f}, Acc: {:.4f} (num: {})'.format(
-                    phase, epoch_loss, epoch_acc, running_corrects))
+            # One copy to the CPU per phase, see `classifier_eval.py`.
+            results = meter.results()
+            epoch_loss, epoch_acc = results['loss'], results['accuracy']
+            print('({})  Loss: {:.4f}, Acc: {:.4f} (num: {}), per class: {}'.format(
+                    phase, epoch_loss, epoch_acc, int(results['confusion'].diag().sum()),
+                    ' '.join('{:.3f}'.format(a) for a in results['per_class'])))
             if phase == 'train':
-                all_train.append(round(epoch_acc.item(),3))
+                all_train.append(round(epoch_acc,3))
             else:
-                all_valid.append(round(epoch_acc.item(),3))
+                all_valid.append(round(epoch_acc,3))
 
             # deep copy the model, use `state_dict()`.
             if phase == 'valid' and epoch_acc > best_acc:
@@ -297,27 +345,28 @@ def train(model, args):
 
     # load best model weights
     model.load_state_dict(best_model_wts)
-    return model
+    stats = {
+        'best_acc':  float(best_acc),
+        'train':     all_train,
+        'valid':     all_valid,
+    }
+    return model, stats
 
 
 if __name__ == "__main__":
     # We only need to call this ONCE, then we can comment out since it creates
     # the data in the format we need for `ImageLoader`.
     #prepare_raw_data()
+    #prepare_shards()
 
     pp = argparse.ArgumentParser()
     pp.add_argument('--optim', type=str)
     pp.add_argument('--model', type=str)
     pp.add_argument('--num_epochs', type=int, default=20)
+    # Stream from the tar shards in SHARDS instead of ImageFolder on TARGET.
+    pp.add_argument('--shards', action='store_true', default=False)
     args = pp.parse_args() 
 
     # Train the ResNet. Then I can do stuff with it ...  I get similar best
     # validation set performance with ResNet-{18,34,50}, fyi.
-    if args.model == 'resnet18':
-        model = train(resnet18, args)
-    elif args.model == 'resnet34':
-        model = train(resnet34, args)
-    elif args.model == 'resnet50':
-        model = train(resnet50, args)
-    else:
-        raise ValueError(args.model)
+    model = train(get_pretrained(args.model), args)
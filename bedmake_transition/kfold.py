@@ -0,0 +1,57 @@
+"""K-fold cross validation for `bedmake.py`, one fold per cache file.
+
+Same idea as `bedmake_grasp/kfold.py`: instead of one random 80/20 split, hold
+out each cache file (fold) in turn and train on the rest, with the
+shared-memory driver in `../torch/kfold_runner.py`. For example:
+
+    python kfold.py --optim adam --model resnet18 --num_procs 5
+
+Needs the record files from `prepare_raw_data()` (or `../torch/cache_records.py`).
+"""
+from torch.utils.data import DataLoader
+import bedmake
+
+import argparse, os, sys
+from PIL import Image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+from cache_records import list_records, load_shared
+import kfold_runner
+
+# Same as `ImageFolder` on 'failure' and 'success' directories, i.e., sorted.
+CLASS_NAMES = ['failure', 'success']
+
+
+class SharedImageDataset(kfold_runner.SharedFrames):
+    """Like `ImageFolder` on TARGET, but indexes into the shared decoded frames."""
+
+    def sample(self, image, label):
+        img = Image.fromarray(image)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, int(label[0])
+
+
+def train_fold(k, frames, labels, indices, device, args):
+    data_transforms = bedmake.get_transforms()
+    image_datasets = {x: SharedImageDataset(frames, labels, indices[x], data_transforms[x])
+                        for x in ['train', 'valid']}
+    dataloaders    = {x: DataLoader(image_datasets[x], batch_size=32, shuffle=True,
+                        num_workers=args.num_workers) for x in ['train', 'valid']}
+    dataset_sizes  = {x: len(image_datasets[x]) for x in ['train', 'valid']}
+    _, stats = bedmake.fit(bedmake.get_pretrained(args.model), dataloaders,
+                           dataset_sizes, device, args)
+    stats['dataset_sizes'] = dataset_sizes
+    stats['last_acc'] = stats['valid'][-1]
+    return stats
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    kfold_runner.add_args(pp, report='kfold_bedmake.json')
+    args = pp.parse_args()
+
+    # In the cache, class 0 is success and 1 is failure; flip to CLASS_NAMES.
+    frames, labels, folds = load_shared(list_records(bedmake.HEAD_REC),
+            label_fn=lambda item: [1 - item['class']])
+    all_stats = kfold_runner.run_folds(train_fold, frames, labels, folds, args)
+    kfold_runner.report(all_stats, args.report, ['best_acc', 'last_acc'])
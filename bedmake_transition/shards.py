@@ -0,0 +1,172 @@
+"""Sharded storage for the success/failure classifier, so we can read over NFS.
+
+`ImageFolder` does one small random read per image, which is why we had to copy
+the data locally to get reasonable speed. Here we pack the same images into a
+handful of large tar files (shards) and stream them sequentially. Each sample
+is stored as two tar members with the same key, like webdataset does:
+
+    success_d_00_0001.png   the raw PNG bytes (no re-encoding)
+    success_d_00_0001.cls   the class index as ASCII, e.g., b'1'
+
+Each split directory also has a `shards.json` with the class names, which use
+the same (sorted) ordering as `ImageFolder`, so labels do not change, plus the
+number of samples per shard so that `len()` still works.
+"""
+import torch
+from torch.utils.data import IterableDataset
+import io, json, os, random, sys, tarfile, time
+from os.path import join
+from PIL import Image
+
+META = 'shards.json'
+
+
+def _add_bytes(tar, name, data):
+    """Add `data` (bytes) as a tar member called `name`."""
+    info = tarfile.TarInfo(name=name)
+    info.size = len(data)
+    info.mtime = time.time()
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(samples, out_dir, classes, shard_size=200):
+    """Write `samples`, an iterable of (key, png_bytes, label), into shards.
+
+    Samples are written in the order they come, so shuffle beforehand if the
+    source is sorted by class (e.g., an `ImageFolder` directory). Returns the
+    metadata dict, which we also save in `out_dir`.
+    """
+    assert not os.path.exists(out_dir), "target directory exists:\n\t{}".format(out_dir)
+    os.makedirs(out_dir)
+    meta = {'classes': classes, 'shards': [], 'sizes': []}
+    tar = None
+
+    for idx,(key,png,label) in enumerate(samples):
+        if idx % shard_size == 0:
+            if tar is not None:
+                tar.close()
+            name = 'shard_{}.tar'.format(str(len(meta['shards'])).zfill(4))
+            tar = tarfile.open(join(out_dir,name), 'w')
+            meta['shards'].append(name)
+            meta['sizes'].append(0)
+        _add_bytes(tar, '{}.png'.format(key), png)
+        _add_bytes(tar, '{}.cls'.format(key), str(int(label)).encode('ascii'))
+        meta['sizes'][-1] += 1
+    if tar is not None:
+        tar.close()
+
+    with open(join(out_dir,META), 'w') as fh:
+        json.dump(meta, fh, indent=2)
+    print("wrote {} samples in {} shards to: {}".format(
+            sum(meta['sizes']), len(meta['shards']), out_dir))
+    return meta
+
+
+def folder_to_shards(folder, out_dir, shard_size=200):
+    """Convert one `ImageFolder`-style split (e.g., `TARGET/train`) to shards.
+
+    We keep the PNG bytes as is, so the decoded images are identical.
+    """
+    classes = sorted([x for x in os.listdir(folder) if os.path.isdir(join(folder,x))])
+    items = []
+    for label,cname in enumerate(classes):
+        for fname in sorted(os.listdir(join(folder,cname))):
+            if fname[-4:] == '.png':
+                items.append((label, join(folder,cname,fname)))
+    random.shuffle(items)
+
+    def _samples():
+        for label,path in items:
+            key = '{}_{}'.format(classes[label], os.path.basename(path)[:-4])
+            with open(path, 'rb') as fh:
+                yield key, fh.read(), label
+
+    return write_shards(_samples(), out_dir, classes, shard_size=shard_size)
+
+
+class ShardedImageDataset(IterableDataset):
+    """Stream (image, label) pairs from shards, as a drop-in for `ImageFolder`.
+
+    Shards are read front to back, one at a time, so reads are large and
+    sequential. With `shuffle=True` we shuffle the shard order every epoch and
+    mix samples in a buffer of `buffer_size` items, which approximates a full
+    shuffle when shards hold several classes. Use `shuffle=False` in the
+    `DataLoader` since the dataset handles it. With several workers, each one
+    reads a disjoint subset of the shards.
+
+    Images are decoded to RGB PIL images, as `ImageFolder` does, so the usual
+    torchvision transforms work unchanged.
+    """
+
+    def __init__(self, shard_dir, transform=None, shuffle=True, buffer_size=500):
+        self.shard_dir = shard_dir
+        with open(join(shard_dir,META), 'r') as fh:
+            self.meta = json.load(fh)
+        self.classes = self.meta['classes']
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.epoch = 0
+
+    def __len__(self):
+        return sum(self.meta['sizes'])
+
+    def _seeds(self):
+        """Returns (shard order seed, buffer seed) for this pass over the data.
+
+        In workers, PyTorch draws a new `base_seed` each epoch and gives worker
+        `i` the seed `base_seed + i`, so all workers agree on the shard order
+        but use different buffers. In the main process we just count epochs.
+        """
+        info = torch.utils.data.get_worker_info()
+        if info is None:
+            self.epoch += 1
+            return self.epoch, self.epoch
+        return info.seed - info.id, info.seed
+
+    def _my_shards(self, seed):
+        shards = list(self.meta['shards'])
+        if self.shuffle:
+            random.Random(seed).shuffle(shards)
+        info = torch.utils.data.get_worker_info()
+        if info is not None:
+            shards = shards[info.id :: info.num_workers]
+        return shards
+
+    def _read_shard(self, name):
+        """Yield (png_bytes, label) in the order they appear in the tar."""
+        pending = {}
+        with tarfile.open(join(self.shard_dir,name), 'r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                key, ext = os.path.splitext(member.name)
+                pending.setdefault(key, {})[ext] = tar.extractfile(member).read()
+                if len(pending[key]) == 2:
+                    item = pending.pop(key)
+                    yield item['.png'], int(item['.cls'])
+        assert len(pending) == 0, "incomplete samples in {}".format(name)
+
+    def _decode(self, png, label):
+        img = Image.open(io.BytesIO(png)).convert('RGB')
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, label
+
+    def __iter__(self):
+        shard_seed, buf_seed = self._seeds()
+        rng = random.Random(buf_seed)
+        buf = []
+        for name in self._my_shards(shard_seed):
+            for png,label in self._read_shard(name):
+                if not self.shuffle:
+                    yield self._decode(png, label)
+                    continue
+                buf.append((png,label))
+                if len(buf) >= self.buffer_size:
+                    idx = rng.randint(0, len(buf)-1)
+                    buf[idx], buf[-1] = buf[-1], buf[idx]
+                    yield self._decode(*buf.pop())
+        rng.shuffle(buf)
+        for png,label in buf:
+            yield self._decode(png, label)
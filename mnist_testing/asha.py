@@ -0,0 +1,211 @@
+"""
+Asynchronous successive halving (ASHA) over the `sweep.py` grids.
+
+Instead of running every config for 300 epochs, each trial (one lrate and wd,
+with all its seeds) first runs to the lowest rung, e.g., 25 epochs. Whenever a
+slot frees up, we promote a trial from rung k to rung k+1 if its mean
+validation error at rung k is in the top 1/`eta` of all trials that finished
+rung k so far; otherwise we start a new trial at the bottom rung. Promoted runs
+resume from their `--ckpt_dir` checkpoint and append to the same logs and
+metrics, so only the extra epochs are trained. Trials that never get promoted
+are stopped early, which is most of them.
+
+    python asha.py --sweep sgd_coarse --rungs 25,50,100,300 --eta 3 --threads 2
+
+Logs and `.jsonl` metrics go to the usual paths, so `plot_coarse.py` and
+`results_store.py` read them as before (stopped trials just have fewer
+epochs). Checkpoints go to `<log dir>/ckpt/<log name>/`, outside the logs.
+"""
+import argparse, os, shutil, subprocess, sys, threading, time
+from collections import OrderedDict
+import numpy as np
+from metrics_io import read_metrics
+from sweep import SWEEPS, get_configs, get_slots, fmt_time
+
+
+class Trial:
+
+    def __init__(self, name, configs):
+        self.name = name
+        self.configs = configs      # [(log path, mnist_fc.py args)], one per seed
+        self.started = set()        # rungs started
+        self.scores = {}            # rung -> mean validation error over seeds
+        self.pending = 0            # seeds still running for the current rung
+        self.failed = False
+
+
+def get_trials(configs):
+    """ Group the per-seed configs by everything before `-seed-`. """
+    trials = OrderedDict()
+    for path, cmd in configs:
+        name = os.path.basename(path).split('-seed-')[0]
+        trials.setdefault(name, []).append((path, cmd))
+    return [Trial(name, c) for name, c in trials.items()]
+
+
+def score(path, epoch, metric):
+    """ `metric` at `epoch` from a run's metrics stream. """
+    _, arrays = read_metrics(path + '.jsonl')
+    idx = np.where(arrays['epoch'] == epoch)[0]
+    assert len(idx) == 1, "{} has no epoch {}".format(path, epoch)
+    return float(arrays[metric][idx[0]])
+
+
+class ASHA:
+
+    def __init__(self, trials, rungs, eta, slots, extra_args, metric='valid_err_s',
+                 python=sys.executable):
+        self.trials = trials
+        self.waiting = list(trials)
+        self.rungs = rungs
+        self.eta = eta
+        self.slots = slots
+        self.extra_args = extra_args
+        self.metric = metric
+        self.python = python
+        self.cond = threading.Condition()
+        self.jobs = []          # (trial, rung, path, cmd), ready to run
+        self.running = 0
+        self.epochs_run = 0
+        self.start = None
+
+    def _promotable(self):
+        """ A trial in the top 1/eta at some rung, not yet promoted, highest
+        rung first. Failed trials score infinity, so never get promoted. """
+        for k in reversed(range(len(self.rungs) - 1)):
+            done = [t for t in self.trials if k in t.scores]
+            ranked = sorted(done, key=lambda t: t.scores[k])
+            for t in ranked[ : len(done) // self.eta]:
+                if (k+1) not in t.started and not t.failed:
+                    return t, k+1
+        return None, None
+
+    def _decide(self):
+        trial, rung = self._promotable()
+        if trial is None and self.waiting:
+            trial, rung = self.waiting.pop(0), 0
+        if trial is None:
+            return False
+        trial.started.add(rung)
+        trial.pending = len(trial.configs)
+        for path, cmd in trial.configs:
+            self.jobs.append((trial, rung, path, cmd))
+        if rung > 0:
+            print("promoting {} to rung {} ({} epochs), score {:.3f}".format(trial.name,
+                    rung, self.rungs[rung], trial.scores[rung-1]))
+        return True
+
+    def _next_job(self):
+        with self.cond:
+            while True:
+                if self.jobs:
+                    self.running += 1
+                    return self.jobs.pop(0)
+                if self._decide():
+                    continue
+                if self.running == 0:
+                    self.cond.notify_all()
+                    return None
+                self.cond.wait()
+
+    def _run_one(self, rung, path, cmd, cores):
+        ckpt_dir = os.path.join(os.path.dirname(path), 'ckpt', os.path.basename(path))
+        if rung == 0 and os.path.exists(ckpt_dir):
+            shutil.rmtree(ckpt_dir)  # stale, from an earlier sweep
+        full = [self.python, 'mnist_fc.py'] + cmd + self.extra_args + \
+               ['--num_epochs', str(self.rungs[rung]), '--ckpt_dir', ckpt_dir,
+                '--num_threads', str(len(cores)), '--metrics', path + '.jsonl']
+        def pin():
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cores)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'a' if rung > 0 else 'w') as f:
+            return subprocess.call(full, stdout=f, stderr=subprocess.STDOUT, preexec_fn=pin)
+
+    def _worker(self, cores):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            trial, rung, path, cmd = job
+            code = self._run_one(rung, path, cmd, cores)
+            with self.cond:
+                self.running -= 1
+                self.epochs_run += self.rungs[rung] - (self.rungs[rung-1] if rung > 0 else 0)
+                trial.pending -= 1
+                if code != 0:
+                    print("FAILED ({}): {}".format(code, path))
+                    trial.failed = True
+                if trial.pending == 0:
+                    self._finish_rung(trial, rung)
+                self.cond.notify_all()
+
+    def _finish_rung(self, trial, rung):
+        epoch = self.rungs[rung] - 1
+        trial.scores[rung] = np.inf
+        if not trial.failed:
+            try:
+                trial.scores[rung] = np.mean([score(p, epoch, self.metric)
+                                              for p,_ in trial.configs])
+            except (AssertionError, IOError, KeyError) as e:
+                print("no score for {}: {}".format(trial.name, e))
+                trial.failed = True
+        full = len(self.trials) * len(self.trials[0].configs) * self.rungs[-1]
+        print("[{}] {} rung {} ({} epochs): {} {:.3f} | {}/{} seed-epochs so far ({:.1f}%)".format(
+                fmt_time(time.time() - self.start), trial.name, rung, self.rungs[rung],
+                self.metric, trial.scores[rung], self.epochs_run, full,
+                100.0 * self.epochs_run / full))
+        sys.stdout.flush()
+
+    def run(self):
+        self.start = time.time()
+        threads = [threading.Thread(target=self._worker, args=(cores,)) for cores in self.slots]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.report()
+
+    def report(self):
+        full = len(self.trials) * len(self.trials[0].configs) * self.rungs[-1]
+        print("\nfinished in {}, {} seed-epochs instead of {} ({:.1f}x less)".format(
+                fmt_time(time.time() - self.start), self.epochs_run, full,
+                full / float(max(self.epochs_run, 1))))
+        print("rung reached, {} per rung:".format(self.metric))
+        top = len(self.rungs) - 1
+        def highest_rung_first(t):
+            k = max(t.scores) if t.scores else -1
+            return (-k, t.scores.get(k, np.inf))
+        for t in sorted(self.trials, key=highest_rung_first):
+            scores = ' '.join('{:.3f}'.format(t.scores[k]) for k in sorted(t.scores))
+            done = '*' if top in t.scores else ' '
+            print("  {} {} {}".format(done, t.name, scores))
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--sweep', type=str, required=True, choices=sorted(SWEEPS.keys()))
+    pp.add_argument('--rungs', type=str, default='25,50,100,300')
+    # Keep the top 1/eta at each rung.
+    pp.add_argument('--eta', type=int, default=3)
+    pp.add_argument('--metric', type=str, default='valid_err_s')
+    pp.add_argument('--threads', type=int, default=1)
+    pp.add_argument('--num_slots', type=int, default=None)
+    pp.add_argument('--fc_size', type=int, default=400)
+    pp.add_argument('--data_dir', type=str, default='/tmp/tensorflow/mnist/input_data')
+    # Anything else is passed on to `mnist_fc.py`.
+    args, extra = pp.parse_known_args()
+
+    rungs = [int(x) for x in args.rungs.split(',')]
+    assert rungs == sorted(rungs) and len(rungs) >= 2
+    trials = get_trials(get_configs(SWEEPS[args.sweep], fc_size=args.fc_size))
+    slots = get_slots(args.num_slots, args.threads)
+    print("ASHA on {}: {} trials x {} seeds, rungs {}, eta {}, {} slots".format(
+            args.sweep, len(trials), len(trials[0].configs), rungs, args.eta, len(slots)))
+    # Download and convert MNIST once here, so jobs don't race to do it, and
+    # all of them memory-map the same `.npy` files.
+    import mnist_cache
+    mnist_cache.read_data_sets(args.data_dir, one_hot=True)
+    extra += ['--data_dir', args.data_dir]
+    ASHA(trials, rungs, args.eta, slots, extra, metric=args.metric).run()
@@ -0,0 +1,84 @@
+"""
+Shuffled minibatches that live in the graph, instead of `next_batch` feeds.
+
+With `next_batch`, every training step gathers a minibatch in numpy and copies
+it into the graph through `feed_dict`. For small networks like ours that copy
+(and the Python around it) is a good chunk of the step. Here the training
+arrays are copied into (non-trainable) variables ONCE, and the minibatch is a
+`tf.gather` on a permutation that is also a variable, so a step needs no feeds
+at all. The permutation is reshuffled in the graph at the start of each epoch.
+
+    batches = GraphBatches(mnist.train.images, mnist.train.labels, 100)
+    x = tf.placeholder_with_default(batches.images, [None, 784])
+    y = tf.placeholder_with_default(batches.labels, [None, 10])
+    ...
+    train_step = batches.advance_after(optimizer.minimize(loss))
+    sess.run(tf.global_variables_initializer())
+    batches.initialize(sess)
+    sess.run(train_step)                        # trains on the next minibatch
+    sess.run(accuracy, {x: images, y: labels})  # feeding still works as before
+
+Running anything that reads `images` or `labels` WITHOUT `advance_after` just
+looks at the current minibatch, e.g., the training accuracy on the batch we're
+about to train on, like the tutorials print. As with `next_batch` in our
+training loops, an epoch is `num_examples // batch_size` minibatches; the rest
+are skipped until the next shuffle.
+
+The variables aren't in any collection, so `tf.train.Saver` doesn't save the
+data with the weights. The shuffles use the graph-level seed.
+"""
+import numpy as np
+import tensorflow as tf
+
+
+class GraphBatches:
+
+    def __init__(self, images, labels, batch_size, shuffle=True, name='graph_batches'):
+        """ With uint8 `images`, they're stored as bytes (4x less memory) and
+        scaled to [0,1] float32 in the graph, same values as `read_data_sets`. """
+        self._arrays = (images, labels)
+        self.num_examples = images.shape[0]
+        self.batch_size = batch_size
+        self.steps_per_epoch = self.num_examples // batch_size
+        self.shuffle = shuffle
+        assert self.steps_per_epoch > 0, "batch size larger than the data"
+
+        with tf.name_scope(name):
+            self._images_ph = tf.placeholder(tf.as_dtype(images.dtype), images.shape)
+            self._labels_ph = tf.placeholder(tf.as_dtype(labels.dtype), labels.shape)
+            self._images = tf.Variable(self._images_ph, trainable=False,
+                                       collections=[], name='images')
+            self._labels = tf.Variable(self._labels_ph, trainable=False,
+                                       collections=[], name='labels')
+            self._perm = tf.Variable(self._order(), trainable=False, collections=[], name='perm')
+            self._step = tf.Variable(0, trainable=False, collections=[], name='step')
+
+            start = self._step * batch_size
+            idx = self._perm[start : start + batch_size]
+            self.images = tf.gather(self._images, idx)
+            self.labels = tf.gather(self._labels, idx)
+            if images.dtype == np.uint8:
+                self.images = tf.cast(self.images, tf.float32) * (1.0 / 255.0)
+
+    def _order(self):
+        order = tf.range(self.num_examples)
+        return tf.random_shuffle(order) if self.shuffle else order
+
+    def initialize(self, sess):
+        """ Copy the data into the graph, the only time it gets fed. """
+        variables = [self._images, self._labels, self._perm, self._step]
+        images, labels = self._arrays
+        sess.run([v.initializer for v in variables],
+                 {self._images_ph: images, self._labels_ph: labels})
+
+    def advance_after(self, op):
+        """ An op that runs `op` and THEN moves on to the next minibatch,
+        reshuffling when an epoch ends. `op` is what reads the minibatch, so
+        the control dependency makes sure we don't move before it's read. """
+        with tf.name_scope('advance'):
+            with tf.control_dependencies([op]):
+                step = tf.assign(self._step, tf.mod(self._step + 1, self.steps_per_epoch))
+            reshuffle = tf.cond(tf.equal(step, 0),
+                                lambda: tf.assign(self._perm, self._order()),
+                                lambda: tf.identity(self._perm))
+            return tf.group(op, reshuffle)
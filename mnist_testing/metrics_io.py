@@ -0,0 +1,110 @@
+"""
+Machine-readable metrics from `mnist_fc.py`, so nothing has to parse the table.
+
+With `--metrics run.jsonl`, `mnist_fc.py` writes a JSON-lines stream: first a
+header with the full run config, then one record per evaluated epoch. Records
+are buffered and flushed every `flush_every` epochs (and at the end), so we
+don't hit the disk every epoch. The file is append-only, so a crashed run still
+leaves every flushed epoch readable.
+
+    {"type": "config", "config": {"lrate": 0.1, ...}}
+    {"type": "epoch", "epoch": 0, "time": 3.1, "l2_loss_v": 0.0, ...}
+
+`read_metrics` gives back the config and a dict of NumPy arrays, one entry per
+field, e.g., `arrays['valid_err_s']` is (E,), or (E,K) with K replicas.
+"""
+import json, time
+import numpy as np
+
+# Same order as the columns of the printed table.
+METRICS = ['epoch', 'l2_loss_v', 'ce_loss_v', 'valid_err_s', 'valid_err_m',
+           'test_err_s', 'test_err_m']
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class MetricsWriter:
+
+    def __init__(self, path, config, flush_every=10, append=False):
+        """ With `append`, e.g., when resuming, keep earlier records. """
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer = []
+        self.start = time.time()
+        self.f = open(path, 'a' if append else 'w')
+        self.f.write(json.dumps({'type': 'config', 'config': config}) + '\n')
+        self.f.flush()
+
+    def write(self, epoch, **metrics):
+        record = {'type': 'epoch', 'epoch': epoch, 'time': time.time() - self.start}
+        for key,value in metrics.items():
+            record[key] = _to_json(value)
+        self.buffer.append(json.dumps(record))
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.f.write('\n'.join(self.buffer) + '\n')
+            self.f.flush()
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_metrics(path):
+    """ Returns (config, arrays): the run config as a dict, and one NumPy
+    array per record field, with epochs along the first axis. A truncated
+    line (from a crash mid-write) is skipped. If a resumed run wrote an
+    epoch again, the later record wins; the config is the latest one. """
+    config = None
+    records = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('type') == 'config':
+                config = record['config']
+            else:
+                records[record['epoch']] = record
+    records = [records[ep] for ep in sorted(records)]
+    arrays = {}
+    if records:
+        for key in records[0]:
+            if key != 'type':
+                arrays[key] = np.array([r[key] for r in records])
+    return config, arrays
+
+
+def num_replicas(arrays):
+    """ K for a `--num_replicas K` stream, where metrics are (E,K), else 1. """
+    values = np.asarray(arrays.get('valid_err_s', []))
+    return values.shape[1] if values.ndim == 2 else 1
+
+
+def as_table(arrays, replica=None):
+    """ The (E,7) table `results_store.parse_log` would give, for one run.
+    For a stream with K > 1 replicas, pick one with `replica`; without it, we
+    raise a ValueError rather than guess which. """
+    if 'epoch' not in arrays:
+        return np.zeros((0, len(METRICS)))
+    K = num_replicas(arrays)
+    if K > 1 and replica is None:
+        raise ValueError("metrics have {} replicas, pick one with `replica`".format(K))
+    columns = []
+    for k in METRICS:
+        values = np.asarray(arrays[k], dtype=np.float64)
+        columns.append(values[:, replica] if values.ndim == 2 else values)
+    return np.stack(columns, axis=1)
@@ -0,0 +1,158 @@
+"""
+MNIST as `.npy` files, memory-mapped read-only, instead of `read_data_sets`.
+
+Each `input_data.read_data_sets` call gunzips and parses the IDX files and
+builds its own float32 copy of the 55k x 784 training images, which takes
+seconds and ~200MB per process. With a sweep running dozens of processes, that
+adds up. Here we convert ONCE to `.npy` files (uint8 and float32 images, uint8
+labels) and then `np.load(..., mmap_mode='r')` them: loading is instant, and
+all processes share the same page-cached copy. `next_batch` only copies the
+minibatch it returns.
+
+Drop-in for the tutorials' `input_data.read_data_sets`, same splits, same
+float32 values (uint8 / 255), and `next_batch` with the same shuffling:
+
+    import mnist_cache
+    mnist = mnist_cache.read_data_sets('/tmp/tensorflow/mnist/input_data', one_hot=True)
+
+From another directory, add this one to `sys.path` first, relative to the
+script so it runs from anywhere, e.g.,
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mnist_testing'))
+
+To convert ahead of time:
+
+    python mnist_cache.py --data_dir /tmp/tensorflow/mnist/input_data
+"""
+import argparse, collections, os, tempfile
+import numpy as np
+
+SPLITS = ['train', 'validation', 'test']
+Datasets = collections.namedtuple('Datasets', SPLITS)
+
+
+def _cache_dir(data_dir, validation_size):
+    return os.path.join(data_dir, 'npy-valid-{}'.format(validation_size))
+
+
+def _save(path, array):
+    """ Write to our own temp file, then rename, so other processes never see
+    a partial file. Several sweep jobs may convert at once; whichever renames
+    last wins, and all of them wrote the same bytes. """
+    if os.path.exists(path):
+        return
+    fd, tmp = tempfile.mkstemp(suffix='.tmp.npy', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def convert(data_dir, validation_size=5000):
+    """ Read (and download, if needed) the IDX files once, save `.npy` files. """
+    from tensorflow.examples.tutorials.mnist import input_data
+    from tensorflow.python.framework import dtypes
+    out_dir = _cache_dir(data_dir, validation_size)
+    os.makedirs(out_dir, exist_ok=True)
+    # With uint8 `dtype`, the images are NOT rescaled, so we get the raw bytes.
+    raw = input_data.read_data_sets(data_dir, one_hot=False, dtype=dtypes.uint8,
+                                    validation_size=validation_size)
+    for split in SPLITS:
+        data = getattr(raw, split)
+        images = data.images.astype(np.uint8)
+        # Same arithmetic as `DataSet`, so values match bit for bit.
+        images_f32 = np.multiply(images.astype(np.float32), 1.0 / 255.0)
+        _save(os.path.join(out_dir, '{}_images_u8.npy'.format(split)), images)
+        _save(os.path.join(out_dir, '{}_images_f32.npy'.format(split)), images_f32)
+        _save(os.path.join(out_dir, '{}_labels.npy'.format(split)), data.labels.astype(np.uint8))
+    print("saved MNIST .npy files to {}".format(out_dir))
+    return out_dir
+
+
+class MemmapDataSet:
+    """ Same interface as the tutorials' `DataSet`, over read-only arrays.
+
+    The original shuffles by permuting its arrays in place; ours are read-only
+    and shared, so we keep a permutation of indices instead.
+    """
+
+    def __init__(self, images, labels, one_hot=False, num_classes=10):
+        self._images = images
+        if one_hot:
+            self._labels = np.eye(num_classes, dtype=np.float32)[labels]
+        else:
+            self._labels = np.asarray(labels)
+        self._num_examples = images.shape[0]
+        self._order = np.arange(self._num_examples)
+        self._epochs_completed = 0
+        self._index_in_epoch = 0
+
+    @property
+    def images(self):
+        return self._images
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def num_examples(self):
+        return self._num_examples
+
+    @property
+    def epochs_completed(self):
+        return self._epochs_completed
+
+    def next_batch(self, batch_size, fake_data=False, shuffle=True):
+        """ Same order of operations as `DataSet.next_batch`. """
+        assert not fake_data, "use input_data.read_data_sets for fake data"
+        start = self._index_in_epoch
+        if self._epochs_completed == 0 and start == 0 and shuffle:
+            np.random.shuffle(self._order)
+        if start + batch_size > self._num_examples:
+            self._epochs_completed += 1
+            # A copy: the shuffle below permutes `_order` in place.
+            rest = self._order[start:].copy()
+            if shuffle:
+                np.random.shuffle(self._order)
+            self._index_in_epoch = batch_size - len(rest)
+            idx = np.concatenate((rest, self._order[:self._index_in_epoch]))
+        else:
+            self._index_in_epoch += batch_size
+            idx = self._order[start:self._index_in_epoch]
+        return self._images[idx], self._labels[idx]
+
+
+def read_data_sets(train_dir, fake_data=False, one_hot=False, dtype='float32',
+                   reshape=True, validation_size=5000):
+    """ Like `input_data.read_data_sets`, converting on the first call.
+
+    `dtype` is 'float32' (in [0,1], like the original) or 'uint8' (raw). With
+    `reshape=False`, images are (N,28,28,1) views of the same memory.
+    """
+    if fake_data:
+        from tensorflow.examples.tutorials.mnist import input_data
+        return input_data.read_data_sets(train_dir, fake_data=True, one_hot=one_hot)
+    cache = _cache_dir(train_dir, validation_size)
+    suffix = {'float32': 'f32', 'uint8': 'u8'}[np.dtype(dtype).name]
+    if not os.path.exists(os.path.join(cache, 'test_labels.npy')):
+        convert(train_dir, validation_size)
+    splits = []
+    for split in SPLITS:
+        images = np.load(os.path.join(cache, '{}_images_{}.npy'.format(split, suffix)), mmap_mode='r')
+        labels = np.load(os.path.join(cache, '{}_labels.npy'.format(split)))
+        if not reshape:
+            images = images.reshape((-1, 28, 28, 1))
+        splits.append(MemmapDataSet(images, labels, one_hot=one_hot))
+    return Datasets(*splits)
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--data_dir', type=str, default='/tmp/tensorflow/mnist/input_data')
+    pp.add_argument('--validation_size', type=int, default=5000)
+    args = pp.parse_args()
+    convert(args.data_dir, args.validation_size)
@@ -1,15 +1,26 @@
-import argparse, random, sys
-from tensorflow.examples.tutorials.mnist import input_data
+import argparse, os, pickle, random, sys, threading
+import mnist_cache
 import tensorflow as tf
+from graph_batches import GraphBatches
 import numpy as np
+from metrics_io import METRICS, MetricsWriter
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
 
-def get_tf_session(gpumem):
-    """ Returning a session. Set options here if desired. """
+def get_tf_session(gpumem, num_threads=0):
+    """ Returning a session. Set options here if desired.
+
+    With `num_threads=0`, TF picks the thread counts. The sweep runner sets it
+    to the number of cores each job is pinned to.
+    """
     tf.reset_default_graph()
-    tf_config = tf.ConfigProto(inter_op_parallelism_threads=1,
-                               intra_op_parallelism_threads=1)
     gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=gpumem)
-    session = tf.Session(config=tf.ConfigProto(gpu_options=gpu_options))
+    tf_config = tf.ConfigProto(inter_op_parallelism_threads=num_threads,
+                               intra_op_parallelism_threads=num_threads,
+                               gpu_options=gpu_options)
+    session = tf.Session(config=tf_config)
     def get_available_gpus():
         from tensorflow.python.client import device_lib
         local_device_protos = device_lib.list_local_devices()
@@ -48,20 +59,182 @@ class Evaluator:
         return 100 * (1 - (num_correct / float(self.num_labels)))
 
 
+class AsyncEval:
+    """ Evaluate weight snapshots in a second graph + session, on a thread.
+
+    The second graph has the same network (built by the classifier's own
+    `make_*` methods, so variables come in the same order) and the same stats.
+    `submit` grabs all weights (and shadow weights, with `--model_avg`) in ONE
+    `sess.run` and queues them; training continues right away. The thread
+    evaluates snapshots in the order submitted, so lines are logged in epoch
+    order. TF releases the GIL inside `sess.run`, so the two overlap. The queue
+    is bounded, so if eval is slower than training, training waits.
+    """
+
+    def __init__(self, classifier, max_pending=2):
+        self.c = classifier
+        args = classifier.args
+        self.shadows = getattr(classifier, 'shadows', [])
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.x = tf.placeholder(tf.float32, [None, 784])
+            self.y = tf.placeholder(tf.float32, [None, 10])
+            if args.num_replicas > 1:
+                logits = classifier.make_ff_replicas(self.x)
+                y = tf.tile(tf.expand_dims(self.y, 0), [args.num_replicas, 1, 1])
+                axes = [1, 2]
+            else:
+                logits = classifier.make_network(self.x)
+                y = self.y
+                axes = None
+            variables = tf.trainable_variables()
+            assert len(variables) == len(classifier.variables)
+            # Along the last axis, so these are (K,) with replicas, else scalars.
+            cross_entropy = tf.reduce_mean(
+                tf.nn.softmax_cross_entropy_with_logits(labels=y, logits=logits), axis=-1)
+            l2_loss = args.l2_reg * \
+                    tf.add_n([ tf.reduce_sum(tf.square(v), axis=axes) / 2.0
+                               for v in variables if 'bias' not in v.name ])
+            correct = tf.equal(tf.argmax(logits, -1), tf.argmax(y, -1))
+            self.accuracy = tf.reduce_mean(tf.cast(correct, tf.float32), axis=-1)
+            self.stats = {
+                'accuracy': self.accuracy,
+                'cross_entropy': cross_entropy,
+                'l2_loss': l2_loss,
+            }
+            if args.model_avg == 'softmax':
+                self.stats['y_softmax'] = tf.nn.softmax(logits)
+            self.phs = [tf.placeholder(v.dtype.base_dtype, v.get_shape()) for v in variables]
+            self.assign_op = tf.group(*[tf.assign(v, ph) for v,ph in zip(variables, self.phs)])
+        self.graph.finalize()
+        self.sess = tf.Session(graph=self.graph)
+        mnist = classifier.mnist
+        self.feed_valid = {self.x: mnist.validation.images, self.y: mnist.validation.labels}
+        self.feed_test = {self.x: mnist.test.images, self.y: mnist.test.labels}
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, ep):
+        if self.error is not None:
+            raise self.error
+        n = len(self.c.variables)
+        values = self.c.sess.run(self.c.variables + self.shadows)
+        self.queue.put((ep, values[:n], values[n:]))
+
+    def _load(self, values):
+        self.sess.run(self.assign_op, {ph: val for ph,val in zip(self.phs, values)})
+
+    def _evaluate(self, ep, values, shadow_values):
+        self._load(values)
+        valid_stats = self.sess.run(self.stats, self.feed_valid)
+        test_stats  = self.sess.run(self.stats, self.feed_test)
+        if len(shadow_values) == 0:
+            valid_err_model, test_err_model = self.c.model_errors(
+                    valid_stats, test_stats, None, None)
+        else:
+            self._load(shadow_values)
+            valid_err_model = 100*(1.0-self.sess.run(self.accuracy, self.feed_valid))
+            test_err_model  = 100*(1.0-self.sess.run(self.accuracy, self.feed_test))
+        self.c.log_epoch(ep, valid_stats, test_stats, valid_err_model, test_err_model)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                self._evaluate(*job)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """ Wait for pending evaluations to finish. """
+        self.queue.put(None)
+        self.thread.join()
+        self.sess.close()
+        if self.error is not None:
+            raise self.error
+
+
 class Classifier:
     """ Only supports MNIST for now! """
 
     def __init__(self, args, sess):
         self.args = args
         self.sess = sess
-        self.mnist = input_data.read_data_sets(args.data_dir, one_hot=True)
+        self.mnist = mnist_cache.read_data_sets(args.data_dir, one_hot=True)
         assert self.mnist.train.labels.shape[0] == args.num_train
         assert self.mnist.validation.labels.shape[0] == args.num_valid
         assert self.mnist.test.labels.shape[0] == args.num_test
 
-        # Placeholders and network output.
-        self.x = tf.placeholder(tf.float32, [None, 784])
-        self.y = tf.placeholder(tf.float32, [None, 10])
+        # Placeholders and network output. With `--graph_batches`, training
+        # minibatches come from the graph by default; evaluation still feeds.
+        self.batches = None
+        if args.graph_batches:
+            assert not args.replica_shuffle, "graph batches have one order for all replicas"
+            self.batches = GraphBatches(self.mnist.train.images, self.mnist.train.labels,
+                                        args.batch_size)
+            self.x = tf.placeholder_with_default(self.batches.images, [None, 784])
+            self.y = tf.placeholder_with_default(self.batches.labels, [None, 10])
+        else:
+            self.x = tf.placeholder(tf.float32, [None, 784])
+            self.y = tf.placeholder(tf.float32, [None, 10])
+        if args.num_replicas > 1:
+            self._build_replicas()
+        else:
+            self._build_single()
+        if self.batches is not None:
+            self.train_step = self.batches.advance_after(self.train_step)
+        self.sess.run(tf.global_variables_initializer())
+        if self.batches is not None:
+            self.batches.initialize(self.sess)
+        self.debug()
+        self.start_epoch = 0
+        if args.ckpt_dir is not None:
+            self.saver = tf.train.Saver(max_to_keep=1)
+            if os.path.exists(os.path.join(args.ckpt_dir, 'state.pkl')):
+                self.restore()
+        self.async_eval = AsyncEval(self) if args.async_eval else None
+        self.logs = []
+        self.metrics = None
+        if args.metrics is not None:
+            self.metrics = MetricsWriter(args.metrics, vars(args), flush_every=args.metrics_flush,
+                                         append=(self.start_epoch > 0))
+
+
+    def save(self, epoch):
+        """ All variables (incl. optimizer slots and shadow weights) and the
+        softmax `Evaluator` state, so a longer run can pick up from `epoch`. """
+        args = self.args
+        if not os.path.exists(args.ckpt_dir):
+            os.makedirs(args.ckpt_dir)
+        self.saver.save(self.sess, os.path.join(args.ckpt_dir, 'model'))
+        state = {'epoch': epoch}
+        if args.model_avg == 'softmax':
+            state['eval_valid'] = self.eval_valid
+            state['eval_test'] = self.eval_test
+        with open(os.path.join(args.ckpt_dir, 'state.pkl'), 'wb') as f:
+            pickle.dump(state, f)
+
+
+    def restore(self):
+        """ Note: the minibatch order restarts, it isn't part of the state. """
+        args = self.args
+        with open(os.path.join(args.ckpt_dir, 'state.pkl'), 'rb') as f:
+            state = pickle.load(f)
+        self.saver.restore(self.sess, os.path.join(args.ckpt_dir, 'model'))
+        self.start_epoch = state['epoch']
+        if args.model_avg == 'softmax':
+            self.eval_valid = state['eval_valid']
+            self.eval_test = state['eval_test']
+        print("Resuming from {} at epoch {}".format(args.ckpt_dir, self.start_epoch))
+
+
+    def _build_single(self):
+        args = self.args
         self.y_logits = self.make_network(self.x)
         self.y_softmax = tf.nn.softmax(self.y_logits)
 
@@ -85,10 +258,132 @@ class Classifier:
             'l2_loss': self.l2_loss,
             'y_softmax': self.y_softmax,
         }
-        self.eval_valid = Evaluator(args.burn_in_epochs, self.mnist.validation.labels)
-        self.eval_test  = Evaluator(args.burn_in_epochs, self.mnist.test.labels)
-        self.sess.run(tf.global_variables_initializer())
-        self.debug()
+        if args.model_avg == 'softmax':
+            self.eval_valid = Evaluator(self.burn_in_evals(), self.mnist.validation.labels)
+            self.eval_test  = Evaluator(self.burn_in_evals(), self.mnist.test.labels)
+        else:
+            self._build_weight_averaging()
+
+
+    def burn_in_evals(self):
+        """ `Evaluator` counts calls, so with `--eval_every` > 1, convert. """
+        return int(np.ceil(self.args.burn_in_epochs / float(self.args.eval_every)))
+
+
+    def _build_replicas(self):
+        """ Same as above, but for K = `num_replicas` networks in one graph.
+
+        Each stat gets a leading K axis, e.g., `accuracy` is (K,). The total
+        loss is the SUM of the K replica losses; since replicas share no
+        parameters, each one gets exactly the gradient it would get alone, and
+        all our optimizers are elementwise, so this is K independent runs.
+        With `--replica_shuffle`, training uses `x_rep` and `y_rep`, which hold
+        a different minibatch for each replica.
+        """
+        args = self.args
+        K = args.num_replicas
+        assert args.net_type == 'ff', "replicas only supported for the ff network"
+        self.x_rep = tf.placeholder(tf.float32, [K, None, 784])
+        self.y_rep = tf.placeholder(tf.float32, [K, None, 10])
+        self.y_logits = self.make_ff_replicas(self.x)
+        self.y_softmax = tf.nn.softmax(self.y_logits)
+        y_tiled = tf.tile(tf.expand_dims(self.y, 0), [K, 1, 1])
+
+        def replica_ce(logits, labels):
+            return tf.reduce_mean(
+                tf.nn.softmax_cross_entropy_with_logits(labels=labels, logits=logits), axis=1)
+
+        self.cross_entropy = replica_ce(self.y_logits, y_tiled)
+        self.variables = tf.trainable_variables()
+        self.l2_loss = args.l2_reg * \
+                tf.add_n([ tf.reduce_sum(tf.square(v), axis=[1,2]) / 2.0
+                           for v in self.variables if 'bias' not in v.name ])
+        if args.replica_shuffle:
+            train_ce = replica_ce(self.make_ff_replicas(self.x_rep), self.y_rep)
+        else:
+            train_ce = self.cross_entropy
+        self.loss = tf.reduce_sum(train_ce + self.l2_loss)
+
+        self.optimizer = self.get_optimizer()
+        self.train_step = self.optimizer.minimize(self.loss)
+        self.correct = tf.equal(tf.argmax(self.y_logits, 2), tf.argmax(y_tiled, 2))
+        self.accuracy = tf.reduce_mean(tf.cast(self.correct, tf.float32), axis=1)
+        self.stats = {
+            'accuracy': self.accuracy,
+            'cross_entropy': self.cross_entropy,
+            'l2_loss': self.l2_loss,
+            'y_softmax': self.y_softmax,
+        }
+        if args.model_avg == 'softmax':
+            self.eval_valid = [Evaluator(self.burn_in_evals(), self.mnist.validation.labels)
+                               for _ in range(K)]
+            self.eval_test  = [Evaluator(self.burn_in_evals(), self.mnist.test.labels)
+                               for _ in range(K)]
+        else:
+            self._build_weight_averaging()
+
+
+    def _build_weight_averaging(self):
+        """ Average the WEIGHTS in the graph, instead of softmax outputs in numpy.
+
+        With `--model_avg polyak`, the shadow weights follow the current weights
+        for the first `burn_in_epochs`, then become the uniform average of all
+        weights since, one update per minibatch (like `Evaluator` does per
+        epoch with the softmax). With `--model_avg ema`, they are an
+        exponential moving average with decay `--ema_decay`. Either way the
+        update runs as part of `train_step`, and the "model" error columns are
+        one forward pass with the shadow weights swapped in, so we no longer
+        fetch the (N,10) softmax outputs.
+        """
+        args = self.args
+        train_step = self.train_step
+        if args.model_avg == 'polyak':
+            num_mbs = int(args.num_train / args.batch_size)
+            burn_in = float(args.burn_in_epochs * num_mbs)
+            shadows = [tf.Variable(v.initialized_value(), trainable=False) for v in self.variables]
+            count = tf.Variable(0.0, trainable=False)
+            with tf.control_dependencies([train_step]):
+                count_op = tf.assign_add(count, 1.0)
+                alpha = 1.0 / tf.maximum(count_op - burn_in, 1.0)
+                updates = [tf.assign(s, s * (1.0 - alpha) + alpha * v)
+                           for s,v in zip(shadows, self.variables)]
+                self.train_step = tf.group(*updates)
+        elif args.model_avg == 'ema':
+            ema = tf.train.ExponentialMovingAverage(decay=args.ema_decay)
+            with tf.control_dependencies([train_step]):
+                self.train_step = ema.apply(self.variables)
+            shadows = [ema.average(v) for v in self.variables]
+        else:
+            raise ValueError(args.model_avg)
+        self.shadows = shadows
+
+        # Swap in: back up current weights, then copy the shadows in. Swap out
+        # restores the backup. Only ever run these between training steps.
+        backups = [tf.Variable(v.initialized_value(), trainable=False) for v in self.variables]
+        save_ops = [tf.assign(b, v) for b,v in zip(backups, self.variables)]
+        with tf.control_dependencies(save_ops):
+            self.swap_in = tf.group(*[tf.assign(v, s) for v,s in zip(self.variables, shadows)])
+        self.swap_out = tf.group(*[tf.assign(v, b) for v,b in zip(self.variables, backups)])
+        del self.stats['y_softmax']
+
+
+    def model_errors(self, valid_stats, test_stats, feed_valid, feed_test):
+        """ Returns (valid, test) error in % for the averaged "model".
+
+        For replicas, these are (K,) arrays, one per replica.
+        """
+        if self.args.model_avg == 'softmax':
+            if self.args.num_replicas > 1:
+                K = self.args.num_replicas
+                return (np.array([self.eval_valid[r].eval(valid_stats['y_softmax'][r]) for r in range(K)]),
+                        np.array([self.eval_test[r].eval(test_stats['y_softmax'][r]) for r in range(K)]))
+            return (self.eval_valid.eval(valid_stats['y_softmax']),
+                    self.eval_test.eval(test_stats['y_softmax']))
+        self.sess.run(self.swap_in)
+        acc_valid = self.sess.run(self.accuracy, feed_valid)
+        acc_test  = self.sess.run(self.accuracy, feed_test)
+        self.sess.run(self.swap_out)
+        return 100*(1.0-acc_valid), 100*(1.0-acc_test)
 
 
     def get_optimizer(self):
@@ -134,6 +429,38 @@ class Classifier:
             return x
 
 
+    def make_ff_replicas(self, x):
+        """ K = `num_replicas` independent copies of `make_ff`, as batched matmuls.
+
+        `x` is (N,784) for one minibatch shared by all replicas, or (K,N,784)
+        for one minibatch per replica. Returns (K,N,10) logits. Weights are
+        stacked along a leading K axis and initialized like `Dense` (Glorot
+        uniform kernel, zero bias), independently for each replica. Calling
+        this again reuses the same weights.
+        """
+        K = self.args.num_replicas
+        size = self.args.fc_size
+        sizes = [784, size, size, 10]
+        with tf.variable_scope('ff_replicas', reuse=tf.AUTO_REUSE):
+            for i in range(3):
+                fan_in, fan_out = sizes[i], sizes[i+1]
+                limit = np.sqrt(6.0 / (fan_in + fan_out))
+                with tf.variable_scope('dense_{}'.format(i)):
+                    W = tf.get_variable('kernel', [K, fan_in, fan_out],
+                            initializer=tf.random_uniform_initializer(-limit, limit))
+                    b = tf.get_variable('bias', [K, 1, fan_out],
+                            initializer=tf.zeros_initializer())
+                if len(x.shape) == 2:
+                    # (N,784) x (K,784,size) -> (N,K,size) -> (K,N,size)
+                    x = tf.transpose(tf.tensordot(x, W, axes=[[1],[1]]), [1,0,2])
+                else:
+                    x = tf.matmul(x, W)
+                x = x + b
+                if i < 2:
+                    x = tf.nn.relu(x)
+            return x
+
+
     def make_cnn(self, x):
         x = tf.transpose(tf.reshape(x, [-1, 1, 28, 28]), [0, 2, 3, 1])
         with tf.variable_scope('cnn'):
@@ -157,29 +484,122 @@ class Classifier:
         """
         args = self.args
         mnist = self.mnist
+        if args.num_replicas > 1:
+            return self.train_replicas()
         feed_valid = {self.x: mnist.validation.images, self.y: mnist.validation.labels}
         feed_test = {self.x: mnist.test.images, self.y: mnist.test.labels}
         print('------------------------')
         print("epoch | l2_loss (v) | ce_loss (v) | valid_err (s) | valid_err (m) | test_err (s) | test_err (m)")
 
-        for ep in range(args.num_epochs):
+        for ep in range(self.start_epoch, args.num_epochs):
             num_mbs = int(args.num_train / args.batch_size)
             for _ in range(num_mbs):
+                if self.batches is not None:
+                    self.sess.run(self.train_step)
+                    continue
                 batch = mnist.train.next_batch(args.batch_size)
                 feed = {self.x: batch[0], self.y: batch[1]}
                 self.sess.run(self.train_step, feed)
-            valid_stats = self.sess.run(self.stats, feed_valid)
-            test_stats  = self.sess.run(self.stats, feed_test)
+            self.end_epoch(ep, feed_valid, feed_test)
+        self.finish()
+
+
+    def train_replicas(self):
+        """
+        Train all replicas at once. Each epoch prints one line per replica,
+        with the replica index first. With `--replica_logs`, e.g.,
+        `logs/sgd-tune/fc-400-lrate-0.1-wd-0.0-seed-{}`, replica r ALSO gets its
+        own log in the usual format, as if run alone with seed `seed + r`, so
+        `plot_coarse.py` can read them. Note: the replicas are initialized
+        from one graph-level seed, so these don't match single runs exactly.
+        """
+        args = self.args
+        mnist = self.mnist
+        K = args.num_replicas
+        feed_valid = {self.x: mnist.validation.images, self.y: mnist.validation.labels}
+        feed_test = {self.x: mnist.test.images, self.y: mnist.test.labels}
+        header = "epoch | l2_loss (v) | ce_loss (v) | valid_err (s) | valid_err (m) | test_err (s) | test_err (m)"
+        if args.replica_logs is not None:
+            mode = 'a' if self.start_epoch > 0 else 'w'
+            self.logs = [open(args.replica_logs.format(args.seed + r), mode) for r in range(K)]
+            for f in self.logs:
+                f.write("Our arguments:\n{}\n".format(args))
+                f.write('------------------------\n' + header + '\n')
+        print('------------------------')
+        print("replica | " + header)
+
+        images, labels = mnist.train.images, mnist.train.labels
+        num_mbs = int(args.num_train / args.batch_size)
+        bs = args.batch_size
+        for ep in range(self.start_epoch, args.num_epochs):
+            if args.replica_shuffle:
+                perms = np.array([np.random.permutation(args.num_train) for _ in range(K)])
+            for i in range(num_mbs):
+                if args.replica_shuffle:
+                    idx = perms[:, i*bs : (i+1)*bs]
+                    feed = {self.x_rep: images[idx], self.y_rep: labels[idx]}
+                elif self.batches is not None:
+                    feed = None
+                else:
+                    batch = mnist.train.next_batch(bs)
+                    feed = {self.x: batch[0], self.y: batch[1]}
+                self.sess.run(self.train_step, feed)
+            self.end_epoch(ep, feed_valid, feed_test)
+        self.finish()
+
+
+    def end_epoch(self, ep, feed_valid, feed_test):
+        """
+        Evaluate every `eval_every` epochs, and always after the last one.
+        With `--async_eval`, only snapshot the weights here; the evaluation
+        and logging happen in the background while we keep training.
+        """
+        args = self.args
+        if (ep + 1) % args.eval_every != 0 and ep != args.num_epochs - 1:
+            return
+        if self.async_eval is not None:
+            self.async_eval.submit(ep)
+            return
+        valid_stats = self.sess.run(self.stats, feed_valid)
+        test_stats  = self.sess.run(self.stats, feed_test)
+        valid_err_model, test_err_model = self.model_errors(
+                valid_stats, test_stats, feed_valid, feed_test)
+        self.log_epoch(ep, valid_stats, test_stats, valid_err_model, test_err_model)
+
+
+    def log_epoch(self, ep, valid_stats, test_stats, valid_err_model, test_err_model):
+        """ One line, or one per replica (and to the replica logs, if any).
+        With `--metrics`, also one record in the metrics stream. """
+        row = [valid_stats['l2_loss'], valid_stats['cross_entropy'],
+               100*(1.0-valid_stats['accuracy']), valid_err_model,
+               100*(1.0-test_stats['accuracy']), test_err_model]
+        if self.metrics is not None:
+            self.metrics.write(ep, **dict(zip(METRICS[1:], row)))
+        fmt = "{:5} {:9.4f} {:9.4f} {:10.3f} {:10.3f} {:10.3f} {:10.3f}"
+        if self.args.num_replicas == 1:
+            print(fmt.format(ep, *row))
+            sys.stdout.flush()
+            return
+        for r in range(self.args.num_replicas):
+            line = fmt.format(ep, *[col[r] for col in row])
+            print("{:7} {}".format(r, line))
+            if self.logs:
+                self.logs[r].write(line + '\n')
+                self.logs[r].flush()
+        sys.stdout.flush()
 
-            valid_err_single = 100*(1.0-valid_stats['accuracy'])
-            valid_err_model  = self.eval_valid.eval(valid_stats['y_softmax'])
-            test_err_single  = 100*(1.0-test_stats['accuracy'])
-            test_err_model   = self.eval_test.eval(test_stats['y_softmax'])
 
-            print("{:5} {:9.4f} {:9.4f} {:10.3f} {:10.3f} {:10.3f} {:10.3f}".format(ep,
-                    valid_stats['l2_loss'], valid_stats['cross_entropy'],
-                    valid_err_single, valid_err_model,
-                    test_err_single, test_err_model))
+    def finish(self):
+        """ Wait for any pending async evaluations, then close logs. With
+        `--ckpt_dir`, save everything so a later run can continue. """
+        if self.async_eval is not None:
+            self.async_eval.close()
+        if self.args.ckpt_dir is not None:
+            self.save(self.args.num_epochs)
+        for f in self.logs:
+            f.close()
+        if self.metrics is not None:
+            self.metrics.close()
 
 
 if __name__ == '__main__':
@@ -187,6 +607,7 @@ if __name__ == '__main__':
     # Bells and whistles
     parser.add_argument('--data_dir', type=str, default='/tmp/tensorflow/mnist/input_data')
     parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--num_threads', type=int, default=0)
     # Training and evaluation, stuff that should stay mostly constant:
     parser.add_argument('--batch_size', type=int, default=100)
     parser.add_argument('--num_epochs', type=int, default=300) # just run longer
@@ -195,6 +616,21 @@ if __name__ == '__main__':
     parser.add_argument('--rmsprop_momentum', type=float, default=0.0)
     # Training and evaluation, stuff to mostly tune:
     parser.add_argument('--burn_in_epochs', type=int, default=30)
+    # How to get the "model" columns: average softmax outputs (the original),
+    # or average weights in the graph, uniformly after burn-in or with an EMA.
+    parser.add_argument('--model_avg', type=str, default='softmax',
+                        choices=['softmax', 'polyak', 'ema'])
+    parser.add_argument('--ema_decay', type=float, default=0.999)
+    # Evaluate every few epochs, and/or in the background on weight snapshots.
+    # Note: `plot_coarse.py` assumes one row per epoch, i.e., `--eval_every 1`.
+    parser.add_argument('--eval_every', type=int, default=1)
+    parser.add_argument('--async_eval', action='store_true', default=False)
+    # Also write per-epoch metrics as JSON lines, see `metrics_io.py`.
+    parser.add_argument('--metrics', type=str, default=None)
+    parser.add_argument('--metrics_flush', type=int, default=10)
+    # Save at the end, and resume from here if already saved. Then
+    # `--num_epochs` is the TOTAL, e.g., 25 and then 50 runs 25 more epochs.
+    parser.add_argument('--ckpt_dir', type=str, default=None)
     parser.add_argument('--lrate', type=float, default=0.2)
     parser.add_argument('--l2_reg', type=float, default=0.0)
     parser.add_argument('--optimizer', type=str, default='sgd')
@@ -204,10 +640,16 @@ if __name__ == '__main__':
     parser.add_argument('--num_test', type=int, default=10000)
     parser.add_argument('--num_train', type=int, default=55000)
     parser.add_argument('--num_valid', type=int, default=5000)
+    # Train K independent copies of the ff network at once, in one graph.
+    parser.add_argument('--num_replicas', type=int, default=1)
+    parser.add_argument('--replica_shuffle', action='store_true', default=False)
+    parser.add_argument('--replica_logs', type=str, default=None)
+    # Keep the training data in the graph and shuffle there, no per-step feeds.
+    parser.add_argument('--graph_batches', action='store_true', default=False)
     args = parser.parse_args()
     print("Our arguments:\n{}".format(args))
 
-    sess = get_tf_session(gpumem=1.0)
+    sess = get_tf_session(gpumem=1.0, num_threads=args.num_threads)
     np.random.seed(args.seed)
     random.seed(args.seed)
     tf.set_random_seed(args.seed)
@@ -10,6 +10,7 @@ matplotlib.use('Agg')
 matplotlib.rcParams['axes.color_cycle'] = ['red', 'blue', 'yellow', 'black', 'purple']
 import matplotlib.pyplot as plt
 import plot_names as pn
+from results_store import ResultsStore
 import numpy as np
 np.set_printoptions(edgeitems=100, linewidth=100, suppress=True)
 from collections import defaultdict
@@ -26,6 +27,8 @@ lw, ms = 3, 8
 # Adjust based on what we did with the scripts
 BURN_IN = 30
 EPOCHS = 300
+# One `ResultsStore` per log directory.
+STORES = {}
 
 
 def parse(file_head, headname, dirs):
@@ -33,48 +36,13 @@ def parse(file_head, headname, dirs):
     Parse line based on the pattern we know.  Makes key assumption that we can
     assume that `seed-x` is placed AT THE END. And that `len(x)==1`.
 
-    Very research-code like. Don't judge.
+    The logs are parsed (only if new or changed) into `headname/results.npz`
+    by `results_store.py`, so this just slices arrays from there.
     """
-    files = sorted([x for x in dirs if file_head in x])
-    info = defaultdict(list)
-
-    for ff in files:
-        path = headname + ff
-        with open(path, 'r') as f:
-            all_lines = [x.strip('\n') for x in f.readlines()]
-        idx = 0
-        while True:
-            if 'epoch | l2_loss (v)' in all_lines[idx]:
-                all_lines = all_lines[idx+1:]
-                #print("found info for {}, at line {}, w/{} data points".format(
-                #        ff, idx, len(all_lines)))
-                break
-            idx += 1
-            if idx > 50:
-                raise Exception()
-        all_stuff = [x.split() for x in all_lines]
-        for idx in range(len(all_stuff)):
-            all_stuff[idx] = [float(x) for x in all_stuff[idx]]
-        results = np.array(all_stuff)
-        assert len(results.shape) == 2 and results.shape[0] == len(all_lines)
-
-        # Yeah it's ugly we have to know these ...
-        info['l2_loss_v'].append(results[:,1])
-        info['ce_loss_v'].append(results[:,2])
-        info['valid_err_s'].append(results[:,3])
-        info['valid_err_m'].append(results[:,4])
-        info['test_err_s'].append(results[:,5])
-        info['test_err_m'].append(results[:,6])
-
-    # Turn into numpy arrays and collect mean/std information.
-    keys = info.keys()
-    for key in list(keys):
-        info[key] = np.array(info[key])
-        assert len(info[key].shape) == 2 and info[key].shape[0] == len(files)
-        info[key+'_mean'] = np.mean(info[key], axis=0)
-        info[key+'_std']  = np.std(info[key], axis=0)
-    info['x'] = np.arange(len(all_lines))
-    return info
+    if headname not in STORES:
+        STORES[headname] = ResultsStore(headname)
+        STORES[headname].update()
+    return STORES[headname].info(file_head, dirs)
 
 
 def get_row_index(head, HPARAMS):
@@ -109,7 +77,8 @@ def plot_one_type(headname, figname, hparams):
     First column, validation, second test. There is a lot of information to
     process. We'll have to form a ranking and add to the plot titles.
     """
-    dirs = sorted([e for e in os.listdir(headname) if 'seed' in e])
+    dirs = sorted([e for e in os.listdir(headname) if 'seed' in e and not e.endswith('.jsonl')
+                   and os.path.isfile(os.path.join(headname, e))])
     unique_dirs = sorted( list( set([x[:-1].replace('seed-','') for x in dirs]) ) )
     nrows = len(hparams['lrate']) * len(hparams['wd'])
     ncols = 2
@@ -122,8 +91,9 @@ def plot_one_type(headname, figname, hparams):
     LIM2 = EPOCHS-1
     ranks = defaultdict(list)
 
+    infos = {head: parse(head, headname, dirs) for head in unique_dirs}
     for head in unique_dirs:
-        info = parse(head, headname, dirs)
+        info = infos[head]
         row = get_row_index(head, hparams)
         print("Currently on head {} w/row idx {}".format(head, row))
 
@@ -146,7 +116,7 @@ def plot_one_type(headname, figname, hparams):
 
     # Now loop again to plot, this time using the rankings we've stored.
     for head in unique_dirs:
-        info = parse(head, headname, dirs)
+        info = infos[head]
         row = get_row_index(head, hparams)
 
         # Validation, single and model.
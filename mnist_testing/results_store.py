@@ -0,0 +1,157 @@
+"""
+Parsed results of a sweep directory, cached in one `results.npz` file there.
+
+`plot_coarse.py` used to re-open and re-tokenize every seed log, twice per
+config. Here `update()` parses ONLY logs that are new or whose mtime changed
+since the last time, and saves everything in one npz:
+
+    names    (M,)       log file names (not paths), sorted
+    mtimes   (M,)       mtime of each log when it was parsed
+    lengths  (M,)       number of epochs (rows) found in each log
+    results  (M,E,7)    per-epoch rows, NaN past `lengths[i]`
+
+with the seven columns in `METRICS` order. Afterwards `info()` just slices the
+arrays, so ranking and plotting take milliseconds. If a log has a metrics
+stream next to it (`<log>.jsonl`, from `mnist_fc.py --metrics`), we read that
+instead of parsing the text.
+
+    store = ResultsStore('logs/sgd-tune/')
+    store.update()
+    info = store.info('fc-400-lrate-0.1-wd-0.0-')
+"""
+import os
+import numpy as np
+from metrics_io import METRICS, as_table, num_replicas, read_metrics
+
+HEADER = 'epoch | l2_loss (v)'
+STORE_NAME = 'results.npz'
+
+
+def parse_log(path, max_header_line=50):
+    """ Returns the (E,7) table of one `mnist_fc.py` log.
+
+    Rows start after the header line. Lines that aren't seven numbers are
+    skipped, so a partial log (e.g., a run that crashed or is still going) just
+    gives fewer rows, and a resumed run (`--ckpt_dir`) can append to the same
+    log, repeated header and all. If an epoch shows up twice, the later wins.
+    """
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    start = None
+    for idx,line in enumerate(lines[:max_header_line]):
+        if HEADER in line:
+            start = idx + 1
+            break
+    if start is None:
+        return np.zeros((0, len(METRICS)))
+    rows = {}
+    for line in lines[start:]:
+        tokens = line.split()
+        if len(tokens) != len(METRICS):
+            continue
+        try:
+            row = [float(x) for x in tokens]
+        except ValueError:
+            continue
+        rows[int(row[0])] = row
+    rows = [rows[ep] for ep in sorted(rows)]
+    return np.array(rows, dtype=np.float64).reshape((-1, len(METRICS)))
+
+
+class ResultsStore:
+
+    def __init__(self, logdir, store_path=None):
+        self.logdir = logdir
+        self.store_path = store_path or os.path.join(logdir, STORE_NAME)
+        self.names = []
+        self.mtimes = {}
+        self.tables = {}
+        if os.path.exists(self.store_path):
+            self._load()
+
+    def _load(self):
+        data = np.load(self.store_path)
+        names, mtimes = data['names'], data['mtimes']
+        lengths, results = data['lengths'], data['results']
+        for i,name in enumerate(names):
+            name = str(name)
+            self.names.append(name)
+            self.mtimes[name] = float(mtimes[i])
+            self.tables[name] = results[i, :lengths[i]]
+
+    def _save(self):
+        names = sorted(self.tables.keys())
+        lengths = np.array([len(self.tables[n]) for n in names], dtype=np.int64)
+        max_len = max(lengths) if len(names) > 0 else 0
+        results = np.full((len(names), max_len, len(METRICS)), np.nan)
+        for i,name in enumerate(names):
+            results[i, :lengths[i]] = self.tables[name]
+        tmp = self.store_path + '.tmp.npz'
+        np.savez(tmp, names=np.array(names), mtimes=np.array([self.mtimes[n] for n in names]),
+                 lengths=lengths, results=results)
+        os.rename(tmp, self.store_path)
+
+    def _source(self, name, files):
+        """ The metrics stream for log `name` if there is one, else the log. """
+        if name + '.jsonl' in files:
+            return os.path.join(self.logdir, name + '.jsonl')
+        return os.path.join(self.logdir, name)
+
+    def update(self, verbose=True):
+        """ Parse logs that are new or changed since the last update. Logs
+        that disappeared are dropped. Returns the number (re-)parsed. """
+        files = set(os.listdir(self.logdir))
+        current = {}
+        for name in files:
+            if 'seed' in name and not name.endswith(('.npz', '.jsonl')) and \
+                    os.path.isfile(os.path.join(self.logdir, name)):
+                current[name] = os.path.getmtime(self._source(name, files))
+        changed = [n for n in sorted(current) if self.mtimes.get(n) != current[n]]
+        removed = [n for n in self.tables if n not in current]
+        for name in changed:
+            path = self._source(name, files)
+            arrays = read_metrics(path)[1] if path.endswith('.jsonl') else None
+            if arrays is not None and num_replicas(arrays) == 1:
+                table = as_table(arrays)
+            else:
+                # A `--num_replicas` stream has no single table, so we read the
+                # log. Each replica's table is in its own `--replica_logs` log.
+                table = parse_log(os.path.join(self.logdir, name))
+            if len(table) == 0:
+                # No rows (yet), or the stdout log of a `--num_replicas` run.
+                # Storing it would cut `info()` down to 0 epochs.
+                self.tables.pop(name, None)
+                self.mtimes.pop(name, None)
+                continue
+            self.tables[name] = table
+            self.mtimes[name] = current[name]
+        for name in removed:
+            del self.tables[name]
+            del self.mtimes[name]
+        self.names = sorted(self.tables.keys())
+        if changed or removed or not os.path.exists(self.store_path):
+            self._save()
+        if verbose:
+            print("results store {}: {} logs, {} parsed, {} removed".format(
+                    self.store_path, len(self.names), len(changed), len(removed)))
+        return len(changed)
+
+    def table(self, name):
+        """ The (E,7) array for one log file name. """
+        return self.tables[name]
+
+    def info(self, file_head, names=None):
+        """ Same dict as `plot_coarse.parse` used to build: for each metric, a
+        (num_seeds, E) array, plus `_mean`, `_std` and the epochs `x`. If
+        seeds ran for different numbers of epochs, we keep the shortest. """
+        names = sorted([x for x in (names or self.names) if file_head in x])
+        assert len(names) > 0, "no logs match {}".format(file_head)
+        num_epochs = min(len(self.tables[n]) for n in names)
+        stacked = np.array([self.tables[n][:num_epochs] for n in names])
+        info = {}
+        for col,key in enumerate(METRICS[1:], start=1):
+            info[key] = stacked[:, :, col]
+            info[key+'_mean'] = np.mean(info[key], axis=0)
+            info[key+'_std']  = np.std(info[key], axis=0)
+        info['x'] = np.arange(num_epochs)
+        return info
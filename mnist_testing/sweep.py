@@ -0,0 +1,191 @@
+"""
+Run a hyperparameter sweep of `mnist_fc.py` jobs in parallel. Replaces the
+nested loops in `scripts/tune_*.sh`, which ran e.g. 6x5x4 = 120 jobs of 300
+epochs strictly one after another.
+
+- Jobs run in a pool of `--num_slots` slots (default: cores / threads). Each
+  slot owns `--threads` cores; its jobs are pinned to them (Linux) and get
+  the same TF intra/inter-op thread counts, so jobs don't fight over cores.
+- Resumable: a config whose log already has the last epoch is skipped, so just
+  re-run the same command after a crash or Ctrl-C. Partial logs are re-run.
+- Prints progress and an ETA after every finished job.
+- Each job also writes `<log>.jsonl` metrics (see `metrics_io.py`), which
+  `results_store.py` reads instead of parsing the log.
+
+Log names are the same as the shell scripts, so `plot_coarse.py` still works:
+
+    python sweep.py --sweep sgd_coarse --threads 2
+    python sweep.py --sweep rmsprop_fine --dry_run
+"""
+import argparse, itertools, os, subprocess, sys, threading, time
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+
+# Same grids as the old shell scripts. Keep values as strings, for the log names.
+SWEEPS = {
+    'sgd_coarse': {
+        'optimizer': 'sgd', 'logdir': 'logs/sgd-tune',
+        'lrate': ['0.04', '0.07', '0.1', '0.3', '0.5', '0.7'],
+        'wd':    ['0.0', '0.000001', '0.00001', '0.0001', '0.001'],
+        'seeds': range(1, 5),
+    },
+    'sgd_fine': {
+        'optimizer': 'sgd', 'logdir': 'logs/sgd-tune',
+        'lrate': ['0.045', '0.055', '0.065', '0.075'],
+        'wd':    ['0.0', '0.00001'],
+        'seeds': range(1, 21),
+    },
+    'rmsprop_coarse': {
+        'optimizer': 'rmsprop', 'logdir': 'logs/rmsprop-tune',
+        'lrate': ['0.01', '0.005', '0.001', '0.0005', '0.0001'],
+        'wd':    ['0.0', '0.000001', '0.00001', '0.0001'],
+        'seeds': range(1, 5),
+    },
+    'rmsprop_fine': {
+        'optimizer': 'rmsprop', 'logdir': 'logs/rmsprop-tune',
+        'lrate': ['0.0003', '0.0006', '0.0009', '0.0012', '0.0015'],
+        'wd':    ['0.0', '0.00001'],
+        'seeds': range(1, 21),
+    },
+}
+
+
+def get_configs(sweep, fc_size=400):
+    """List of (log path, mnist_fc.py arguments), in the old loop order."""
+    configs = []
+    for e, w, i in itertools.product(sweep['lrate'], sweep['wd'], sweep['seeds']):
+        name = 'fc-{}-lrate-{}-wd-{}-seed-{}'.format(fc_size, e, w, i)
+        cmd = ['--optimizer', sweep['optimizer'], '--fc_size', str(fc_size),
+               '--lrate', e, '--l2_reg', w, '--seed', str(i)]
+        configs.append((os.path.join(sweep['logdir'], name), cmd))
+    return configs
+
+
+def is_complete(path, num_epochs):
+    """True if the last line of the log is the row for the final epoch."""
+    if not os.path.exists(path):
+        return False
+    with open(path, 'r') as f:
+        lines = [x.split() for x in f.readlines() if x.strip()]
+    if len(lines) == 0:
+        return False
+    try:
+        return int(lines[-1][0]) == num_epochs - 1
+    except ValueError:
+        return False
+
+
+def get_slots(num_slots, threads):
+    """Core sets for each slot, e.g., [[0,1], [2,3], ...] with 2 threads."""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    if num_slots is None:
+        num_slots = max(1, len(cores) // threads)
+    return [cores[(k*threads) % len(cores) : (k*threads) % len(cores) + threads]
+            for k in range(num_slots)]
+
+
+def fmt_time(seconds):
+    seconds = int(seconds)
+    return '{}h{:02d}m{:02d}s'.format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+class Sweep(object):
+
+    def __init__(self, configs, slots, extra_args, python=sys.executable):
+        self.configs = configs
+        self.slots = slots
+        self.extra_args = extra_args
+        self.python = python
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = []
+        self.job_times = []
+
+    def _run_one(self, path, cmd, cores):
+        full = [self.python, 'mnist_fc.py'] + cmd + self.extra_args + \
+               ['--num_threads', str(len(cores)), '--metrics', path + '.jsonl']
+        def pin():
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cores)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        start = time.time()
+        with open(path, 'w') as f:
+            code = subprocess.call(full, stdout=f, stderr=subprocess.STDOUT, preexec_fn=pin)
+        return code, time.time() - start
+
+    def _worker(self, cores, jobs):
+        while True:
+            try:
+                path, cmd = jobs.get_nowait()
+            except queue.Empty:
+                return
+            code, elapsed = self._run_one(path, cmd, cores)
+            with self.lock:
+                self.done += 1
+                self.job_times.append(elapsed)
+                if code != 0:
+                    self.failed.append(path)
+                self._report(path, code, elapsed)
+
+    def _report(self, path, code, elapsed):
+        total = len(self.configs)
+        remaining = total - self.done
+        # Jobs take about the same time, and `len(slots)` run at once.
+        avg = sum(self.job_times) / len(self.job_times)
+        eta = avg * remaining / float(len(self.slots))
+        since = time.time() - self.start
+        status = 'ok' if code == 0 else 'FAILED ({})'.format(code)
+        print("[{}/{}] {} {} in {}, elapsed {}, ETA {}".format(self.done, total,
+                path, status, fmt_time(elapsed), fmt_time(since), fmt_time(eta)))
+        sys.stdout.flush()
+
+    def run(self):
+        jobs = queue.Queue()
+        for path, cmd in self.configs:
+            jobs.put((path, cmd))
+        self.start = time.time()
+        threads = [threading.Thread(target=self._worker, args=(cores, jobs))
+                   for cores in self.slots]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print("finished {} jobs in {}, {} failed".format(self.done,
+                fmt_time(time.time() - self.start), len(self.failed)))
+        for path in self.failed:
+            print("  failed: {}".format(path))
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--sweep', type=str, required=True, choices=sorted(SWEEPS.keys()))
+    pp.add_argument('--threads', type=int, default=1)
+    pp.add_argument('--num_slots', type=int, default=None)
+    pp.add_argument('--num_epochs', type=int, default=300)
+    pp.add_argument('--fc_size', type=int, default=400)
+    pp.add_argument('--data_dir', type=str, default='/tmp/tensorflow/mnist/input_data')
+    pp.add_argument('--dry_run', action='store_true', default=False)
+    # Anything else is passed on to `mnist_fc.py`, e.g., `--batch_size`.
+    args, extra = pp.parse_known_args()
+
+    configs = get_configs(SWEEPS[args.sweep], fc_size=args.fc_size)
+    todo = [c for c in configs if not is_complete(c[0], args.num_epochs)]
+    slots = get_slots(args.num_slots, args.threads)
+    print("sweep {}: {} configs, {} already complete, {} to run on {} slots: {}".format(
+            args.sweep, len(configs), len(configs) - len(todo), len(todo), len(slots), slots))
+    if args.dry_run:
+        for path, cmd in todo:
+            print("  {} <- {}".format(path, ' '.join(cmd)))
+        sys.exit()
+    # Download and convert MNIST once here, so jobs don't race to do it, and
+    # all of them memory-map the same `.npy` files.
+    import mnist_cache
+    mnist_cache.read_data_sets(args.data_dir, one_hot=True)
+    extra += ['--num_epochs', str(args.num_epochs), '--data_dir', args.data_dir]
+    Sweep(todo, slots, extra).run()
@@ -0,0 +1,26 @@
+""" Run with `python -m pytest test_mnist_cache.py` from this directory. """
+import numpy as np
+from mnist_cache import MemmapDataSet
+
+
+def test_next_batch_wraps_around_with_leftovers():
+    # 10 examples, batches of 4: each epoch leaves 2 for the next batch.
+    N, bs = 10, 4
+    data = MemmapDataSet(np.arange(N).reshape(N, 1), np.arange(N))
+    np.random.seed(0)
+    seen = []
+    for _ in range(10):
+        images, labels = data.next_batch(bs)
+        assert len(labels) == bs
+        assert (images[:, 0] == labels).all()
+        seen.extend(labels.tolist())
+    # 40 examples is exactly 4 epochs, each of which must be a permutation.
+    for e in range(4):
+        assert sorted(seen[e*N:(e+1)*N]) == list(range(N))
+    assert data.epochs_completed == 3
+
+
+def test_next_batch_no_shuffle_is_in_order():
+    data = MemmapDataSet(np.arange(5).reshape(5, 1), np.arange(5))
+    batches = [data.next_batch(3, shuffle=False)[1].tolist() for _ in range(3)]
+    assert batches == [[0, 1, 2], [3, 4, 0], [1, 2, 3]]
@@ -0,0 +1,126 @@
+""" Save checkpoints on a background thread, so training doesn't stall.
+
+`saver.save` writes every variable to disk before returning. Instead, we grab
+all variable values with ONE `sess.run` (a consistent snapshot, since nothing
+trains during that call), and hand the numpy arrays to a background thread. That
+thread has its own small graph with one variable per original variable (same
+names), assigns the snapshot and calls `Saver.save` there. The files are the
+usual `epoch-N.{index,data,meta}`, so `load.py` works unchanged: the `.meta` is
+exported from the training graph, and checkpoint keys are the variable names.
+
+The queue is bounded, so if the disk is slower than training we block rather
+than pile up snapshots in memory. We also keep only the last `keep_last`
+checkpoints plus every `keep_every`-th one, instead of all of them.
+"""
+import glob, os, sys, threading
+import tensorflow as tf
+import numpy as np
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+
+
+class AsyncCheckpointer(object):
+
+    def __init__(self, sess, saver, ckpt_name="checkpoints/epoch", var_list=None,
+                 keep_last=3, keep_every=5, max_pending=2):
+        """`saver` is the usual training-graph Saver; we only use it to export
+        the meta graph, which we do once here since the graph doesn't change.
+        So build this after the full training graph. Set `keep_every=0` to
+        only keep the last few.
+        """
+        self.sess = sess
+        self.saver = saver
+        self.ckpt_name = ckpt_name
+        self.ckpt_dir = os.path.dirname(ckpt_name)
+        self.var_list = var_list or tf.global_variables()
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.saved = []
+        self.error = None
+        self.meta_bytes = tf.train.export_meta_graph(
+                graph=sess.graph, saver_def=saver.saver_def).SerializeToString()
+        self._build_writer()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _build_writer(self):
+        """A separate graph + session with one variable per training variable."""
+        self.w_graph = tf.Graph()
+        self.w_phs = []
+        assigns = []
+        with self.w_graph.as_default():
+            w_vars = {}
+            for v in self.var_list:
+                dtype = v.dtype.base_dtype
+                shape = v.get_shape().as_list()
+                ph = tf.placeholder(dtype, shape)
+                w_var = tf.Variable(tf.zeros(shape, dtype=dtype), trainable=False)
+                assigns.append(tf.assign(w_var, ph))
+                w_vars[v.op.name] = w_var
+                self.w_phs.append(ph)
+            self.w_assign = tf.group(*assigns)
+            self.w_saver = tf.train.Saver(w_vars, max_to_keep=None)
+            init = tf.global_variables_initializer()
+        self.w_graph.finalize()
+        self.w_sess = tf.Session(graph=self.w_graph)
+        self.w_sess.run(init)
+
+    def save(self, step):
+        """Snapshot all variables now, and write them later. Returns right away
+        unless `max_pending` snapshots are still waiting to be written."""
+        if self.error is not None:
+            raise self.error
+        values = self.sess.run(self.var_list)
+        self.queue.put((step, values))
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+            try:
+                self._write(*job)
+            except Exception as e:
+                self.error = e
+            self.queue.task_done()
+
+    def _write(self, step, values):
+        feed = {ph: val for ph,val in zip(self.w_phs, values)}
+        self.w_sess.run(self.w_assign, feed)
+        path = self.w_saver.save(self.w_sess, self.ckpt_name, global_step=step,
+                                 write_meta_graph=False)
+        with open('{}.meta'.format(path), 'wb') as fh:
+            fh.write(self.meta_bytes)
+        self.saved.append((step, path))
+        self._apply_retention()
+
+    def _keep(self, idx, step):
+        if idx >= len(self.saved) - self.keep_last:
+            return True
+        return self.keep_every > 0 and step % self.keep_every == 0
+
+    def _apply_retention(self):
+        kept = []
+        for idx,(step,path) in enumerate(self.saved):
+            if self._keep(idx, step):
+                kept.append((step,path))
+            else:
+                for fname in glob.glob('{}.*'.format(path)):
+                    os.remove(fname)
+        self.saved = kept
+        # So `tf.train.latest_checkpoint` etc. only see what's on disk.
+        tf.train.update_checkpoint_state(self.ckpt_dir, kept[-1][1],
+                all_model_checkpoint_paths=[p for _,p in kept])
+
+    def close(self):
+        """Wait for pending writes to finish."""
+        self.queue.put(None)
+        self.thread.join()
+        self.w_sess.close()
+        if self.error is not None:
+            raise self.error
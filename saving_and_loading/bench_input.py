@@ -0,0 +1,72 @@
+""" Training steps/sec with `feed_dict` (the old way) vs the `tf.data` pipeline.
+
+Builds the same `train.build_net` CNN in a fresh graph for each mode, runs a
+few warm-up steps, and then times `--steps` training steps:
+
+    feed_dict      numpy slicing + `np.expand_dims` + `feed_dict` per batch
+    tf.data        `input_pipeline.MnistInput`, converting per batch
+    tf.data+cache  same, but with the converted images cached in memory
+
+    python bench_input.py --steps 1000
+"""
+import argparse, time
+import tensorflow as tf
+import numpy as np
+from input_pipeline import MnistInput
+from train import build_net
+mnist = tf.keras.datasets.mnist
+
+MODES = ['feed_dict', 'tf.data', 'tf.data+cache']
+
+
+def time_mode(mode, data, bs, steps, warmup):
+    (x_train, y_train),(x_test, y_test) = data
+    tf.reset_default_graph()
+    if mode == 'feed_dict':
+        images_ph = tf.placeholder(tf.float32, [None, 28, 28, 1], name='images')
+        labels_ph = tf.placeholder(tf.float32, [None], name='labels')
+        _, cross_entropy_op, _, train_op = build_net(images_ph, labels_ph)
+        x_float = x_train / 255.0
+        def feeds():
+            while True:
+                for start in range(0, len(x_float) - bs + 1, bs):
+                    xs = np.expand_dims(x_float[start : start+bs], axis=3)
+                    ys = y_train[start : start+bs]
+                    yield {images_ph:xs, labels_ph:ys}
+    else:
+        inp = MnistInput(batch_size=bs, cache=(mode == 'tf.data+cache'))
+        _, cross_entropy_op, _, train_op = build_net(inp.images, inp.labels)
+        def feeds():
+            while True:
+                yield inp.train_feed
+
+    sess = tf.Session()
+    sess.run(tf.global_variables_initializer())
+    if mode != 'feed_dict':
+        inp.initialize(sess, x_train, y_train, x_test, y_test)
+    feed_iter = feeds()
+    for _ in range(warmup):
+        sess.run([train_op, cross_entropy_op], next(feed_iter))
+    start = time.time()
+    for _ in range(steps):
+        sess.run([train_op, cross_entropy_op], next(feed_iter))
+    elapsed = time.time() - start
+    sess.close()
+    return steps / elapsed
+
+
+if __name__ == '__main__':
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--bs', type=int, default=100)
+    pp.add_argument('--steps', type=int, default=1000)
+    pp.add_argument('--warmup', type=int, default=50)
+    args = pp.parse_args()
+
+    data = mnist.load_data()
+    results = []
+    for mode in MODES:
+        rate = time_mode(mode, data, args.bs, args.steps, args.warmup)
+        results.append((mode, rate))
+    print("\nmode, steps/sec, speedup")
+    for mode,rate in results:
+        print("{}, {:.1f}, {:.2f}x".format(mode, rate, rate / results[0][1]))
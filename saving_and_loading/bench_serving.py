@@ -0,0 +1,61 @@
+""" Inference images/sec of an exported SavedModel on CPU, by batch size.
+
+Loads the output of `export.py` on its own (no training code needed), feeds
+random images, and times the 'classes' output for batch sizes 1, 2, 4, ...,
+1024. For each size we warm up, then run until at least `--min_time` seconds
+have passed, so small batches get enough iterations to time.
+
+    python bench_serving.py --model exported/epoch-9 --threads 4
+"""
+import argparse, os, time
+# Hide GPUs from TF before it starts.
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+import tensorflow as tf
+import numpy as np
+from export import SIGNATURE
+
+
+def load_model(sess, model_dir):
+    """Returns the (images, classes) tensors of the exported signature."""
+    meta = tf.saved_model.loader.load(sess, [tf.saved_model.tag_constants.SERVING], model_dir)
+    sig = meta.signature_def[SIGNATURE]
+    graph = sess.graph
+    images = graph.get_tensor_by_name(sig.inputs['images'].name)
+    classes = graph.get_tensor_by_name(sig.outputs['classes'].name)
+    return images, classes
+
+
+def time_batch(sess, images, classes, bs, min_time=1.0, warmup=5):
+    xs = np.random.rand(bs, 28, 28, 1).astype(np.float32)
+    for _ in range(warmup):
+        sess.run(classes, {images: xs})
+    n = 0
+    start = time.time()
+    while True:
+        sess.run(classes, {images: xs})
+        n += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return n * bs / elapsed, elapsed / n
+
+
+if __name__ == '__main__':
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--model', type=str, required=True)
+    pp.add_argument('--max_bs', type=int, default=1024)
+    pp.add_argument('--min_time', type=float, default=1.0)
+    # 0 means let TF decide.
+    pp.add_argument('--threads', type=int, default=0)
+    args = pp.parse_args()
+
+    config = tf.ConfigProto(device_count={'GPU': 0},
+                            intra_op_parallelism_threads=args.threads,
+                            inter_op_parallelism_threads=args.threads)
+    with tf.Session(graph=tf.Graph(), config=config) as sess:
+        images, classes = load_model(sess, args.model)
+        print("batch_size, images/sec, ms/batch")
+        bs = 1
+        while bs <= args.max_bs:
+            rate, per_batch = time_batch(sess, images, classes, bs, args.min_time)
+            print("{}, {:.1f}, {:.3f}".format(bs, rate, per_batch * 1000.0))
+            bs *= 2
@@ -0,0 +1,123 @@
+""" A content-addressed store for per-epoch snapshots of all variables.
+
+`saver.save` writes a full copy of every variable for every epoch, even ones
+that never change (e.g., optimizer slots for frozen scopes). Here, each variable
+is split into fixed-size chunks which are stored under their SHA-1, compressed
+with zlib. A chunk that is identical to one from any earlier epoch (or another
+variable) is stored once. Each epoch only adds a small JSON manifest that lists
+the chunks of each variable:
+
+    store/graph.meta                the meta graph, written once
+    store/manifests/epoch-N.json    {name: {dtype, shape, chunks: [sha1, ...]}}
+    store/chunks/ab/abcdef...       zlib-compressed chunk bytes
+
+Use `put` while training and `restore` (or `get`) to load. `load.py` can
+evaluate from a store with `--store DIR`.
+"""
+import hashlib, json, os, re, zlib
+from os.path import join
+import numpy as np
+
+
+class CheckpointStore(object):
+
+    def __init__(self, root, chunk_bytes=1<<20, level=6):
+        self.root = root
+        self.chunk_bytes = chunk_bytes
+        self.level = level
+        self.meta_path = join(root, 'graph.meta')
+        for d in [root, join(root,'manifests'), join(root,'chunks')]:
+            if not os.path.exists(d):
+                os.makedirs(d)
+
+    def _manifest_path(self, step):
+        return join(self.root, 'manifests', 'epoch-{}.json'.format(step))
+
+    def _chunk_path(self, digest):
+        return join(self.root, 'chunks', digest[:2], digest)
+
+    def _put_chunk(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._chunk_path(digest)
+        if not os.path.exists(path):
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # Write then rename, so a crash never leaves a partial chunk.
+            with open(path + '.tmp', 'wb') as fh:
+                fh.write(zlib.compress(data, self.level))
+            os.rename(path + '.tmp', path)
+        return digest
+
+    def _get_chunk(self, digest):
+        with open(self._chunk_path(digest), 'rb') as fh:
+            return zlib.decompress(fh.read())
+
+    def put_meta_graph(self, meta_graph_def):
+        """Save the (tf.MetaGraphDef) graph once; later calls are no-ops."""
+        if not os.path.exists(self.meta_path):
+            with open(self.meta_path, 'wb') as fh:
+                fh.write(meta_graph_def.SerializeToString())
+
+    def put(self, step, values):
+        """Store `values`, a dict from variable name to numpy array, as `step`."""
+        manifest = {}
+        for name,val in values.items():
+            val = np.ascontiguousarray(val)
+            data = val.tobytes()
+            chunks = [self._put_chunk(data[i : i+self.chunk_bytes])
+                      for i in range(0, max(len(data),1), self.chunk_bytes)]
+            manifest[name] = {'dtype': val.dtype.str, 'shape': list(val.shape),
+                              'chunks': chunks}
+        with open(self._manifest_path(step), 'w') as fh:
+            json.dump(manifest, fh)
+
+    def get(self, step):
+        """Returns a dict from variable name to numpy array for `step`."""
+        with open(self._manifest_path(step), 'r') as fh:
+            manifest = json.load(fh)
+        values = {}
+        for name,info in manifest.items():
+            data = b''.join(self._get_chunk(d) for d in info['chunks'])
+            values[name] = np.frombuffer(data, dtype=np.dtype(info['dtype'])).reshape(info['shape'])
+        return values
+
+    def restore(self, sess, step, var_list):
+        """Load `step` into the graph variables in `var_list`, matched by name.
+
+        Uses `Variable.load`, which feeds the initializer's input, so it adds no
+        ops to the graph and works on a finalized graph.
+        """
+        values = self.get(step)
+        for v in var_list:
+            v.load(values[v.op.name], sess)
+
+    def steps(self):
+        pattern = re.compile(r'^epoch-(\d+)\.json$')
+        names = os.listdir(join(self.root, 'manifests'))
+        return sorted([int(m.group(1)) for m in map(pattern.match, names) if m])
+
+    def delete(self, step):
+        """Drop a manifest. Call `gc()` afterwards to free its chunks."""
+        os.remove(self._manifest_path(step))
+
+    def gc(self):
+        """Remove chunks that no manifest refers to. Returns how many."""
+        live = set()
+        for step in self.steps():
+            with open(self._manifest_path(step), 'r') as fh:
+                for info in json.load(fh).values():
+                    live.update(info['chunks'])
+        removed = 0
+        for sub in os.listdir(join(self.root, 'chunks')):
+            for digest in os.listdir(join(self.root, 'chunks', sub)):
+                if digest not in live:
+                    os.remove(join(self.root, 'chunks', sub, digest))
+                    removed += 1
+        return removed
+
+    def disk_usage(self):
+        """Total bytes on disk, for comparing against plain checkpoints."""
+        total = 0
+        for dirpath,_,fnames in os.walk(self.root):
+            total += sum(os.path.getsize(join(dirpath,f)) for f in fnames)
+        return total
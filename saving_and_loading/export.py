@@ -0,0 +1,83 @@
+""" Export a training checkpoint as a frozen SavedModel, for serving.
+
+The `checkpoints/epoch-N` files hold the full training graph: the input
+pipeline, labels, loss, Adam slots and all the gradient ops. For inference we
+only need images -> logits. So we:
+
+- import the meta graph with a fresh float `input` placeholder in place of
+  'images' (which otherwise defaults to the training iterator),
+- restore the checkpoint and fold every variable into a constant,
+- keep only the subgraph that 'logits' depends on, which drops the optimizer,
+  `cross_entropy_op` and its gradients, and strip Identity/CheckNumerics ops,
+- add softmax and argmax, and write a SavedModel (no variables) plus the bare
+  frozen `GraphDef`.
+
+    python export.py --ckpt checkpoints/epoch-9 --out exported/epoch-9
+
+Then `bench_serving.py --model exported/epoch-9` measures images/sec. Older
+checkpoints don't have a 'logits' node; use `--output fully_connected_2/BiasAdd`.
+"""
+import argparse, os, shutil
+import tensorflow as tf
+
+SIGNATURE = 'predict'
+
+
+def freeze(ckpt, output='logits'):
+    """Returns a frozen `GraphDef` from `input` (N,28,28,1) floats to `output`."""
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.float32, [None, 28, 28, 1], name='input')
+        saver = tf.train.import_meta_graph('{}.meta'.format(ckpt),
+                                           input_map={'images:0': images})
+        with tf.Session(graph=graph) as sess:
+            saver.restore(sess, ckpt)
+            # Also extracts the subgraph needed for `output`, nothing else.
+            frozen = tf.graph_util.convert_variables_to_constants(
+                    sess, graph.as_graph_def(), [output])
+    frozen = tf.graph_util.remove_training_nodes(frozen, protected_nodes=['input', output])
+    return frozen
+
+
+def write_saved_model(frozen, out_dir, output='logits'):
+    """Wrap the frozen graph with softmax/argmax and save it as a SavedModel."""
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.float32, [None, 28, 28, 1], name='images')
+        logits, = tf.import_graph_def(frozen, input_map={'input:0': images},
+                                      return_elements=['{}:0'.format(output)], name='')
+        probs = tf.nn.softmax(logits, name='probabilities')
+        classes = tf.argmax(logits, axis=1, name='classes')
+        signature = tf.saved_model.signature_def_utils.predict_signature_def(
+                inputs={'images': images},
+                outputs={'logits': logits, 'probabilities': probs, 'classes': classes})
+        builder = tf.saved_model.builder.SavedModelBuilder(out_dir)
+        with tf.Session(graph=graph) as sess:
+            builder.add_meta_graph_and_variables(
+                    sess, [tf.saved_model.tag_constants.SERVING],
+                    signature_def_map={SIGNATURE: signature})
+        builder.save()
+
+
+def export(ckpt, out_dir, output='logits', overwrite=False):
+    if os.path.exists(out_dir):
+        assert overwrite, "{} exists, use --overwrite".format(out_dir)
+        shutil.rmtree(out_dir)
+    frozen = freeze(ckpt, output)
+    write_saved_model(frozen, out_dir, output)
+    pb_path = os.path.join(out_dir, 'frozen.pb')
+    with open(pb_path, 'wb') as fh:
+        fh.write(frozen.SerializeToString())
+    print("frozen graph: {} nodes, {:.1f} KB".format(len(frozen.node), frozen.ByteSize() / 1e3))
+    print("saved: {} (SavedModel) and {}".format(out_dir, pb_path))
+
+
+if __name__ == '__main__':
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--ckpt', type=str, required=True)
+    pp.add_argument('--out', type=str, default=None)
+    pp.add_argument('--output', type=str, default='logits')
+    pp.add_argument('--overwrite', action='store_true', default=False)
+    args = pp.parse_args()
+    out_dir = args.out or os.path.join('exported', os.path.basename(args.ckpt))
+    export(args.ckpt, out_dir, output=args.output, overwrite=args.overwrite)
@@ -0,0 +1,92 @@
+""" `tf.data` input pipeline for MNIST, so we don't `feed_dict` every batch.
+
+Before, each step sliced numpy arrays, did `np.expand_dims` and fed the batch
+through `feed_dict`, all on the Python thread, while the graph waited. Here the
+raw uint8 arrays are fed ONCE (through placeholders, so they aren't baked into
+the graph as huge constants) into iterators that shuffle, batch, convert to
+float, and `prefetch` in the background. The model reads from a feedable
+iterator, so one graph can switch between the train and test data by feeding a
+string handle.
+
+The model inputs are still named 'images' and 'labels', but as
+`tf.placeholder_with_default`s on top of the iterator, so anything that feeds
+`images:0` and `labels:0` (like older versions of `load.py`) still works.
+"""
+import tensorflow as tf
+
+
+def _to_float(images, labels):
+    """uint8 (...,28,28) images to float (...,28,28,1) in [0,1]; float labels."""
+    images = tf.expand_dims(tf.cast(images, tf.float32) / 255.0, axis=-1)
+    return images, tf.cast(labels, tf.float32)
+
+
+def train_dataset(x, y, batch_size, cache=False, prefetch=2, seed=None):
+    """Shuffled, repeated batches from tensors `x` (N,28,28) and `y` (N,).
+
+    With `cache`, we convert each image once and keep the floats in memory
+    (4x larger than uint8); otherwise we convert one batch at a time.
+    """
+    data = tf.data.Dataset.from_tensor_slices((x, y))
+    if cache:
+        data = data.map(_to_float).cache()
+    data = data.shuffle(buffer_size=60000, seed=seed).repeat().batch(batch_size)
+    if not cache:
+        data = data.map(_to_float)
+    return data.prefetch(prefetch)
+
+
+def test_dataset(x, y, batch_size, cache=False, prefetch=2, repeat=True):
+    """Batches in order. The final batch is smaller if `batch_size` doesn't
+    divide N. With `repeat`, take `ceil(N/batch_size)` batches per pass."""
+    data = tf.data.Dataset.from_tensor_slices((x, y)).batch(batch_size).map(_to_float)
+    if cache:
+        data = data.cache()
+    if repeat:
+        data = data.repeat()
+    return data.prefetch(prefetch)
+
+
+class MnistInput(object):
+    """Train and test iterators behind one pair of 'images', 'labels' tensors.
+
+    Build this before the model, then after initializing variables, call
+    `initialize` with the arrays. Pass `train_feed` or `test_feed` to
+    `sess.run` to pick which data the model sees.
+    """
+
+    def __init__(self, batch_size=100, test_batch_size=100, cache=False, prefetch=2, seed=None):
+        self.batch_size = batch_size
+        self.test_batch_size = test_batch_size
+        self.x_train_ph = tf.placeholder(tf.uint8, [None, 28, 28])
+        self.y_train_ph = tf.placeholder(tf.uint8, [None])
+        self.x_test_ph = tf.placeholder(tf.uint8, [None, 28, 28])
+        self.y_test_ph = tf.placeholder(tf.uint8, [None])
+
+        train = train_dataset(self.x_train_ph, self.y_train_ph, batch_size,
+                              cache=cache, prefetch=prefetch, seed=seed)
+        test = test_dataset(self.x_test_ph, self.y_test_ph, test_batch_size,
+                            cache=cache, prefetch=prefetch)
+        self.train_iter = train.make_initializable_iterator()
+        self.test_iter = test.make_initializable_iterator()
+        self.train_handle_op = self.train_iter.string_handle()
+        self.test_handle_op = self.test_iter.string_handle()
+
+        self.handle_ph = tf.placeholder(tf.string, shape=[])
+        iterator = tf.data.Iterator.from_string_handle(
+                self.handle_ph, train.output_types, train.output_shapes)
+        images, labels = iterator.get_next()
+        self.images = tf.placeholder_with_default(images, [None, 28, 28, 1], name='images')
+        self.labels = tf.placeholder_with_default(labels, [None], name='labels')
+
+    def initialize(self, sess, x_train, y_train, x_test, y_test):
+        """Feed the raw uint8 arrays, once. Both iterators repeat forever, so
+        use `train_steps` and `test_steps` batches for one pass."""
+        sess.run([self.train_iter.initializer, self.test_iter.initializer],
+                 {self.x_train_ph: x_train, self.y_train_ph: y_train,
+                  self.x_test_ph: x_test, self.y_test_ph: y_test})
+        train_handle, test_handle = sess.run([self.train_handle_op, self.test_handle_op])
+        self.train_feed = {self.handle_ph: train_handle}
+        self.test_feed = {self.handle_ph: test_handle}
+        self.train_steps = len(x_train) // self.batch_size
+        self.test_steps = (len(x_test) + self.test_batch_size - 1) // self.test_batch_size
@@ -1,7 +1,21 @@
-"""Practice with loading."""
-import argparse, random, sys, datetime
+"""Practice with loading.
+
+All the `checkpoints/epoch-N` files share the same graph, so we import the meta
+graph only ONCE, and then for each checkpoint we only restore variable values.
+(Calling `tf.train.import_meta_graph` per checkpoint adds another full copy of
+the graph to the default graph each time, so memory and restore times grow.)
+With `--num_procs K`, checkpoints are split over K processes, each of which
+imports the graph once. Either way we end with one table, also saved as CSV.
+With `--store DIR`, we evaluate the epochs in a `ckpt_store.CheckpointStore`.
+Test batches come from a `tf.data` iterator wired into the imported graph's
+'images' and 'labels' inputs, instead of numpy slicing + `feed_dict`.
+"""
+import argparse, random, sys, datetime, functools, multiprocessing, os, re
 import tensorflow as tf
 import numpy as np
+from ckpt_store import CheckpointStore
+from input_pipeline import test_dataset
+from streaming_eval import StreamingEval
 np.set_printoptions(edgeitems=10, suppress=True)
 mnist = tf.keras.datasets.mnist
 slim = tf.contrib.slim
@@ -17,53 +31,144 @@ def debug():
 
     # Only if you want to print everything. Note: doesn't include `:0` part.
     if False:
-        names = sorted([tensor.name 
+        names = sorted([tensor.name
                 for tensor in tf.get_default_graph().as_graph_def().node])
         for nn in names:
             print(nn)
         sys.exit()
 
 
-def load():
-    # load data (should be shuffled already) and build graph
+def list_checkpoints(ckpt_dir='checkpoints', prefix='epoch'):
+    """Returns [(epoch, path)] sorted by epoch, e.g., (3, 'checkpoints/epoch-3').
+
+    For restoring, don't include the stuff from the `data`, i.e. use `name`,
+    not `name.data-00000-of-00001`. We find them via the `.index` files.
+    """
+    pattern = re.compile(r'^{}-(\d+)\.index$'.format(prefix))
+    ckpts = []
+    for fname in os.listdir(ckpt_dir):
+        match = pattern.match(fname)
+        if match:
+            ep = int(match.group(1))
+            ckpts.append((ep, os.path.join(ckpt_dir, '{}-{}'.format(prefix, ep))))
+    return sorted(ckpts)
+
+
+class Evaluator(object):
+    """Imports the meta graph once, into its own graph, then restores many times.
+
+    The test data is fed once into a `tf.data` iterator, which we plug into the
+    graph's 'images' and 'labels' tensors with `input_map` on import. If
+    `store` is a `CheckpointStore`, checkpoints are epochs in that store.
+    """
+
+    def __init__(self, meta_path, x_test, y_test, bs=100, store=None):
+        self.store = store
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            x_ph = tf.placeholder(tf.uint8, [None, 28, 28])
+            y_ph = tf.placeholder(tf.uint8, [None])
+            test = test_dataset(x_ph, y_ph, bs, cache=True)
+            test_iter = test.make_initializable_iterator()
+            images, labels = test_iter.get_next()
+            self.steps = (len(x_test) + bs - 1) // bs
+            self.saver = tf.train.import_meta_graph(meta_path,
+                    input_map={'images:0': images, 'labels:0': labels})
+            self.variables = tf.global_variables()
+            # How we extract individual tensors. Note the `:0`.
+            self.accuracy_op = self.graph.get_tensor_by_name("accuracy_op:0")
+            self.cross_entropy_op = self.graph.get_tensor_by_name("cross_entropy_op:0")
+            self.test_eval = StreamingEval(
+                    {'accuracy': self.accuracy_op, 'loss': self.cross_entropy_op},
+                    batch_size=tf.shape(labels)[0])
+        # Nothing should be added to the graph from now on.
+        self.graph.finalize()
+        self.sess = tf.Session(graph=self.graph)
+        self.sess.run(test_iter.initializer, {x_ph: x_test, y_ph: y_test})
+
+    def evaluate(self, ckpt):
+        """Restore `ckpt` (values only) and return (test accuracy, test loss)."""
+        if self.store is not None:
+            self.store.restore(self.sess, ckpt, self.variables)
+        else:
+            self.saver.restore(self.sess, ckpt)
+        result = self.test_eval.evaluate(self.sess, self.steps)
+        return result['accuracy'], result['loss']
+
+    def close(self):
+        self.sess.close()
+
+
+def _test_data():
+    """Raw uint8 arrays; the input pipeline scales images to [0,1]."""
     (x_train, y_train),(x_test, y_test) = mnist.load_data()
-    x_train = x_train / 255.0
-    x_test = x_test / 255.0
-
-    for ep in range(0,9):
-        # It's a two-step process. For restoring, don't include the stuff
-        # from the `data`, i.e. use `name`, not `name.data-00000-of-00001`.
-        sess = tf.Session()
-        saver = tf.train.import_meta_graph('checkpoints/epoch-{}.meta'.format(ep))
-        saver.restore(sess, 'checkpoints/epoch-{}'.format(ep))
-        if ep == 0:
+    return x_test, y_test
+
+
+def evaluate_checkpoints(ckpts, verbose=False, store_dir=None):
+    """Evaluate [(epoch, path)] in this process. Returns [(epoch, acc, loss)].
+
+    With `store_dir`, the 'paths' are just the epochs in that store.
+    """
+    x_test, y_test = _test_data()
+    if store_dir is not None:
+        store = CheckpointStore(store_dir)
+        evaluator = Evaluator(store.meta_path, x_test, y_test, store=store)
+    else:
+        evaluator = Evaluator('{}.meta'.format(ckpts[0][1]), x_test, y_test)
+    if verbose:
+        with evaluator.graph.as_default():
             debug()
+    rows = []
+    for ep,ckpt in ckpts:
+        # `epoch-N` is saved after N+1 epochs of training, so report N+1 to
+        # line up with the test performance printed by `train.py`.
+        acc_test, loss_test = evaluator.evaluate(ckpt)
+        rows.append((ep+1, acc_test, loss_test))
+        if verbose:
+            print("{}, {:.3f}, {:.5f}".format(ep+1, acc_test, loss_test))
+    evaluator.close()
+    return rows
+
+
+def load(ckpt_dir='checkpoints', num_procs=1, out_csv=None, store_dir=None):
+    if store_dir is not None:
+        ckpts = [(ep, ep) for ep in CheckpointStore(store_dir).steps()]
+        ckpt_dir = store_dir
+    else:
+        ckpts = list_checkpoints(ckpt_dir)
+    assert len(ckpts) > 0, "no checkpoints in: {}".format(ckpt_dir)
+    if num_procs <= 1:
+        rows = evaluate_checkpoints(ckpts, verbose=True, store_dir=store_dir)
+    else:
+        # Spawn, since TF doesn't like being forked after it's initialized.
+        # Interleave so each process gets early and late epochs.
+        chunks = [ckpts[i::num_procs] for i in range(num_procs)]
+        chunks = [c for c in chunks if len(c) > 0]
+        pool = multiprocessing.get_context('spawn').Pool(len(chunks))
+        func = functools.partial(evaluate_checkpoints, store_dir=store_dir)
+        rows = [r for chunk in pool.map(func, chunks) for r in chunk]
+        pool.close()
+        pool.join()
+    rows = sorted(rows)
 
-        # How we extract individual tensors. Note the `:0`.
-        graph = tf.get_default_graph()
-        images_ph = graph.get_tensor_by_name("images:0")
-        labels_ph = graph.get_tensor_by_name("labels:0")
-        accuracy_op = graph.get_tensor_by_name("accuracy_op:0")
-        cross_entropy_op = graph.get_tensor_by_name("cross_entropy_op:0")
-
-        # Test and see if we get same test-time performance.
-        bs = 100
-        cum_acc = 0.0
-        cum_loss = 0.0
-        k = 0
-        for start in range(0, 10000, bs):
-            k += 1
-            xs = np.expand_dims(x_test[start : start+bs], axis=3)
-            ys = y_test[start : start+bs]
-            feed_dict = {images_ph:xs, labels_ph:ys}
-            acc_test, loss_test = sess.run([accuracy_op, cross_entropy_op], feed_dict)
-            cum_acc += acc_test
-            cum_loss += loss_test
-        acc_test = cum_acc / float(k)
-        loss_test = cum_loss / float(k)
-
-        print("{}, {:.3f}, {:.5f}".format(ep+1, acc_test, loss_test))
+    print("\nepoch, test_accuracy, test_loss")
+    for ep,acc_test,loss_test in rows:
+        print("{}, {:.3f}, {:.5f}".format(ep, acc_test, loss_test))
+    if out_csv is None:
+        out_csv = os.path.join(ckpt_dir, 'eval.csv')
+    with open(out_csv, 'w') as fh:
+        fh.write("epoch,test_accuracy,test_loss\n")
+        for ep,acc_test,loss_test in rows:
+            fh.write("{},{:.5f},{:.5f}\n".format(ep, acc_test, loss_test))
+    print("saved: {}".format(out_csv))
+    return rows
 
 
 if __name__ == '__main__':
-    load()
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--ckpt_dir', type=str, default='checkpoints')
+    pp.add_argument('--num_procs', type=int, default=1)
+    pp.add_argument('--store', type=str, default=None)
+    args = pp.parse_args()
+    load(ckpt_dir=args.ckpt_dir, num_procs=args.num_procs, store_dir=args.store)
@@ -0,0 +1,40 @@
+""" Exact dataset-level evaluation with streaming metric ops.
+
+We used to `sess.run` the batch accuracy and loss 100 times and average them in
+Python, which is only right if every batch has the same size. Here each metric
+is a `tf.metrics.mean` of the batch value weighted by the batch size, so its
+local accumulator variables hold the sum over examples and the count. Per batch
+we only run the update ops; at the end ONE fetch gives the exact accuracy and
+loss over the whole set, ragged final batch included.
+
+Since it only needs the batch means, this also works on graphs imported from
+older checkpoints, which only have 'accuracy_op' and 'cross_entropy_op'.
+"""
+import tensorflow as tf
+
+
+class StreamingEval(object):
+
+    def __init__(self, metrics, batch_size, scope='streaming_eval'):
+        """`metrics` is a dict from name to a scalar per-batch mean tensor, and
+        `batch_size` the (dynamic) number of examples in the batch."""
+        self.names = sorted(metrics.keys())
+        weights = tf.cast(batch_size, tf.float32)
+        values = []
+        updates = []
+        with tf.variable_scope(scope):
+            for name in self.names:
+                value, update = tf.metrics.mean(metrics[name], weights=weights, name=name)
+                values.append(value)
+                updates.append(update)
+        self.values = values
+        self.update_op = tf.group(*updates)
+        local_vars = tf.get_collection(tf.GraphKeys.LOCAL_VARIABLES, scope=scope)
+        self.reset_op = tf.variables_initializer(local_vars)
+
+    def evaluate(self, sess, steps, feed_dict=None):
+        """Run `steps` batches, then return {name: value} over all of them."""
+        sess.run(self.reset_op)
+        for _ in range(steps):
+            sess.run(self.update_op, feed_dict)
+        return dict(zip(self.names, sess.run(self.values)))
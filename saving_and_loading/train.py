@@ -2,6 +2,10 @@
 import argparse, random, sys, datetime
 import tensorflow as tf
 import numpy as np
+from async_ckpt import AsyncCheckpointer
+from ckpt_store import CheckpointStore
+from input_pipeline import MnistInput
+from streaming_eval import StreamingEval
 np.set_printoptions(edgeitems=10, suppress=True)
 mnist = tf.keras.datasets.mnist
 slim = tf.contrib.slim
@@ -25,19 +29,10 @@ def train_keras():
     model.evaluate(x_test, y_test)
 
 
-def train_slim():
-    # load data (should be shuffled already) and build graph
-    (x_train, y_train),(x_test, y_test) = mnist.load_data()
-    x_train = x_train / 255.0
-    x_test = x_test / 255.0
-    print(x_train.shape, x_train.dtype)
-    print(y_train.shape, y_train.dtype)
-    print(x_test.shape, x_test.dtype)
-    print(y_test.shape, y_test.dtype)
-
+def build_net(images_ph, labels_ph):
+    """The slim CNN. Returns (logits, cross_entropy_op, accuracy_op, train_op),
+    named so `load.py` can find them in the meta graph."""
     # For one-hot, depth=10 because there are 10 classes.
-    images_ph = tf.placeholder(tf.float32, [None, 28, 28, 1], name='images')
-    labels_ph = tf.placeholder(tf.float32, [None], name='labels')
     labels_ph_one_hot = tf.one_hot(tf.cast(labels_ph, tf.int32), depth=10)
 
     print("\nhere's the network input style:")
@@ -65,7 +60,8 @@ def train_slim():
         print(net)
     print("")
 
-    logits_ph = net
+    # Named, so `export.py` knows where the inference graph ends.
+    logits_ph = tf.identity(net, name='logits')
 
     # Training Operations
     # Note: use `_v2` as original version of softmax(C.E.) is deprecated.
@@ -77,6 +73,25 @@ def train_slim():
     correct_op = tf.equal(tf.argmax(logits_ph, 1), tf.argmax(labels_ph_one_hot, 1))
     accuracy_op = tf.reduce_mean(tf.cast(correct_op, tf.float32), name='accuracy_op')
     train_op = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy_op)
+    return logits_ph, cross_entropy_op, accuracy_op, train_op
+
+
+def train_slim(args):
+    # load data (should be shuffled already) and build graph
+    # Keep the raw uint8 arrays; the input pipeline converts to float in [0,1].
+    (x_train, y_train),(x_test, y_test) = mnist.load_data()
+    print(x_train.shape, x_train.dtype)
+    print(y_train.shape, y_train.dtype)
+    print(x_test.shape, x_test.dtype)
+    print(y_test.shape, y_test.dtype)
+
+    # The model reads batches straight from the `tf.data` iterators; the
+    # 'images' and 'labels' tensors can still be fed if needed.
+    bs = 100
+    inp = MnistInput(batch_size=bs, test_batch_size=bs, cache=args.cache)
+    logits_ph, cross_entropy_op, accuracy_op, train_op = build_net(inp.images, inp.labels)
+    test_eval = StreamingEval({'accuracy': accuracy_op, 'loss': cross_entropy_op},
+                              batch_size=tf.shape(inp.labels)[0])
 
     # Initialize. Also, tf.train.Saver() must be done _after_ creating variables
     # First argument is `var_list` but if None, then save all saveable variables
@@ -85,34 +100,28 @@ def train_slim():
     saver = tf.train.Saver(max_to_keep=None)
     sess = tf.Session()
     sess.run(tf.global_variables_initializer())
+    inp.initialize(sess, x_train, y_train, x_test, y_test)
+    ckpt_name = "checkpoints/epoch"
+    if args.async_ckpt:
+        ckpt = AsyncCheckpointer(sess, saver, ckpt_name, keep_last=args.keep_last,
+                                 keep_every=args.keep_every)
+    if args.store:
+        store = CheckpointStore(args.store)
+        store.put_meta_graph(tf.train.export_meta_graph(saver_def=saver.saver_def))
+        store_vars = tf.global_variables()
 
     # train
-    bs = 100
     print("epoch, test_accuracy, test_loss")
 
     for ep in range(0,10):
-        # I know, lame, only works if even number of testing instances in each batch
-        cum_acc = 0.0
-        cum_loss = 0.0
-        k = 0
-        for start in range(0, 10000, bs):
-            k += 1
-            xs = np.expand_dims(x_test[start : start+bs], axis=3)
-            ys = y_test[start : start+bs]
-            feed_dict = {images_ph:xs, labels_ph:ys}
-            acc_test, loss_test = sess.run([accuracy_op, cross_entropy_op], feed_dict)
-            cum_acc += acc_test
-            cum_loss += loss_test
-        acc_test = cum_acc / float(k)
-        loss_test = cum_loss / float(k)
+        # Exact over all test images, even if the last batch is smaller.
+        result = test_eval.evaluate(sess, inp.test_steps, inp.test_feed)
+        acc_test, loss_test = result['accuracy'], result['loss']
         print("{}, {:.3f}, {:.5f}".format(ep, acc_test, loss_test))
 
         # After evaluation b/c I wanted to see performance before any training
-        for start in range(0, 60000, bs):
-            xs = np.expand_dims(x_train[start : start+bs], axis=3)
-            ys = y_train[start : start+bs]
-            feed_dict = {images_ph:xs, labels_ph:ys}
-            _, loss_train = sess.run([train_op, cross_entropy_op], feed_dict)
+        for _ in range(inp.train_steps):
+            _, loss_train = sess.run([train_op, cross_entropy_op], inp.train_feed)
 
         # Can use `curr_time` if you want unique file names.
         # curr_time = datetime.datetime.now().strftime('%m_%d_%H_%M_%S')
@@ -124,13 +133,36 @@ def train_slim():
         # etc....
         # https://www.tensorflow.org/guide/checkpoints
         # https://www.tensorflow.org/guide/saved_model
-        ckpt_name = "checkpoints/epoch"
-        saver.save(sess, ckpt_name, global_step=ep)
+        # With `--async_ckpt`, only the snapshot happens here, not the writing.
+        # With `--store`, unchanged chunks are shared with earlier epochs.
+        if args.store:
+            values = sess.run(store_vars)
+            store.put(ep, {v.op.name: val for v,val in zip(store_vars, values)})
+        elif args.async_ckpt:
+            ckpt.save(ep)
+        else:
+            saver.save(sess, ckpt_name, global_step=ep)
+
+    if args.async_ckpt:
+        ckpt.close()
+    if args.store:
+        print("store: {}, {:.1f} MB on disk".format(args.store, store.disk_usage() / 1e6))
 
 
 if __name__ == '__main__':
+    pp = argparse.ArgumentParser()
+    ckpt_mode = pp.add_mutually_exclusive_group()
+    # Write checkpoints on a background thread, keeping only some of them.
+    ckpt_mode.add_argument('--async_ckpt', action='store_true', default=False)
+    pp.add_argument('--keep_last', type=int, default=3)
+    pp.add_argument('--keep_every', type=int, default=5)
+    # Or save to a deduplicated, compressed store (see `ckpt_store.py`).
+    ckpt_mode.add_argument('--store', type=str, default=None)
+    # Keep the float-converted data in the `tf.data` pipeline's memory cache.
+    pp.add_argument('--cache', action='store_true', default=False)
+    args = pp.parse_args()
     seed = 1
     np.random.seed(seed)
     random.seed(seed)
     tf.set_random_seed(seed)
-    train_slim()
+    train_slim(args)
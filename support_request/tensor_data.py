@@ -0,0 +1,153 @@
+"""Keep the whole (small) data set in memory as one uint8 tensor.
+
+`build_data.py` writes the 115 items of `data_raw_115_items.pkl` as PNGs, then
+`train.py` reads them back with `ImageFolder` and 4 workers, decoding and
+augmenting one image at a time. But all of it is only ~100MB as uint8, so here
+we load the pickle straight into a (N,3,480,640) tensor, and do the same
+augmentations on a whole minibatch at once in the main process: each crop (and
+flip) is an affine map, so one `grid_sample` call does the crop + resize for
+all images. No PNG round trip and no worker processes.
+"""
+import torch
+import torch.nn.functional as F
+import math, pickle, sys
+import numpy as np
+
+# Same as `ImageFolder` on 'failure' and 'success' directories, i.e., sorted.
+CLASS_NAMES = ['failure', 'success']
+
+
+def load_raw_tensors(path, device='cpu'):
+    """Returns (images, labels): (N,3,H,W) uint8 and (N,) long tensors.
+
+    In the pickle, class 0 is success and 1 is failure, so we flip the labels to
+    match the indices `ImageFolder` gives to CLASS_NAMES.
+    """
+    with open(path, 'rb') as fh:
+        data = pickle.load(fh)
+    images = np.stack([item['d_img'] for item in data])   # (N,H,W,3)
+    images = torch.from_numpy(images).permute(0,3,1,2).contiguous()
+    labels = torch.tensor([1 - int(item['class']) for item in data], dtype=torch.long)
+    return images.to(device), labels.to(device)
+
+
+def random_split(N, frac_train=0.8):
+    """Random train and valid indices, as in `build_data.py`."""
+    indx_random = torch.randperm(N)
+    return {'train': indx_random[ : int(N*frac_train)],
+            'valid': indx_random[int(N*frac_train) : ]}
+
+
+def _random_resized_boxes(N, H, W, scale, ratio, attempts=10):
+    """Batched version of `transforms.RandomResizedCrop.get_params`.
+
+    Returns (N,4) float boxes (top, left, height, width) in pixels. Like
+    torchvision, we retry samples that don't fit, and otherwise fall back to
+    the largest centered crop with an allowed aspect ratio.
+    """
+    area = float(H * W)
+    boxes = torch.zeros(N, 4)
+    done = torch.zeros(N, dtype=torch.bool)
+    log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+
+    for _ in range(attempts):
+        target_area = area * torch.empty(N).uniform_(scale[0], scale[1])
+        aspect = torch.exp(torch.empty(N).uniform_(log_ratio[0], log_ratio[1]))
+        w = torch.round(torch.sqrt(target_area * aspect))
+        h = torch.round(torch.sqrt(target_area / aspect))
+        ok = (w <= W) & (h <= H) & (w > 0) & (h > 0) & (~done)
+        top  = torch.floor(torch.rand(N) * (H - h + 1))
+        left = torch.floor(torch.rand(N) * (W - w + 1))
+        boxes[ok] = torch.stack((top, left, h, w), dim=1)[ok]
+        done = done | ok
+        if bool(done.all()):
+            return boxes
+
+    # Fallback: whole image, clamped to the allowed aspect ratios, centered.
+    in_ratio = W / float(H)
+    if in_ratio < min(ratio):
+        w, h = W, int(round(W / min(ratio)))
+    elif in_ratio > max(ratio):
+        h, w = H, int(round(H * max(ratio)))
+    else:
+        h, w = H, W
+    fallback = torch.tensor([(H - h) // 2, (W - w) // 2, h, w], dtype=torch.float)
+    boxes[~done] = fallback
+    return boxes
+
+
+def _center_boxes(N, H, W, resize, crop):
+    """Boxes equivalent to `Resize(resize)` then `CenterCrop(crop)`."""
+    s = float(resize) / min(H, W)           # shorter side goes to `resize`
+    h, w = crop / s, crop / s
+    box = torch.tensor([(H - h) / 2.0, (W - w) / 2.0, h, w])
+    return box.repeat(N, 1)
+
+
+def crop_resize(images, boxes, size, flip=None):
+    """Crop each image to its box and resize to (size,size), in one op.
+
+    `images` is (B,3,H,W) float, `boxes` is (B,4) as (top, left, height, width)
+    in pixels, and `flip` is an optional (B,) bool tensor of horizontal flips.
+    """
+    B, _, H, W = images.shape
+    top, left, h, w = [boxes[:,i].to(images.device) for i in range(4)]
+    theta = torch.zeros(B, 2, 3, device=images.device)
+    theta[:,0,0] = w / W
+    theta[:,0,2] = (2.0 * left + w) / W - 1.0
+    theta[:,1,1] = h / H
+    theta[:,1,2] = (2.0 * top + h) / H - 1.0
+    if flip is not None:
+        theta[:,0,0] = torch.where(flip.to(images.device), -theta[:,0,0], theta[:,0,0])
+    grid = F.affine_grid(theta, (B, 3, size, size), align_corners=False)
+    return F.grid_sample(images, grid, mode='bilinear', padding_mode='border',
+                         align_corners=False)
+
+
+class TensorBatches(object):
+    """Iterate over augmented (inputs, labels) minibatches from uint8 tensors.
+
+    For 'train', matches `RandomResizedCrop(224)` (+ optional flip), then
+    `ToTensor()` and `Normalize(mean, std)`. For 'valid', matches `Resize(256)`,
+    `CenterCrop(224)`, `ToTensor()`, `Normalize(mean, std)`. Images stay on
+    whatever device `images` is on, so the augmentation can run on the GPU.
+    """
+
+    def __init__(self, images, labels, indices, mean, std, phase, batch_size=32,
+                 shuffle=True, size=224, scale=(0.08, 1.0), ratio=(3./4., 4./3.),
+                 flip=False):
+        self.images = images
+        self.labels = labels
+        self.indices = indices
+        self.phase = phase
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.flip = flip
+        self.mean = torch.tensor(mean, device=images.device).view(1,3,1,1)
+        self.std  = torch.tensor(std,  device=images.device).view(1,3,1,1)
+
+    def __len__(self):
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
+
+    def _augment(self, imgs):
+        B, _, H, W = imgs.shape
+        imgs = imgs.float().div(255)
+        if self.phase == 'train':
+            boxes = _random_resized_boxes(B, H, W, self.scale, self.ratio)
+            flip = (torch.rand(B) < 0.5) if self.flip else None
+        else:
+            boxes = _center_boxes(B, H, W, resize=256, crop=self.size)
+            flip = None
+        imgs = crop_resize(imgs, boxes, self.size, flip=flip)
+        return (imgs - self.mean) / self.std
+
+    def __iter__(self):
+        order = self.indices
+        if self.shuffle:
+            order = order[torch.randperm(len(order))]
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start : start+self.batch_size].to(self.images.device)
+            yield self._augment(self.images[idx]), self.labels[idx]
@@ -4,13 +4,17 @@ import torch.optim as optim
 from torch.optim import lr_scheduler
 import torchvision.models as models
 from torchvision import datasets, transforms
-import copy, cv2, os, sys, pickle, time
+import argparse, copy, cv2, os, sys, pickle, time
 import numpy as np
 from os.path import join
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+from classifier_eval import ConfusionMatrix
+import tensor_data
 
 # ------------------------------------------------------------------------------
 TARGET = 'tmp/'
 TEST_IMG = 'debug_img/'
+RAW_PICKLE_FILE = 'data_raw_115_items.pkl'
 
 # When dealing with mean and std, need to use a three-item list.
 # Also, since we call ToTensor(), we want mean/std for *scaled* data.
@@ -79,13 +83,31 @@ def _save_images(inputs, labels, phase):
         cv2.imwrite(fname, img)
 
 
-def train(model):
+def _in_memory_loaders(device):
+    """Same data and augmentation as the `ImageFolder` loaders, from RAM.
+
+    Loads RAW_PICKLE_FILE directly (no need for `build_data.py`) and does a new
+    random 80/20 split. See `tensor_data.py`.
+    """
+    images, labels = tensor_data.load_raw_tensors(RAW_PICKLE_FILE, device=device)
+    indices = tensor_data.random_split(len(labels))
+    dataloaders = {x: tensor_data.TensorBatches(images, labels, indices[x], MEAN, STD,
+                        phase=x, batch_size=32, shuffle=True) for x in ['train', 'valid']}
+    dataset_sizes = {x: len(indices[x]) for x in ['train', 'valid']}
+    return dataloaders, dataset_sizes, tensor_data.CLASS_NAMES
+
+
+def train(model, in_memory=False):
     """From this tutorial with minor edits:
     https://pytorch.org/tutorials/beginner/data_loading_tutorial.html
 
     BTW: you need the `ToTensor()` BEFORE `Normalize()`. And because of this, we
     want the MEAN and STD to reflect the *scaled* images, NOT the raw ones.
+
+    With `in_memory=True` we skip the PNGs and workers entirely, and augment
+    whole minibatches of an in-memory uint8 tensor instead.
     """
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     data_transforms = {
         'train': transforms.Compose([
             transforms.RandomResizedCrop(224),
@@ -99,15 +121,17 @@ def train(model):
             transforms.Normalize(MEAN, STD)
         ]),
     }
-    image_datasets = {x: datasets.ImageFolder(join(TARGET,x), data_transforms[x]) 
-                        for x in ['train', 'valid']}
-    dataloaders    = {x: torch.utils.data.DataLoader(image_datasets[x],
-                        batch_size=32, shuffle=True, num_workers=4)
-                          for x in ['train', 'valid']}
-    dataset_sizes  = {x: len(image_datasets[x]) for x in ['train', 'valid']}
-    class_names    = image_datasets['train'].classes
+    if in_memory:
+        dataloaders, dataset_sizes, class_names = _in_memory_loaders(device)
+    else:
+        image_datasets = {x: datasets.ImageFolder(join(TARGET,x), data_transforms[x]) 
+                            for x in ['train', 'valid']}
+        dataloaders    = {x: torch.utils.data.DataLoader(image_datasets[x],
+                            batch_size=32, shuffle=True, num_workers=4)
+                              for x in ['train', 'valid']}
+        dataset_sizes  = {x: len(image_datasets[x]) for x in ['train', 'valid']}
+        class_names    = image_datasets['train'].classes
 
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     print("\nNow training!! On device: {}".format(device))
     print("class_names: {}".format(class_names))
     print("dataset_sizes: {}\n".format(dataset_sizes))
@@ -142,8 +166,7 @@ def train(model):
                 model.train()  # Set model to training mode
             else:
                 model.eval()   # Set model to evaluate mode
-            running_loss = 0.0
-            running_corrects = 0
+            meter = ConfusionMatrix(num_classes=2, device=device)
 
             # Iterate over data and labels (minibatches), by default, for one epoch.
             for inputs, labels in dataloaders[phase]:
@@ -160,7 +183,6 @@ def train(model):
                 # forward: track (gradient?) history _only_ if training
                 with torch.set_grad_enabled(phase == 'train'):
                     outputs = model(inputs)             # forward pass
-                    _, preds = torch.max(outputs, 1)    # returns (max vals, indices)
                     loss = criterion(outputs, labels)
 
                     # backward + optimize only if in training phase
@@ -168,14 +190,15 @@ def train(model):
                         loss.backward()
                         optimizer.step()
 
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
+                # Summed (not averaged) loss; stays on the device, no `.item()`.
+                meter.update(outputs.detach(), labels, loss.detach() * inputs.size(0))
 
-            # We summed (not averaged) the losses earlier, so divide by full size.
-            epoch_loss = running_loss / dataset_sizes[phase]
-            epoch_acc = running_corrects.double() / dataset_sizes[phase]
-            print('({})  Loss: {:.4f}, Acc: {:.4f} (num right: {})'.format(
-                    phase, epoch_loss, epoch_acc, running_corrects))
+            # One copy to the CPU per phase, see `classifier_eval.py`.
+            results = meter.results()
+            epoch_loss, epoch_acc = results['loss'], results['accuracy']
+            print('({})  Loss: {:.4f}, Acc: {:.4f} (num right: {}), per class: {}'.format(
+                    phase, epoch_loss, epoch_acc, int(results['confusion'].diag().sum()),
+                    ' '.join('{:.3f}'.format(a) for a in results['per_class'])))
             if phase == 'valid' and epoch_acc > best_acc:
                 best_acc = epoch_acc
 
@@ -185,5 +208,9 @@ def train(model):
 
 
 if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    # Load the raw pickle into memory, instead of the `build_data.py` PNGs.
+    pp.add_argument('--in_memory', action='store_true', default=False)
+    args = pp.parse_args()
     resnet18 = models.resnet18(pretrained=True)
-    train(resnet18)
+    train(resnet18, in_memory=args.in_memory)
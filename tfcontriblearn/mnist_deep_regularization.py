@@ -12,8 +12,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import argparse
+import os
 import sys
-from tensorflow.examples.tutorials.mnist import input_data
+# Memory-mapped `.npy` copy of MNIST, converted once; see `mnist_cache.py`.
+# Relative to this file, not the working directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mnist_testing'))
+import mnist_cache
+from graph_batches import GraphBatches
 import tensorflow as tf
 import tensorflow.contrib.layers as layers
 import numpy as np
@@ -43,9 +48,15 @@ def easier_network(x, reg):
 
 
 def main(_):
-    mnist = input_data.read_data_sets(FLAGS.data_dir, one_hot=True)
-    x = tf.placeholder(tf.float32, [None, 784])
-    y_ = tf.placeholder(tf.float32, [None, 10])
+    mnist = mnist_cache.read_data_sets(FLAGS.data_dir, one_hot=True)
+    if FLAGS.graph_batches:
+        # Training minibatches come from the graph unless we feed x and y_.
+        batches = GraphBatches(mnist.train.images, mnist.train.labels, 50)
+        x = tf.placeholder_with_default(batches.images, [None, 784])
+        y_ = tf.placeholder_with_default(batches.labels, [None, 10])
+    else:
+        x = tf.placeholder(tf.float32, [None, 784])
+        y_ = tf.placeholder(tf.float32, [None, 10])
 
     # Make a network with regularization
     y_conv = easier_network(x, FLAGS.regu)
@@ -66,15 +77,21 @@ def main(_):
         tf.nn.softmax_cross_entropy_with_logits(labels=y_, logits=y_conv))
     loss_fn = cross_entropy + tf.reduce_sum(reg_ws)
     train_step = tf.train.AdamOptimizer(1e-4).minimize(loss_fn)
+    if FLAGS.graph_batches:
+        train_step = batches.advance_after(train_step)
     correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
     accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
 
     with tf.Session() as sess:
         sess.run(tf.global_variables_initializer())
+        if FLAGS.graph_batches:
+            batches.initialize(sess)
         # Training
         for i in range(5000):
-            batch = mnist.train.next_batch(50)
-            feed = {x: batch[0], y_: batch[1]}
+            feed = None
+            if not FLAGS.graph_batches:
+                batch = mnist.train.next_batch(50)
+                feed = {x: batch[0], y_: batch[1]}
             if i % 50 == 0:
                 train_accuracy = accuracy.eval(feed_dict=feed)
                 print('step %d, training accuracy %g' % (i, train_accuracy))
@@ -89,5 +106,6 @@ if __name__ == '__main__':
                         default='/tmp/tensorflow/mnist/input_data',
                         help='Directory for storing input data')
     parser.add_argument('--regu', type=float, default=0.0)
+    parser.add_argument('--graph_batches', action='store_true', default=False)
     FLAGS, unparsed = parser.parse_known_args()
     tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
@@ -0,0 +1,165 @@
+"""Streaming format for the bed-making cache files.
+
+The cache pickles (`grasp_list_of_dicts_*.pkl`, and those in
+`cache_combo_v03_success`) are each one big pickled list, so `pickle.load` has
+to hold every (480,640,3) frame in memory at once. Here we store the same items
+as length-prefixed records instead:
+
+    MAGIC, then for each item: an 8-byte little-endian length, then the pickled
+    item (the same dict as in the list, with protocol 2 so Python 2 can read it)
+
+and `iter_records` yields the items one at a time, so only one frame needs to
+be in memory. Use `convert_pickle` or `convert_dir` once per cache directory.
+
+Shared by `bedmake_grasp` and `bedmake_transition`; from there, add this
+directory to `sys.path` first, relative to the script, e.g.,
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+"""
+import os, pickle, re, struct, sys
+from os.path import join
+
+MAGIC  = b'BEDREC01'
+LENGTH = struct.Struct('<Q')
+SUFFIX = '.rec'
+
+
+def convert_pickle(pkl_path, rec_path):
+    """Convert one list-of-dicts pickle into a record file. Returns the length.
+
+    We can't avoid one full `pickle.load` of the old file, but we drop each item
+    from the list as soon as it is written, and it's one file at a time.
+    """
+    assert not os.path.exists(rec_path), "target exists:\n\t{}".format(rec_path)
+    with open(pkl_path, 'rb') as fh:
+        data = pickle.load(fh)
+    N = len(data)
+    data.reverse()
+    with open(rec_path, 'wb') as fh:
+        fh.write(MAGIC)
+        while data:
+            blob = pickle.dumps(data.pop(), protocol=2)
+            fh.write(LENGTH.pack(len(blob)))
+            fh.write(blob)
+    print("converted: {}  (len: {})".format(pkl_path, N))
+    return N
+
+
+def convert_dir(head, target):
+    """Convert all `.pkl` files in `head` to `.rec` files in `target`."""
+    if not os.path.exists(target):
+        os.makedirs(target)
+    pickle_files = sorted([x for x in os.listdir(head) if x[-4:] == '.pkl'])
+    for x in pickle_files:
+        convert_pickle(join(head,x), join(target, x[:-4] + SUFFIX))
+
+
+def _check_magic(fh, rec_path):
+    magic = fh.read(len(MAGIC))
+    assert magic == MAGIC, "not a record file:\n\t{}".format(rec_path)
+
+
+def iter_records(rec_path):
+    """Yield the items of a record file one at a time, in their original order."""
+    with open(rec_path, 'rb') as fh:
+        _check_magic(fh, rec_path)
+        while True:
+            header = fh.read(LENGTH.size)
+            if not header:
+                break
+            n, = LENGTH.unpack(header)
+            blob = fh.read(n)
+            assert len(blob) == n, "truncated record in {}".format(rec_path)
+            yield pickle.loads(blob)
+
+
+def num_records(rec_path):
+    """Count the items by skipping over the records, without unpickling any."""
+    N = 0
+    with open(rec_path, 'rb') as fh:
+        _check_magic(fh, rec_path)
+        while True:
+            header = fh.read(LENGTH.size)
+            if not header:
+                break
+            n, = LENGTH.unpack(header)
+            fh.seek(n, os.SEEK_CUR)
+            N += 1
+    return N
+
+
+def list_records(head):
+    """The sorted `.rec` files in `head`, same order as the original pickles."""
+    return sorted([join(head,x) for x in os.listdir(head) if x[-4:] == SUFFIX])
+
+
+def fold_id(rec_path, default):
+    """The `k` in a `..._cv_k_...` file name, else `default`."""
+    match = re.search(r'cv_(\d+)', os.path.basename(rec_path))
+    return int(match.group(1)) if match else default
+
+
+def load_shared(record_files, label_fn):
+    """Decode all frames once into tensors in shared memory, for `kfold_runner.py`.
+
+    Returns (frames, labels, folds): frames is a (N,480,640) uint8 tensor of the
+    depth images (all three channels are the same, so we keep just one), labels
+    is a (N,L) float64 tensor from `label_fn(item)`, and folds is a (N,) long
+    tensor of fold indices from the file names. Processes that get these tensors
+    through `torch.multiprocessing` map the same memory rather than copying.
+    """
+    import numpy as np
+    import torch
+    sizes = [num_records(x) for x in record_files]
+    N = sum(sizes)
+    frames = torch.empty((N,480,640), dtype=torch.uint8).share_memory_()
+    labels = None
+    folds  = torch.empty((N,), dtype=torch.long).share_memory_()
+
+    i = 0
+    for p_idx,p_ff in enumerate(record_files):
+        k = fold_id(p_ff, default=p_idx)
+        for item in iter_records(p_ff):
+            d_img = item['d_img']
+            assert d_img.shape == (480,640,3)
+            frames[i] = torch.from_numpy(np.ascontiguousarray(d_img[:,:,0]))
+            label = torch.tensor(label_fn(item), dtype=torch.float64)
+            if labels is None:
+                labels = torch.empty((N,label.numel()), dtype=torch.float64).share_memory_()
+            labels[i] = label
+            folds[i] = k
+            i += 1
+        print("decoded: {}  (fold {}, total so far {})".format(p_ff, k, i))
+    assert i == N
+    return frames, labels, folds
+
+
+class RunningStats(object):
+    """Mean and std of pixel values, without keeping all the pixels around.
+
+    The prepare scripts used to `extend` a list with every pixel, which is far
+    bigger than the images themselves. Sums in float64 are exact enough here.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, values):
+        values = values.astype('float64')
+        self.n += values.size
+        self.total += values.sum()
+        self.total_sq += (values ** 2).sum()
+
+    def mean(self, scale=1.0):
+        return (self.total / self.n) / scale
+
+    def std(self, scale=1.0):
+        var = self.total_sq / self.n - (self.total / self.n) ** 2
+        return (max(var, 0.0) ** 0.5) / scale
+
+
+if __name__ == "__main__":
+    # e.g., python cache_records.py  /nfs/.../cache_combo_v03  /nfs/.../cache_combo_v03_rec
+    convert_dir(sys.argv[1], sys.argv[2])
@@ -12,7 +12,13 @@ import torch.optim as optim
 import torchvision
 import torchvision.transforms as transforms
 torch.set_printoptions(linewidth=180) # :-)
-import sys
+import argparse, sys, time
+from classifier_eval import evaluate, print_results
+from tensor_loader import TensorLoader, normalized_tensors, CIFAR_MEAN, CIFAR_STD
+import cpu_ddp
+
+CLASSES = ('plane', 'car', 'bird', 'cat', 'deer',
+           'dog', 'frog', 'horse', 'ship', 'truck')
 
 
 class Net(nn.Module):
@@ -37,46 +43,16 @@ class Net(nn.Module):
         return x
 
 
-if __name__ == "__main__":
-    # If we set net to this device, we need data on the device as well
-    # It will give a warning if `cuda:k` does not exist on the machine.
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    print("our device: {}\n".format(device))
-
-    # Loading data, looks like have `set` and `loader` for both train/test.
-    transform = transforms.Compose(
-        [transforms.ToTensor(),
-         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
-    
-    trainset = torchvision.datasets.CIFAR10(root='./data', train=True,
-                                            download=True, transform=transform)
-    trainloader = torch.utils.data.DataLoader(trainset, batch_size=4,
-                                              shuffle=True, num_workers=2)
-    testset = torchvision.datasets.CIFAR10(root='./data', train=False,
-                                           download=True, transform=transform)
-    testloader = torch.utils.data.DataLoader(testset, batch_size=4,
-                                             shuffle=False, num_workers=2)
-    classes = ('plane', 'car', 'bird', 'cat', 'deer',
-               'dog', 'frog', 'horse', 'ship', 'truck')
-
-    net = Net()
-    net.to(device)
-    print("\nour net:\n{}\n".format(net))
-
-    # Huh, these all have requires_grad = False
-    for k,v in net.state_dict().items():
-        print(k, v.size(), v.requires_grad)
-    # AH, it must be the `parameters()` and how that differs from the state dict
-    # and items. These are True. :-)
-    for p in net.parameters():
-        print(p.size(), p.requires_grad)
-
+def train(net, trainloader, device, epochs=4):
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
 
     # loop over the dataset multiple times (use trainloader for convenience)
-    for epoch in range(4):  
+    start = time.time()
+    for epoch in range(epochs):
         running_loss = 0.0
+        if hasattr(trainloader, 'sampler') and hasattr(trainloader.sampler, 'set_epoch'):
+            trainloader.sampler.set_epoch(epoch)    # with `--ranks`, see below
 
         for i, data in enumerate(trainloader):
             # assuming we kept batch_size=4 obviously
@@ -95,40 +71,103 @@ if __name__ == "__main__":
     
             # print statistics
             running_loss += loss.item()
-            if i % 2000 == 1999:    # print every 2000 mini-batches
+            if i % 2000 == 1999 and cpu_ddp.is_main():    # print every 2000 mini-batches
                 print('[%d, %5d] loss: %.3f' % (epoch + 1, i + 1, running_loss / 2000))
                 running_loss = 0.0
-    print('Finished Training')
-
-    # Check on test data, note the `torch.no_grad()` ...
-    correct = 0
-    total = 0
-    with torch.no_grad():
-        for data in testloader:
-            images, labels = data
-            images, labels = images.to(device), labels.to(device)
-            outputs = net(images)
-            _, predicted = torch.max(outputs.data, 1)
-            total += labels.size(0)
-            correct += (predicted == labels).sum().item()
-    
-    print('\nAccuracy of the network on the 10000 test images: %d %%\n' % (
-        100 * correct / total))
-    # analyze per class performance
-    class_correct = list(0. for i in range(10))
-    class_total = list(0. for i in range(10))
-
-    with torch.no_grad():
-        for data in testloader:
-            images, labels = data
-            images, labels = images.to(device), labels.to(device)
-            outputs = net(images)
-            _, predicted = torch.max(outputs, 1)
-            c = (predicted == labels).squeeze()
-            for i in range(4):
-                label = labels[i]
-                class_correct[label] += c[i].item()
-                class_total[label] += 1
-
-    for i in range(10):
-        print('Accuracy of %5s : %2d %%' % (classes[i], 100*class_correct[i] / class_total[i]))
+    elapsed = time.time() - start
+    if cpu_ddp.is_main():
+        print('Finished Training, {:.3f} epochs/sec'.format(epochs / elapsed))
+
+
+def test(net, testloader, device):
+    # Check on test data: one `torch.no_grad()` pass gives the overall and the
+    # per-class accuracy (from the confusion matrix), see `classifier_eval.py`.
+    # With `--ranks`, it sums over the ranks' shards.
+    results = evaluate(net, testloader, device, topk=(1,5))
+    if not cpu_ddp.is_main():
+        return
+    print('\nAccuracy of the network on the %d test images: %d %%\n' % (
+        results['count'], 100 * results['accuracy']))
+    print_results(results, CLASSES)
+
+
+def ddp_main(rank, world_size, args):
+    """ One of the `--ranks` processes, see `cpu_ddp.py`. CPU only. Each rank
+    gets `batch_size / ranks` examples per minibatch from its shard, so the
+    effective batch size matches a single process. """
+    device = torch.device("cpu")
+    trainset = torchvision.datasets.CIFAR10(root='./data', train=True)
+    testset = torchvision.datasets.CIFAR10(root='./data', train=False)
+    trainset = torch.utils.data.TensorDataset(*normalized_tensors(trainset, CIFAR_MEAN, CIFAR_STD))
+    testset = torch.utils.data.TensorDataset(*normalized_tensors(testset, CIFAR_MEAN, CIFAR_STD))
+    trainloader = cpu_ddp.distributed_loader(trainset, max(1, args.batch_size // world_size))
+    testloader = cpu_ddp.distributed_loader(testset, max(args.batch_size, 1000), shuffle=False)
+    torch.manual_seed(0)
+    net = nn.parallel.DistributedDataParallel(Net())
+    train(net, trainloader, device)
+    test(net, testloader, device)
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--batch_size', type=int, default=4)
+    # Normalize CIFAR-10 once and keep it on the device, see `tensor_loader.py`,
+    # optionally with (batched) random crops and flips for training.
+    pp.add_argument('--tensor_loader', action='store_true', default=False)
+    pp.add_argument('--augment', action='store_true', default=False)
+    # Data-parallel over this many CPU processes, see `cpu_ddp.py`.
+    pp.add_argument('--ranks', type=int, default=1)
+    pp.add_argument('--threads_per_rank', type=int, default=None)
+    args = pp.parse_args()
+    if args.ranks > 1:
+        # Download once here, so the ranks don't race to do it.
+        torchvision.datasets.CIFAR10(root='./data', train=True, download=True)
+        torchvision.datasets.CIFAR10(root='./data', train=False, download=True)
+        cpu_ddp.launch(ddp_main, args.ranks, args=(args,), threads=args.threads_per_rank)
+        sys.exit()
+
+    # If we set net to this device, we need data on the device as well
+    # It will give a warning if `cuda:k` does not exist on the machine.
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    print("our device: {}\n".format(device))
+
+    # Loading data, looks like have `set` and `loader` for both train/test.
+    if args.tensor_loader:
+        trainset = torchvision.datasets.CIFAR10(root='./data', train=True, download=True)
+        testset = torchvision.datasets.CIFAR10(root='./data', train=False, download=True)
+        aug = {'crop_padding': 4, 'flip': True, 'mean': CIFAR_MEAN, 'std': CIFAR_STD} \
+                if args.augment else {}
+        trainloader = TensorLoader(*normalized_tensors(trainset, CIFAR_MEAN, CIFAR_STD, device),
+                                   batch_size=args.batch_size, shuffle=True, **aug)
+        testloader = TensorLoader(*normalized_tensors(testset, CIFAR_MEAN, CIFAR_STD, device),
+                                  batch_size=max(args.batch_size, 1000))
+    else:
+        augment = [transforms.RandomCrop(32, padding=4),
+                   transforms.RandomHorizontalFlip()] if args.augment else []
+        transform = transforms.Compose(
+            [transforms.ToTensor(),
+             transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+
+        trainset = torchvision.datasets.CIFAR10(root='./data', train=True, download=True,
+                                                transform=transforms.Compose(augment + [transform]))
+        trainloader = torch.utils.data.DataLoader(trainset, batch_size=args.batch_size,
+                                                  shuffle=True, num_workers=2)
+        testset = torchvision.datasets.CIFAR10(root='./data', train=False,
+                                               download=True, transform=transform)
+        testloader = torch.utils.data.DataLoader(testset, batch_size=args.batch_size,
+                                                 shuffle=False, num_workers=2)
+
+    net = Net()
+    net.to(device)
+    print("\nour net:\n{}\n".format(net))
+
+    # Huh, these all have requires_grad = False
+    for k,v in net.state_dict().items():
+        print(k, v.size(), v.requires_grad)
+    # AH, it must be the `parameters()` and how that differs from the state dict
+    # and items. These are True. :-)
+    for p in net.parameters():
+        print(p.size(), p.requires_grad)
+
+    train(net, trainloader, device)
+    test(net, testloader, device)
@@ -0,0 +1,118 @@
+""" Evaluation of a classifier in one pass, from a confusion matrix.
+
+Our scripts each count accuracy their own way: `cifar10.py` does a SECOND pass
+over the test set for per-class accuracy, with a Python loop and an `.item()`
+per sample, and the ResNet scripts call `loss.item()` every minibatch. Each
+`.item()` waits for the GPU. Here we keep everything on the device: the
+confusion matrix is one `bincount` per minibatch, the summed loss and top-k
+counts are tensors, and we only copy to the CPU once at the end:
+
+    results = evaluate(model, test_loader, device, topk=(1,5))
+    print_results(results, class_names)
+
+or, inside an existing loop (e.g., the training phase),
+
+    meter = ConfusionMatrix(num_classes=2, device=device)
+    meter.update(outputs.detach(), labels, loss.detach() * inputs.size(0))
+    results = meter.results()
+
+`results` has `loss` (mean per sample), `accuracy`, `top{k}` for each k,
+`per_class` accuracies, `count`, and the (C,C) `confusion` matrix, where rows
+are true labels and columns predictions. From another directory, add this one
+to `sys.path` first, relative to the script, e.g.,
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+"""
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+
+
+def cross_entropy_sum(outputs, targets):
+    return F.cross_entropy(outputs, targets, reduction='sum')
+
+
+def nll_sum(outputs, targets):
+    """ For networks that end in `log_softmax`, like `mnist.py`. """
+    return F.nll_loss(outputs, targets, reduction='sum')
+
+
+class ConfusionMatrix(object):
+
+    def __init__(self, num_classes, device=None, topk=(1,)):
+        self.num_classes = num_classes
+        self.topk = [k for k in topk if k <= num_classes]
+        self.matrix = torch.zeros(num_classes * num_classes, dtype=torch.long, device=device)
+        self.correct = {k: torch.zeros((), dtype=torch.long, device=device) for k in self.topk}
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+        self.count = 0
+
+    def update(self, outputs, targets, loss_sum=None):
+        """ `outputs` are (N,C) scores, `targets` are (N,) labels, and
+        `loss_sum` is the SUMMED loss over the minibatch, as a tensor. """
+        C = self.num_classes
+        preds = outputs.argmax(dim=1)
+        self.matrix += torch.bincount(targets * C + preds, minlength=C * C)
+        if self.topk:
+            top = outputs.topk(max(self.topk), dim=1)[1]
+            hits = top == targets.view(-1, 1)
+            for k in self.topk:
+                self.correct[k] += hits[:, :k].sum()
+        if loss_sum is not None:
+            self.loss_sum += loss_sum.double()
+        self.count += targets.size(0)
+
+    def all_reduce(self):
+        """ Sum the counts over all ranks, when training with `cpu_ddp.py`. """
+        for t in [self.matrix, self.loss_sum] + [self.correct[k] for k in self.topk]:
+            dist.all_reduce(t, op=dist.ReduceOp.SUM)
+        count = torch.tensor([self.count], dtype=torch.long, device=self.matrix.device)
+        dist.all_reduce(count, op=dist.ReduceOp.SUM)
+        self.count = int(count.item())
+
+    def results(self):
+        """ The only place we copy to the CPU. """
+        matrix = self.matrix.view(self.num_classes, self.num_classes).cpu()
+        count = max(self.count, 1)
+        per_class = matrix.diag().double() / matrix.sum(dim=1).clamp(min=1).double()
+        results = {
+            'loss': self.loss_sum.item() / count,
+            'accuracy': matrix.diag().sum().item() / float(count),
+            'per_class': per_class.tolist(),
+            'count': self.count,
+            'confusion': matrix,
+        }
+        for k in self.topk:
+            results['top{}'.format(k)] = self.correct[k].item() / float(count)
+        return results
+
+
+def evaluate(model, loader, device, num_classes=None, loss_fn=cross_entropy_sum, topk=(1,)):
+    """ One `no_grad` pass over `loader`, in `model.eval()` mode. If not
+    given, `num_classes` is the width of the first minibatch of outputs. When
+    running distributed, each rank evaluates its shard and we sum over ranks,
+    so every rank gets the results for the whole data set. """
+    model.eval()
+    meter = None
+    with torch.no_grad():
+        for inputs, targets in loader:
+            inputs, targets = inputs.to(device), targets.to(device)
+            outputs = model(inputs)
+            if meter is None:
+                meter = ConfusionMatrix(num_classes or outputs.size(1), device=device, topk=topk)
+            meter.update(outputs, targets, loss_fn(outputs, targets))
+    assert meter is not None, "empty loader"
+    if dist.is_available() and dist.is_initialized():
+        meter.all_reduce()
+    return meter.results()
+
+
+def print_results(results, class_names=None):
+    top = ', '.join('{}: {:.4f}'.format(k, v) for k,v in sorted(results.items())
+                    if k.startswith('top'))
+    print('Loss: {:.4f}, Acc: {:.4f} ({}/{}){}'.format(results['loss'], results['accuracy'],
+            int(results['confusion'].diag().sum()), results['count'],
+            ', ' + top if top else ''))
+    for i,acc in enumerate(results['per_class']):
+        name = class_names[i] if class_names is not None else i
+        print('  accuracy of {:>6} : {:.4f}'.format(name, acc))
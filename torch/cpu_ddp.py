@@ -0,0 +1,153 @@
+""" Data-parallel training on CPUs: N processes, `DistributedDataParallel`, gloo.
+
+Our big hosts have lots of cores and no GPUs, and one PyTorch process doesn't
+use 40 cores well for small convnets (intra-op threading runs out of work).
+Instead, start N worker processes ("ranks"), each with its own share of the
+cores, its own shard of every epoch (`DistributedSampler`) and its own copy of
+the model. `DistributedDataParallel` averages the gradients with an allreduce
+over the gloo backend, so all ranks take the same optimizer step.
+
+    def worker(rank, world_size, args):
+        loader = distributed_loader(train_set, args.batch_size // world_size)
+        model = DistributedDataParallel(Net())
+        for epoch in range(args.epochs):
+            loader.sampler.set_epoch(epoch)     # new shuffle every epoch
+            ...
+    launch(worker, world_size=4, args=(args,))
+
+`worker` must be a module-level function (it gets pickled). Sum metrics over
+ranks with `all_reduce_sum`, or use `classifier_eval.evaluate`, which does it
+for us. Only print from rank 0, see `is_main`. Note that `DistributedSampler`
+pads each shard to the same size by repeating a few examples, so aggregated
+evaluation counts can be a bit more than the data set size. To measure how
+training throughput scales with the number of ranks:
+
+    python cpu_ddp.py --ranks 1,2,4,8 --net mnist
+"""
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data.distributed import DistributedSampler
+import argparse, json, os, tempfile, time
+
+
+def threads_per_rank(world_size):
+    """ Split the cores evenly, at least one thread each. """
+    return max(1, (os.cpu_count() or 1) // world_size)
+
+
+def _run(rank, world_size, threads, worker, args):
+    torch.set_num_threads(threads)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        worker(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(worker, world_size, args=(), threads=None, port=29500):
+    """ Run `worker(rank, world_size, *args)` in `world_size` processes on this
+    host, each limited to `threads` intra-op threads. Blocks until all exit,
+    and raises if any of them failed. """
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ['MASTER_PORT'] = str(port)
+    threads = threads or threads_per_rank(world_size)
+    mp.spawn(_run, args=(world_size, threads, worker, args), nprocs=world_size, join=True)
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main():
+    """ True on rank 0, and when not running distributed at all. """
+    return not is_distributed() or dist.get_rank() == 0
+
+
+def distributed_loader(dataset, batch_size, shuffle=True, **kwargs):
+    """ A `DataLoader` over this rank's shard. Call `loader.sampler.set_epoch`
+    every epoch, or every epoch has the same order. """
+    sampler = DistributedSampler(dataset, shuffle=shuffle)
+    return DataLoader(dataset, batch_size=batch_size, sampler=sampler, **kwargs)
+
+
+def all_reduce_sum(values):
+    """ Sum a list of numbers over all ranks; every rank gets the sums. """
+    if not is_distributed():
+        return list(values)
+    t = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
+
+
+# ------------------------------------------------------------------------------
+# Scaling benchmark, on synthetic data so it doesn't depend on any download.
+# ------------------------------------------------------------------------------
+
+def _bench_worker(rank, world_size, net, num_examples, batch_size, epochs, out_path):
+    from torch.nn.parallel import DistributedDataParallel
+    import torch.nn.functional as F
+    if net == 'mnist':
+        from mnist import Net
+        shape = (1, 28, 28)
+    else:
+        from cifar10 import Net
+        shape = (3, 32, 32)
+    torch.manual_seed(0)
+    data = TensorDataset(torch.randn((num_examples,) + shape),
+                         torch.randint(0, 10, (num_examples,)))
+    loader = distributed_loader(data, batch_size // world_size)
+    model = DistributedDataParallel(Net())
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+
+    def one_epoch(epoch):
+        loader.sampler.set_epoch(epoch)
+        for inputs, labels in loader:
+            optimizer.zero_grad()
+            # `mnist.Net` ends in log_softmax, `cifar10.Net` in logits; the
+            # cost is the same either way.
+            loss = F.cross_entropy(model(inputs), labels)
+            loss.backward()
+            optimizer.step()
+
+    one_epoch(-1)   # warm-up
+    dist.barrier()
+    start = time.time()
+    for epoch in range(epochs):
+        one_epoch(epoch)
+    dist.barrier()
+    if rank == 0:
+        with open(out_path, 'w') as f:
+            json.dump({'seconds': time.time() - start}, f)
+
+
+if __name__ == "__main__":
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--ranks', type=str, default='1,2,4,8')
+    pp.add_argument('--net', type=str, default='mnist', choices=['mnist', 'cifar10'])
+    pp.add_argument('--num_examples', type=int, default=8192)
+    # The GLOBAL batch size, split over the ranks, so every run does the same
+    # optimizer steps and only the parallelism changes.
+    pp.add_argument('--batch_size', type=int, default=64)
+    pp.add_argument('--epochs', type=int, default=2)
+    args = pp.parse_args()
+
+    print("{} net, {} examples, global batch {}, {} cores".format(
+            args.net, args.num_examples, args.batch_size, os.cpu_count()))
+    print("{:>5} {:>8} {:>10} {:>12} {:>8}".format(
+            'ranks', 'threads', 'seconds', 'examples/s', 'speedup'))
+    base = None
+    for i,world_size in enumerate([int(x) for x in args.ranks.split(',')]):
+        fd, out_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        # A new port each time, the last one may not be free yet.
+        launch(_bench_worker, world_size, args=(args.net, args.num_examples,
+               args.batch_size, args.epochs, out_path), port=29500 + i)
+        with open(out_path, 'r') as f:
+            seconds = json.load(f)['seconds']
+        os.remove(out_path)
+        rate = args.num_examples * args.epochs / seconds
+        base = base or rate
+        print("{:>5} {:>8} {:>10.2f} {:>12.1f} {:>7.2f}x".format(
+                world_size, threads_per_rank(world_size), seconds, rate, rate / base))
@@ -152,32 +152,51 @@ plt.show()
 ######################################################################
 
 class FaceLandmarksDataset(Dataset):
-    """Face Landmarks dataset."""
+    """Face Landmarks dataset.
+
+    Daniel: indexing the pandas frame with `iloc[idx, 1:].as_matrix()` for
+    every sample is really slow, especially in DataLoader workers. So we read
+    the CSV ONCE into a list of image paths and one contiguous float32 array of
+    landmarks, shape (N, 68, 2), and `__getitem__` just indexes those. With
+    `cache_images=True`, we also decode all images up front (the faces data is
+    small), so workers don't call `io.imread` every epoch. Workers get the cache
+    via fork, so treat cached images as read-only; our transforms don't modify
+    their inputs.
+    """
 
-    def __init__(self, csv_file, root_dir, transform=None):
+    def __init__(self, csv_file, root_dir, transform=None, cache_images=False):
         """
         Args:
             csv_file (string): Path to the csv file with annotations.
             root_dir (string): Directory with all the images.
             transform (callable, optional): Optional transform to be applied
                 on a sample.
+            cache_images (bool, optional): Decode all images in advance.
         """
-        self.landmarks_frame = pd.read_csv(csv_file)
+        landmarks_frame = pd.read_csv(csv_file)
         self.root_dir = root_dir
+        self.img_paths = [os.path.join(root_dir, name) for name in landmarks_frame.iloc[:, 0]]
+        landmarks = landmarks_frame.iloc[:, 1:].values.astype(np.float32)
+        self.landmarks = np.ascontiguousarray(landmarks.reshape(len(landmarks_frame), -1, 2))
+        self.images = None
+        if cache_images:
+            self.images = [io.imread(path) for path in self.img_paths]
         self.transform = transform
 
     def __len__(self):
-        return len(self.landmarks_frame)
+        return len(self.img_paths)
 
     def __getitem__(self, idx):
         """When we sample we read it from memory. We don't pre-load it so it is
         memory-efficient. But, probably slow ... but that's the trade-off!
+        (Unless we use `cache_images`.) Landmarks are copied, so changing a
+        sample never changes the dataset.
         """
-        img_name = os.path.join(self.root_dir,
-                                self.landmarks_frame.iloc[idx, 0])
-        image = io.imread(img_name)
-        landmarks = self.landmarks_frame.iloc[idx, 1:].as_matrix()
-        landmarks = landmarks.astype('float').reshape(-1, 2)
+        if self.images is not None:
+            image = self.images[idx]
+        else:
+            image = io.imread(self.img_paths[idx])
+        landmarks = self.landmarks[idx].copy()
         sample = {'image': image, 'landmarks': landmarks}
 
         if self.transform:
@@ -286,7 +305,7 @@ class Rescale(object):
 
         # h and w are swapped for landmarks because for images,
         # x and y axes are axis 1 and 0 respectively
-        landmarks = landmarks * [new_w / w, new_h / h]
+        landmarks = landmarks * np.array([new_w / w, new_h / h], dtype=landmarks.dtype)
 
         return {'image': img, 'landmarks': landmarks}
 
@@ -319,7 +338,7 @@ class RandomCrop(object):
         image = image[top: top + new_h,
                       left: left + new_w]
 
-        landmarks = landmarks - [left, top]
+        landmarks = landmarks - np.array([left, top], dtype=landmarks.dtype)
 
         return {'image': image, 'landmarks': landmarks}
 
@@ -402,25 +421,47 @@ plt.show()
 #
 # Here it is:
 
+# For the 68-point (dlib) landmarks, a mirrored face has its left and right
+# points swapped, e.g., the left eye corner becomes the right eye corner. This
+# is the index of each point's mirror image (the jaw, eyebrows, nose, eyes, then
+# outer and inner lips); points on the center line map to themselves.
+FLIP_68 = np.array(list(range(16, -1, -1)) + list(range(26, 16, -1)) +
+                   [27, 28, 29, 30, 35, 34, 33, 32, 31] +
+                   [45, 44, 43, 42, 47, 46, 39, 38, 37, 36, 41, 40] +
+                   [54, 53, 52, 51, 50, 49, 48, 59, 58, 57, 56, 55] +
+                   [64, 63, 62, 61, 60, 67, 66, 65])
+
+
 class HorizontalFlip(object):
+    """Flip the image left-right, with probability `ratio`.
+
+    The landmarks get mirrored too, x -> (w - 1) - x, and for 68 points also
+    reordered with FLIP_68 so each index still means the same part of the face.
+    """
 
     def __init__(self, ratio=0.5):
-        self.ratio = 0.5 # flipping ratio
+        self.ratio = ratio # flipping ratio
 
     def __call__(self, sample):
         image, landmarks = sample['image'], sample['landmarks']
-        
-        # TODO If we do this we need to 'flip' the labels! I'm skipping for now because meh.
+
         # If we want a 'vertical' flip (the 'intuitive' meaning) then second arg is 0, not 1.
         if np.random.rand() < self.ratio:
+            w = image.shape[1]
             image = cv2.flip(image, 1)
+            landmarks = landmarks.copy()
+            landmarks[:, 0] = (w - 1) - landmarks[:, 0]
+            if len(landmarks) == len(FLIP_68):
+                landmarks = landmarks[FLIP_68]
 
         return {'image': image, 'landmarks': landmarks}
 
 
 
+# Daniel: this one goes to a DataLoader with 4 workers, so decode images once.
 transformed_dataset = FaceLandmarksDataset(csv_file='faces/face_landmarks.csv',
                                            root_dir='faces/',
+                                           cache_images=True,
                                            transform=transforms.Compose([
                                                Rescale(256),
                                                RandomCrop(224),
@@ -0,0 +1,136 @@
+"""K-fold cross validation over the shared decoded frames of a bed-making cache.
+
+The driver behind `bedmake_grasp/kfold.py` and `bedmake_transition/kfold.py`.
+All frames are decoded once into shared memory (`cache_records.load_shared`),
+then folds train concurrently in worker processes, each with its own thread
+budget, so we don't have 10 copies of the data or 10 processes fighting over
+every core. A project only supplies how to train one fold:
+
+    def train_fold(k, frames, labels, indices, device, args):
+        # indices['train'] and indices['valid'] index into frames and labels
+        ...
+        return stats    # a JSON-able dict, with `dataset_sizes` if you like
+
+    pp = argparse.ArgumentParser()
+    add_args(pp, report='kfold_grasp.json')
+    args = pp.parse_args()
+    frames, labels, folds = load_shared(list_records(HEAD_REC), label_fn)
+    all_stats = run_folds(train_fold, frames, labels, folds, args)
+    report(all_stats, args.report, ['best_loss', 'best_loss_pix'])
+
+`train_fold` must be a module-level function (it gets pickled). The workers
+are NOT daemonic, so each fold can use `DataLoader` workers (`--num_workers`).
+"""
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import Dataset
+from concurrent.futures import ProcessPoolExecutor
+import json, time
+import numpy as np
+
+# Set in each worker by `_init_worker`, so they don't get pickled per fold.
+_SHARED = {}
+
+
+class SharedFrames(Dataset):
+    """Indexes into the shared decoded frames. Subclasses implement `sample`,
+    from a (480,640,3) uint8 image (as in cv2) and its row of labels."""
+
+    def __init__(self, frames, labels, indices, transform=None):
+        self.frames = frames
+        self.labels = labels
+        self.indices = indices
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        i = int(self.indices[idx])
+        d_img = self.frames[i].numpy()
+        return self.sample(np.repeat(d_img[:,:,None], 3, axis=2), self.labels[i])
+
+    def sample(self, image, label):
+        raise NotImplementedError
+
+
+def add_args(pp, report):
+    """The command line options of every k-fold runner."""
+    pp.add_argument('--model', type=str, default='resnet18')
+    pp.add_argument('--optim', type=str, default='adam')
+    pp.add_argument('--num_epochs', type=int, default=20)
+    pp.add_argument('--num_procs', type=int, default=5)
+    # Default: split the cores evenly across the concurrent folds.
+    pp.add_argument('--num_threads', type=int, default=0)
+    # Loader workers per fold. The data is already decoded, so 0 is often fine.
+    pp.add_argument('--num_workers', type=int, default=0)
+    pp.add_argument('--folds', type=str, default='', help='e.g., 0,3,7 (default: all)')
+    pp.add_argument('--seed', type=int, default=0)
+    pp.add_argument('--report', type=str, default=report)
+
+
+def _init_worker(frames, labels, folds, num_threads):
+    torch.set_num_threads(num_threads)
+    _SHARED['frames'] = frames
+    _SHARED['labels'] = labels
+    _SHARED['folds']  = folds
+
+
+def _run_fold(train_fold, k, args):
+    """Train with fold `k` held out for validation. Returns the fold's stats."""
+    frames, labels, folds = _SHARED['frames'], _SHARED['labels'], _SHARED['folds']
+    np.random.seed(args.seed + k)
+    torch.manual_seed(args.seed + k)
+    indices = {'train': torch.nonzero(folds != k).view(-1),
+               'valid': torch.nonzero(folds == k).view(-1)}
+
+    # Spread folds over the GPUs, if we have them.
+    if torch.cuda.is_available():
+        device = torch.device("cuda:{}".format(k % torch.cuda.device_count()))
+    else:
+        device = torch.device("cpu")
+    print("fold {}: device {}, train {}, valid {}".format(
+            k, device, len(indices['train']), len(indices['valid'])))
+
+    since = time.time()
+    stats = train_fold(k, frames, labels, indices, device, args)
+    stats['fold'] = k
+    stats['seconds'] = time.time() - since
+    return stats
+
+
+def run_folds(train_fold, frames, labels, folds, args):
+    """Run `train_fold` for each of `args.folds` (default: all folds), at most
+    `args.num_procs` at a time. Returns the list of their stats."""
+    if args.num_threads <= 0:
+        args.num_threads = max(1, mp.cpu_count() // args.num_procs)
+    if args.folds:
+        fold_list = [int(x) for x in args.folds.split(',')]
+    else:
+        fold_list = sorted(set(folds.tolist()))
+    print("folds: {}, {} procs x {} threads".format(
+            fold_list, args.num_procs, args.num_threads))
+
+    # Spawn (not fork) so CUDA works; the shared tensors are passed by handle.
+    # Not `mp.Pool`: its workers are daemonic and can't start loader workers.
+    n = len(fold_list)
+    with ProcessPoolExecutor(max_workers=args.num_procs, mp_context=mp.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(frames, labels, folds, args.num_threads)) as pool:
+        return list(pool.map(_run_fold, [train_fold] * n, fold_list, [args] * n))
+
+
+def report(all_stats, path, keys):
+    """Print the per-fold `keys` and their mean/std, and save everything as JSON."""
+    all_stats = sorted(all_stats, key=lambda x: x['fold'])
+    print('\n{:>5} '.format('fold') + ' '.join('{:>13}'.format(k) for k in keys) +
+          ' {:>8}'.format('secs'))
+    for st in all_stats:
+        print('{:>5} '.format(st['fold']) + ' '.join('{:>13.4f}'.format(st[k]) for k in keys) +
+              ' {:>8.0f}'.format(st['seconds']))
+    for key in keys:
+        vals = np.array([st[key] for st in all_stats])
+        print('{}: {:.4f} +/- {:.4f}'.format(key, np.mean(vals), np.std(vals)))
+    with open(path, 'w') as fh:
+        json.dump(all_stats, fh, indent=2)
+    print('saved report: {}'.format(path))
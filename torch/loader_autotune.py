@@ -0,0 +1,151 @@
+""" Pick DataLoader settings for a dataset on this host, by timing them.
+
+Every script hardcodes `num_workers` and `batch_size=32`, which is rarely right
+for both a laptop and a 40-core Triton. Here we time a few hundred batches for
+each setting in a small grid and keep the one with the most samples/sec. The
+result is cached per (host, dataset, grid) in a JSON file, so later runs are
+free:
+
+    from loader_autotune import autotune
+    kwargs = autotune(gdata_t, name='grasp_train', batch_size=32)
+    loader = DataLoader(gdata_t, shuffle=True, **kwargs)
+
+The returned dict has `batch_size`, `num_workers`, `pin_memory`, and (if using
+workers) `prefetch_factor` and `persistent_workers`. From another directory,
+add this one to `sys.path` first, relative to the script, e.g.,
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'torch'))
+"""
+import torch
+from torch.utils.data import DataLoader, IterableDataset
+import argparse, hashlib, itertools, json, os, socket, sys, time
+
+CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'tf_practice', 'loader_autotune.json')
+
+
+def default_grid(batch_sizes=(32,)):
+    """Candidate settings. Pinned memory only matters if we copy to a GPU."""
+    ncpu = os.cpu_count() or 1
+    workers = sorted(set([0] + [w for w in [1, 2, 4, 8, 16, 32] if w <= ncpu]))
+    pins = [False, True] if torch.cuda.is_available() else [False]
+    grid = []
+    for bs, nw, pin in itertools.product(batch_sizes, workers, pins):
+        if nw == 0:
+            grid.append({'batch_size': bs, 'num_workers': 0, 'pin_memory': pin})
+            continue
+        for pf, pers in itertools.product([2, 4, 8], [False, True]):
+            grid.append({'batch_size': bs, 'num_workers': nw, 'pin_memory': pin,
+                         'prefetch_factor': pf, 'persistent_workers': pers})
+    return grid
+
+
+def _touch(batch, device):
+    """Move the batch to `device`, like a training loop would, then sync."""
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=True)
+    elif isinstance(batch, dict):
+        return {k: _touch(v, device) for k,v in batch.items()}
+    elif isinstance(batch, (list, tuple)):
+        return [_touch(v, device) for v in batch]
+    return batch
+
+
+def time_config(dataset, config, num_batches=200, num_epochs=2, collate_fn=None):
+    """Samples/sec for `config`, over `num_epochs` passes of `num_batches` each.
+
+    We use more than one pass so the cost of starting workers every epoch (what
+    `persistent_workers` avoids) shows up in the timing.
+    """
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    # `shuffle` is an error for an `IterableDataset`, which orders itself.
+    if not isinstance(dataset, IterableDataset):
+        config = dict(config, shuffle=True)
+    loader = DataLoader(dataset, drop_last=True, collate_fn=collate_fn, **config)
+    per_epoch = max(1, min(num_batches, len(loader)) // num_epochs)
+    samples = 0
+    start = time.time()
+    for _ in range(num_epochs):
+        for batch in itertools.islice(loader, per_epoch):
+            _touch(batch, device)
+            samples += config['batch_size']
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+    elapsed = time.time() - start
+    del loader
+    return samples / elapsed
+
+
+def _key(name, dataset, grid):
+    """Results depend on the settings we tried, so the batch sizes and a digest
+    of the whole grid are part of the key."""
+    batch_sizes = sorted(set(c['batch_size'] for c in grid))
+    digest = hashlib.sha1(json.dumps(grid, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    return '{}/{}/{}/bs{}/{}'.format(socket.gethostname(), name, len(dataset),
+                                     ','.join(str(b) for b in batch_sizes), digest)
+
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fh:
+        return json.load(fh)
+
+
+def autotune(dataset, name=None, batch_size=32, batch_sizes=None, grid=None,
+             num_batches=200, collate_fn=None, cache=CACHE, force=False, verbose=True):
+    """Return the fastest DataLoader kwargs for `dataset` on this host.
+
+    Use `batch_sizes` to also search over batch sizes (we compare samples/sec,
+    but remember a larger batch changes the optimization too). The cache key is
+    the host name, `name` (default: the dataset class name), the dataset
+    length, and the grid (so also the batch sizes). Pass `force=True` to
+    re-run, e.g., after changing transforms.
+    """
+    name = name or type(dataset).__name__
+    if grid is None:
+        grid = default_grid(batch_sizes or [batch_size])
+    key = _key(name, dataset, grid)
+    results = _load_cache(cache)
+    if key in results and not force:
+        if verbose:
+            print("autotune: cached result for {}: {}".format(key, results[key]['config']))
+        return dict(results[key]['config'])
+
+    timings = []
+    for config in grid:
+        rate = time_config(dataset, config, num_batches=num_batches, collate_fn=collate_fn)
+        timings.append((rate, config))
+        if verbose:
+            print("  {:8.1f} samples/sec  {}".format(rate, config))
+    best_rate, best = max(timings, key=lambda x: x[0])
+    if verbose:
+        print("autotune: best for {}: {} ({:.1f} samples/sec)".format(key, best, best_rate))
+
+    # Re-read in case another process wrote to the cache while we were timing.
+    results = _load_cache(cache)
+    results[key] = {'config': best, 'samples_per_sec': best_rate, 'time': time.time()}
+    if not os.path.exists(os.path.dirname(cache)):
+        os.makedirs(os.path.dirname(cache))
+    with open(cache, 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    return dict(best)
+
+
+if __name__ == "__main__":
+    # Example: tune the CIFAR-10 training set from `cifar10.py`.
+    import torchvision
+    import torchvision.transforms as transforms
+    pp = argparse.ArgumentParser()
+    pp.add_argument('--num_batches', type=int, default=200)
+    pp.add_argument('--batch_sizes', type=str, default='4,32,128')
+    pp.add_argument('--force', action='store_true', default=False)
+    args = pp.parse_args()
+
+    transform = transforms.Compose(
+        [transforms.ToTensor(),
+         transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+    trainset = torchvision.datasets.CIFAR10(root='./data', train=True,
+                                            download=True, transform=transform)
+    batch_sizes = [int(x) for x in args.batch_sizes.split(',')]
+    autotune(trainset, name='cifar10_train', batch_sizes=batch_sizes,
+             num_batches=args.num_batches, force=args.force)
@@ -16,7 +16,10 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torchvision import datasets, transforms
 from torch.autograd import Variable
-import sys
+import sys, time
+from classifier_eval import evaluate, nll_sum
+from tensor_loader import TensorLoader, normalized_tensors, MNIST_MEAN, MNIST_STD
+import cpu_ddp
 
 
 class Net(nn.Module):
@@ -110,7 +113,7 @@ def train(epoch, train_loader, model, optimizer):
         loss.backward()
         optimizer.step()
 
-        if batch_idx % args.log_interval == 0:
+        if batch_idx % args.log_interval == 0 and cpu_ddp.is_main():
             print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
                 epoch, batch_idx * len(data), len(train_loader.dataset),
                 100. * batch_idx / len(train_loader), loss.item()))
@@ -126,27 +129,50 @@ def test(test_loader, model):
     We use `F.nll_loss(...)` in a slightly different way, without taking an
     average but just summing it. We save averaging for the end.
 
-    And note the use of `[...].data` to extract the contents of a Variable.
-    EDIT: use `item()`:
-        https://discuss.pytorch.org/t/confused-about-loss-data-0/1572
+    Now done by `classifier_eval.evaluate`, one no-grad pass that keeps the
+    loss and a confusion matrix on the device (no `.item()` per minibatch), so
+    we also get per-class accuracy for free.
     """
-    model.eval()
-    test_loss = 0
-    correct = 0
-    with torch.no_grad():
-        for data, target in test_loader:
-            if args.cuda:
-                data, target = data.cuda(), target.cuda()
-            data, target = Variable(data), Variable(target)
-            output = model(data)
-            test_loss += F.nll_loss(output, target, size_average=False).item() # sum up batch loss
-            pred = output.data.max(1, keepdim=True)[1] # get the index of the max log-probability
-            correct += pred.eq(target.data.view_as(pred)).cpu().sum()
-
-    test_loss /= len(test_loader.dataset)
-    print('\nTest set: Average loss: {:.4f}, Accuracy: {}/{} ({:.0f}%)\n'.format(
-            test_loss, correct, len(test_loader.dataset),
-            100. * correct / len(test_loader.dataset)))
+    device = torch.device('cuda' if args.cuda else 'cpu')
+    results = evaluate(model, test_loader, device, loss_fn=nll_sum)
+    if not cpu_ddp.is_main():
+        return
+    print('\nTest set: Average loss: {:.4f}, Accuracy: {}/{} ({:.0f}%)'.format(
+            results['loss'], int(results['confusion'].diag().sum()), results['count'],
+            100. * results['accuracy']))
+    print('Per-class accuracy: {}\n'.format(
+            ' '.join('{:.3f}'.format(a) for a in results['per_class'])))
+
+
+def ddp_main(rank, world_size, cli_args):
+    """ One of the `--ranks` processes, see `cpu_ddp.py`. CPU only.
+
+    Each rank trains on its shard of every epoch with `batch_size / ranks`
+    examples per minibatch, so the effective batch size (and hence `--lr`) is
+    the same as with one process. `DistributedDataParallel` broadcasts rank
+    0's initial weights and averages the gradients. The test metrics are
+    summed over ranks, then printed once.
+    """
+    global args
+    args = cli_args
+    torch.manual_seed(args.seed)
+    train_set = torch.utils.data.TensorDataset(*normalized_tensors(
+            datasets.MNIST('../data', train=True), MNIST_MEAN, MNIST_STD))
+    test_set = torch.utils.data.TensorDataset(*normalized_tensors(
+            datasets.MNIST('../data', train=False), MNIST_MEAN, MNIST_STD))
+    train_loader = cpu_ddp.distributed_loader(train_set, max(1, args.batch_size // world_size))
+    test_loader = cpu_ddp.distributed_loader(test_set, args.test_batch_size, shuffle=False)
+    model = nn.parallel.DistributedDataParallel(Net())
+    optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum)
+    start = time.time()
+    for epoch in range(1, args.epochs + 1):
+        train_loader.sampler.set_epoch(epoch)
+        train(epoch, train_loader, model, optimizer)
+    elapsed = time.time() - start
+    if cpu_ddp.is_main():
+        print('\nTrained {} epochs on {} ranks in {:.1f}s, {:.3f} epochs/sec'.format(
+                args.epochs, world_size, elapsed, args.epochs / elapsed))
+    test(test_loader, model)
 
 
 if __name__ == "__main__":
@@ -167,8 +193,21 @@ if __name__ == "__main__":
                         help='random seed (default: 1)')
     parser.add_argument('--log-interval', type=int, default=10, metavar='N',
                         help='how many batches to wait before logging training status')
+    parser.add_argument('--tensor-loader', action='store_true', default=False,
+                        help='normalize MNIST once and keep it on the device')
+    parser.add_argument('--ranks', type=int, default=1,
+                        help='data-parallel CPU processes, see cpu_ddp.py (default: 1)')
+    parser.add_argument('--threads-per-rank', type=int, default=None,
+                        help='intra-op threads for each rank (default: cores / ranks)')
     args = parser.parse_args()
     args.cuda = not args.no_cuda and torch.cuda.is_available()
+    if args.ranks > 1:
+        # Download once here, so the ranks don't race to do it.
+        datasets.MNIST('../data', train=True, download=True)
+        datasets.MNIST('../data', train=False, download=True)
+        args.cuda = False
+        cpu_ddp.launch(ddp_main, args.ranks, args=(args,), threads=args.threads_per_rank)
+        sys.exit()
     torch.manual_seed(args.seed)
     if args.cuda:
         torch.cuda.manual_seed(args.seed)
@@ -177,24 +216,34 @@ if __name__ == "__main__":
     kwargs = {'num_workers': 1, 'pin_memory': True} if args.cuda else {}
 
     # Load the MNIST data if necessary. There's also CIFAR, etc.
-    train_loader = torch.utils.data.DataLoader(
-        datasets.MNIST('../data',
-                       train=True,
-                       download=True,
-                       transform=transforms.Compose([
-                            transforms.ToTensor(),
-                            transforms.Normalize((0.1307,), (0.3081,))
-                       ])),
-        batch_size=args.batch_size, shuffle=True, **kwargs)
-
-    test_loader = torch.utils.data.DataLoader(
-        datasets.MNIST('../data',
-                       train=False,
-                       transform=transforms.Compose([
-                            transforms.ToTensor(),
-                            transforms.Normalize((0.1307,), (0.3081,))
-                       ])),
-        batch_size=args.test_batch_size, shuffle=True, **kwargs)
+    if args.tensor_loader:
+        # Same values, but normalized once and indexed, see `tensor_loader.py`.
+        device = torch.device('cuda' if args.cuda else 'cpu')
+        train_set = datasets.MNIST('../data', train=True, download=True)
+        test_set = datasets.MNIST('../data', train=False)
+        train_loader = TensorLoader(*normalized_tensors(train_set, MNIST_MEAN, MNIST_STD, device),
+                                    batch_size=args.batch_size, shuffle=True)
+        test_loader = TensorLoader(*normalized_tensors(test_set, MNIST_MEAN, MNIST_STD, device),
+                                   batch_size=args.test_batch_size)
+    else:
+        train_loader = torch.utils.data.DataLoader(
+            datasets.MNIST('../data',
+                           train=True,
+                           download=True,
+                           transform=transforms.Compose([
+                                transforms.ToTensor(),
+                                transforms.Normalize((0.1307,), (0.3081,))
+                           ])),
+            batch_size=args.batch_size, shuffle=True, **kwargs)
+
+        test_loader = torch.utils.data.DataLoader(
+            datasets.MNIST('../data',
+                           train=False,
+                           transform=transforms.Compose([
+                                transforms.ToTensor(),
+                                transforms.Normalize((0.1307,), (0.3081,))
+                           ])),
+            batch_size=args.test_batch_size, shuffle=True, **kwargs)
 
     # Form network and optimizer. And yes we need to keep doing `model.cuda()`.
     # Looks like in PyTorch, you form the model and then pass in the parameters.
@@ -205,6 +254,10 @@ if __name__ == "__main__":
     optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum)
 
     # Finally, training and testing.
+    start = time.time()
     for epoch in range(1, args.epochs + 1):
         train(epoch, train_loader, model, optimizer)
+    elapsed = time.time() - start
+    print('\nTrained {} epochs in {:.1f}s, {:.3f} epochs/sec'.format(
+            args.epochs, elapsed, args.epochs / elapsed))
     test(test_loader, model)
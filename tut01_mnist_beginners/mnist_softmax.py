@@ -26,8 +26,12 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import os
 import sys
-from tensorflow.examples.tutorials.mnist import input_data
+# Memory-mapped `.npy` copy of MNIST, converted once; see `mnist_cache.py`.
+# Relative to this file, not the working directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mnist_testing'))
+import mnist_cache
 import tensorflow as tf
 
 FLAGS = None
@@ -49,7 +53,7 @@ def main(_):
     The contrib.learn python is supposed to be a non-supported branch designed
     to ease people into TF.
     """
-    mnist = input_data.read_data_sets(FLAGS.data_dir, one_hot=True)
+    mnist = mnist_cache.read_data_sets(FLAGS.data_dir, one_hot=True)
     x = tf.placeholder(tf.float32, [None, 784])
     W = tf.Variable(tf.zeros([784, 10]))
     b = tf.Variable(tf.zeros([10]))
@@ -18,8 +18,12 @@ could have taken a hour for all 20k iterations.
 from __future__ import print_function
 import tensorflow as tf
 import argparse
+import os
 import sys
-from tensorflow.examples.tutorials.mnist import input_data
+# Memory-mapped `.npy` copy of MNIST, converted once; see `mnist_cache.py`.
+# Relative to this file, not the working directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mnist_testing'))
+import mnist_cache
 import numpy as np
 FLAGS = None
 
@@ -82,7 +86,7 @@ if __name__ == "__main__":
                         default='/tmp/tensorflow/mnist/input_data',
                         help='Directory for storing input data')
     FLAGS, unparsed = parser.parse_known_args()
-    mnist = input_data.read_data_sets(FLAGS.data_dir, one_hot=True)
+    mnist = mnist_cache.read_data_sets(FLAGS.data_dir, one_hot=True)
     x = tf.placeholder(tf.float32, [None, 784])
     y_ = tf.placeholder(tf.float32, [None, 10])
 
@@ -27,9 +27,14 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import os
 import sys
 
-from tensorflow.examples.tutorials.mnist import input_data
+# Memory-mapped `.npy` copy of MNIST, converted once; see `mnist_cache.py`.
+# Relative to this file, not the working directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mnist_testing'))
+import mnist_cache
+from graph_batches import GraphBatches
 
 import tensorflow as tf
 
@@ -116,13 +121,17 @@ def bias_variable(shape):
 
 def main(_):
   # Import data
-  mnist = input_data.read_data_sets(FLAGS.data_dir, one_hot=True)
-
-  # Create the model
-  x = tf.placeholder(tf.float32, [None, 784])
-
-  # Define loss and optimizer
-  y_ = tf.placeholder(tf.float32, [None, 10])
+  mnist = mnist_cache.read_data_sets(FLAGS.data_dir, one_hot=True)
+
+  # Create the model, and define loss and optimizer. With --graph_batches,
+  # the training minibatches come from the graph unless we feed x and y_.
+  if FLAGS.graph_batches:
+    batches = GraphBatches(mnist.train.images, mnist.train.labels, 50)
+    x = tf.placeholder_with_default(batches.images, [None, 784])
+    y_ = tf.placeholder_with_default(batches.labels, [None, 10])
+  else:
+    x = tf.placeholder(tf.float32, [None, 784])
+    y_ = tf.placeholder(tf.float32, [None, 10])
 
   # Build the graph for the deep net
   y_conv, keep_prob = deepnn(x)
@@ -130,18 +139,27 @@ def main(_):
   cross_entropy = tf.reduce_mean(
       tf.nn.softmax_cross_entropy_with_logits(labels=y_, logits=y_conv))
   train_step = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy)
+  if FLAGS.graph_batches:
+    train_step = batches.advance_after(train_step)
   correct_prediction = tf.equal(tf.argmax(y_conv, 1), tf.argmax(y_, 1))
   accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
 
   with tf.Session() as sess:
     sess.run(tf.global_variables_initializer())
+    if FLAGS.graph_batches:
+      batches.initialize(sess)
     for i in range(20000):
-      batch = mnist.train.next_batch(50)
+      # Without feeds for x and y_, both runs see the same (current) batch.
+      feed = {}
+      if not FLAGS.graph_batches:
+        batch = mnist.train.next_batch(50)
+        feed = {x: batch[0], y_: batch[1]}
       if i % 100 == 0:
-        train_accuracy = accuracy.eval(feed_dict={
-            x: batch[0], y_: batch[1], keep_prob: 1.0})
+        feed[keep_prob] = 1.0
+        train_accuracy = accuracy.eval(feed_dict=feed)
         print('step %d, training accuracy %g' % (i, train_accuracy))
-      train_step.run(feed_dict={x: batch[0], y_: batch[1], keep_prob: 0.5})
+      feed[keep_prob] = 0.5
+      train_step.run(feed_dict=feed)
 
     print('test accuracy %g' % accuracy.eval(feed_dict={
         x: mnist.test.images, y_: mnist.test.labels, keep_prob: 1.0}))
@@ -151,5 +169,7 @@ if __name__ == '__main__':
   parser.add_argument('--data_dir', type=str,
                       default='/tmp/tensorflow/mnist/input_data',
                       help='Directory for storing input data')
+  parser.add_argument('--graph_batches', action='store_true',
+                      help='Keep training data in the graph, no per-step feeds')
   FLAGS, unparsed = parser.parse_known_args()
   tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
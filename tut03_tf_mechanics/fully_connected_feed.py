@@ -25,7 +25,10 @@ import sys
 import time
 from six.moves import xrange
 import tensorflow as tf
-from tensorflow.examples.tutorials.mnist import input_data
+# Memory-mapped `.npy` copy of MNIST, converted once; see `mnist_cache.py`.
+# Relative to this file, not the working directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mnist_testing'))
+import mnist_cache
 from tensorflow.examples.tutorials.mnist import mnist
 
 FLAGS = None
@@ -58,7 +61,7 @@ def run_training():
     is FC stuff so the shapes are fairly easy to reason about. Once we have the
     graph built, we can train by looping here.
     """
-    data_sets = input_data.read_data_sets(FLAGS.input_data_dir, FLAGS.fake_data)
+    data_sets = mnist_cache.read_data_sets(FLAGS.input_data_dir, FLAGS.fake_data)
 
     with tf.Graph().as_default():
         # The tutorial puts this in another method but it's only two lines. This